@@ -0,0 +1,297 @@
+import argparse
+import io
+import itertools
+import random
+import time
+from fontTools.misc.xmlReader import XMLReader
+from fontTools.misc.xmlWriter import XMLWriter
+from fontTools.ttLib import TTFont, newTable, registerCustomTableClass
+
+registerCustomTableClass("VarC", "rcjktools.table_VarC", "table_VarC")
+
+from .synthVarC import buildSyntheticVarCFont  # noqa: E402
+from .table_VarC import (  # noqa: E402
+    VarCXMLReader,
+    compileVarIdxs,
+    decompileVarIdxs,
+    packVarIdxs,
+    unpackVarIdxs,
+)
+
+
+def checkRoundTrip(ttFont):
+    """Check that the VarC table of ttFont survives a compile/decompile and a
+    toXML/fromXML round trip unchanged, with the plain and the streaming XML
+    reader. Raise an AssertionError if it doesn't.
+    """
+    varcTable = ttFont["VarC"]
+    glyphData = dict(varcTable.GlyphData)
+    data = varcTable.compile(ttFont)
+
+    decompiledTable = newTable("VarC")
+    decompiledTable.decompile(data, ttFont)
+    assert dict(decompiledTable.GlyphData) == glyphData, "decompile mismatch"
+    assert decompiledTable.compile(ttFont) == data, "recompile mismatch"
+
+    xmlData = dumpVarCXML(decompiledTable, ttFont)
+    try:
+        for readerClass in [XMLReader, VarCXMLReader]:
+            xmlTable = readVarCXML(xmlData, ttFont, readerClass)
+            assert xmlTable.GlyphData == glyphData, f"{readerClass.__name__} mismatch"
+            assert xmlTable.compile(ttFont) == data, "XML recompile mismatch"
+    finally:
+        ttFont["VarC"] = varcTable
+
+
+def checkVarIdxsRoundTrip(rnd, numArrays=1000):
+    """Check compileVarIdxs/decompileVarIdxs and packVarIdxs/unpackVarIdxs on
+    random varIdx arrays of all entry sizes.
+    """
+    from fontTools.ttLib.tables.otConverters import OTTableReader, OTTableWriter
+
+    for _ in range(numArrays):
+        maxOuter = rnd.choice([0, 1, 0xFF, 0xFFFF])
+        maxInner = rnd.choice([1, 0xFF, 0xFFF, 0xFFFF])
+        varIdxs = [
+            (rnd.randint(0, maxOuter) << 16) | rnd.randint(0, maxInner)
+            for _ in range(rnd.randint(0, 20))
+        ]
+        data = packVarIdxs(varIdxs)
+        assert unpackVarIdxs(data, 0, len(varIdxs)) == (varIdxs, len(data))
+        writer = OTTableWriter()
+        compileVarIdxs(writer, varIdxs)
+        assert writer.getAllData() == data
+        reader = OTTableReader(b"\0" + data, offset=1)
+        assert decompileVarIdxs(reader, len(varIdxs)) == varIdxs
+        assert reader.pos == len(data) + 1
+
+
+def runChecks(numGlyphs=300, seed=0, log=print):
+    """Run the round trip checks on synthetic fonts for a matrix of settings."""
+    checkVarIdxsRoundTrip(random.Random(seed))
+    log("varIdxs: OK")
+    for numAxes, varIdxEntrySize, transformVariationProbability in itertools.product(
+        [8, 300], [1, 2, 3, 4], [0, 0.5, 1]
+    ):
+        settings = dict(
+            numAxes=numAxes,
+            varIdxEntrySize=varIdxEntrySize,
+            transformVariationProbability=transformVariationProbability,
+        )
+        ttFont = _reloadFont(buildSyntheticVarCFont(numGlyphs, seed=seed, **settings))
+        checkRoundTrip(ttFont)
+        log(f"{settings}: OK")
+
+
+def dumpVarCXML(varcTable, ttFont):
+    f = io.BytesIO()
+    writer = XMLWriter(f)
+    writer.begintag("ttFont")
+    writer.newline()
+    writer.begintag("VarC")
+    writer.newline()
+    varcTable.toXML(writer, ttFont)
+    writer.endtag("VarC")
+    writer.newline()
+    writer.endtag("ttFont")
+    writer.newline()
+    return f.getvalue()
+
+
+def readVarCXML(xmlData, ttFont, readerClass=VarCXMLReader):
+    reader = readerClass(io.BytesIO(xmlData), ttFont)
+    reader.read()
+    return ttFont["VarC"]
+
+
+def benchmark(ttFont, repeat=3, log=print):
+    """Time VarC compile, decompile, decompile to CompactVarCGlyphs, toXML and
+    fromXML for ttFont, and log the throughput in glyphs per second and MB per
+    second.
+    """
+    from .compactVarC import CompactVarCGlyphs
+
+    varcTable = ttFont["VarC"]
+    glyphData = varcTable.GlyphData
+    numGlyphs = len(glyphData)
+    numComponents = sum(len(glyphData[glyphName]) for glyphName in glyphData)
+    data = varcTable.compile(ttFont)
+    # Dumping XML expands the glyf glyphs, CompactVarCGlyphs.unpackAll() needs
+    # them as read from disk
+    compactFont = _reloadFont(ttFont)
+    xmlData = dumpVarCXML(varcTable, ttFont)
+    log(
+        f"{numGlyphs} glyphs, {numComponents} components, "
+        f"{len(data)} bytes binary, {len(xmlData)} bytes XML"
+    )
+
+    def decompile():
+        table = newTable("VarC")
+        table.decompile(data, ttFont)
+        for glyphName in table.GlyphData:
+            table.GlyphData[glyphName]
+
+    def decompileCompact():
+        table = newTable("VarC")
+        table.decompile(data, compactFont)
+        compactFont["VarC"] = table
+        CompactVarCGlyphs(compactFont).unpackAll()
+
+    tests = [
+        ("compile", lambda: varcTable.compile(ttFont), len(data)),
+        ("decompile", decompile, len(data)),
+        ("compact", decompileCompact, len(data)),
+        ("toXML", lambda: dumpVarCXML(varcTable, ttFont), len(xmlData)),
+        ("fromXML", lambda: readVarCXML(xmlData, ttFont), len(xmlData)),
+    ]
+    results = {}
+    try:
+        for name, func, numBytes in tests:
+            seconds = min(_timeit(func) for _ in range(repeat))
+            results[name] = seconds
+            log(
+                f"{name:10} {seconds:8.3f} s {numGlyphs / seconds:10.0f} glyphs/s "
+                f"{numBytes / seconds / 1e6:8.2f} MB/s"
+            )
+    finally:
+        ttFont["VarC"] = varcTable
+    return results
+
+
+def makeSampleText(ttFont, numParagraphs=20, paragraphLength=200, seed=0):
+    """Return paragraphs of random characters from the cmap of ttFont,
+    separated by newlines, to stand in for CJK running text.
+    """
+    rnd = random.Random(seed)
+    codePoints = sorted(ttFont.getBestCmap())
+    return "\n".join(
+        "".join(chr(rnd.choice(codePoints)) for _ in range(paragraphLength))
+        for _ in range(numParagraphs)
+    )
+
+
+def benchmarkDrawText(varcFont, text, location, repeat=3, log=print):
+    """Time TTVarCFont.drawText() for text at location, and log the
+    throughput in glyphs per second, for the first run, which fills the
+    caches, and for the best of the following runs.
+    """
+    from fontTools.pens.basePen import NullPen
+
+    results = {}
+    for name, numRuns in [("cold", 1), ("warm", repeat)]:
+        hits, misses = varcFont.leafCacheHits, varcFont.leafCacheMisses
+        seconds = float("inf")
+        for _ in range(numRuns):
+            t = time.perf_counter()
+            numGlyphs = varcFont.drawText(NullPen(), text, location)
+            seconds = min(seconds, time.perf_counter() - t)
+        results[name] = seconds
+        log(
+            f"drawText {name:4} {seconds:8.3f} s {numGlyphs / seconds:10.0f} glyphs/s "
+            f"(leaf cache: {varcFont.leafCacheHits - hits} hits, "
+            f"{varcFont.leafCacheMisses - misses} misses)"
+        )
+    return results
+
+
+def _timeit(func):
+    t = time.perf_counter()
+    func()
+    return time.perf_counter() - t
+
+
+def _reloadFont(ttFont):
+    # Save and reopen the font, so its tables are decompiled lazily, like they
+    # would be for a font read from disk
+    f = io.BytesIO()
+    ttFont.save(f)
+    f.seek(0)
+    return TTFont(f)
+
+
+def _makeTTVarCFont(ttFont):
+    import uharfbuzz as hb
+    from .ttVarCFont import TTVarCFont
+
+    f = io.BytesIO()
+    ttFont.save(f)
+    data = f.getvalue()
+    hbFont = hb.Font(hb.Face(data))
+    return TTVarCFont(None, ttFont=TTFont(io.BytesIO(data)), hbFont=hbFont)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the VarC table code on a synthetic VarC font, or "
+        "check that it round-trips"
+    )
+    parser.add_argument(
+        "--glyphs",
+        type=int,
+        default=60000,
+        help="number of glyphs; the default is the size of a full CJK font, the "
+        "size the compile time is meant to be checked for",
+    )
+    parser.add_argument("--axes", type=int, default=300, help="number of axes")
+    parser.add_argument(
+        "--varidx-size",
+        type=int,
+        default=2,
+        choices=[1, 2, 3, 4],
+        help="the widest varIdx entry size",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="take the best of this many runs"
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="run round trip checks on small fonts with a matrix of settings, "
+        "instead of the benchmark",
+    )
+    parser.add_argument(
+        "--draw",
+        action="store_true",
+        help="benchmark drawing text with TTVarCFont.drawText(), instead of the "
+        "table code",
+    )
+    parser.add_argument(
+        "--text-file",
+        help="with --draw, the UTF-8 text to draw; by default, paragraphs of "
+        "random characters from the font are drawn",
+    )
+    parser.add_argument("--save", help="save the synthetic font to this path")
+    args = parser.parse_args()
+
+    if args.check:
+        runChecks(seed=args.seed)
+        return
+
+    ttFont = buildSyntheticVarCFont(
+        args.glyphs,
+        numAxes=args.axes,
+        varIdxEntrySize=args.varidx_size,
+        seed=args.seed,
+    )
+    if args.save:
+        ttFont.save(args.save)
+    if args.draw:
+        if args.text_file:
+            with open(args.text_file, encoding="utf-8") as f:
+                text = f.read()
+        else:
+            text = makeSampleText(ttFont, seed=args.seed)
+        rnd = random.Random(args.seed)
+        axisTags = [axis.axisTag for axis in ttFont["fvar"].axes]
+        location = {
+            axisTag: rnd.uniform(-1, 1)
+            for axisTag in rnd.sample(axisTags, min(8, len(axisTags)))
+        }
+        benchmarkDrawText(_makeTTVarCFont(ttFont), text, location, repeat=args.repeat)
+        return
+    benchmark(_reloadFont(ttFont), repeat=args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
+from collections import Counter
+import logging
+import time
 from fontTools.misc.fixedTools import floatToFixed
 from fontTools.ttLib import TTFont, newTable, registerCustomTableClass
+from fontTools.ttLib.tables.otTables import NO_VARIATION_INDEX
+from fontTools.varLib.builder import buildVarRegionList, buildVarStore
 from fontTools.varLib.models import VariationModel, allEqual
 from fontTools.varLib.varStore import OnlineVarStoreBuilder
-from rcjktools.varco import VarCoFont
+from rcjktools.varco import VarCoFont, getDefaultGlyphCachePath, tuplifyLocation
 from rcjktools.table_VarC import (
     fixedCoord,
     getToFixedConverterForNumIntBitsForScale,
+    packVarIdxs,
     transformToIntConverters,
     transformDefaults,
     VARIDX_KEY,
@@ -14,18 +20,55 @@ from rcjktools.table_VarC import (
     TransformRecord,
 )
 
+logger = logging.getLogger(__name__)
 
-def precompileAllComponents(vcData, allLocations, axisTags):
+
+def precompileAllComponents(
+    vcData, allLocations, axisTags, glyphTimings=None, numWorkers=1
+):
+    """Precompile the components of the glyphs in vcData. Return a dict with a
+    list of ComponentRecord objects per glyph, and the VarStore their varIdxs
+    refer to.
+
+    If numWorkers is larger than 1, the glyphs are precompiled in chunks in
+    that many worker processes, each chunk into a VarStore of its own, and the
+    stores are combined with mergeVarStores(); None means one per CPU core. The
+    deltas behind each varIdx are the same as in a serial build, and the
+    result does not depend on the number of workers.
+    """
+    if numWorkers is None or numWorkers > 1:
+        return _precompileAllComponentsParallel(
+            vcData, allLocations, axisTags, glyphTimings, numWorkers
+        )
+    precompiled, store, numSubModels = _precompileGlyphs(
+        vcData, allLocations, axisTags, glyphTimings
+    )
+    logger.info(f"{numSubModels} distinct master sets for {len(vcData)} glyphs")
+    return precompiled, store
+
+
+def _precompileGlyphs(vcData, allLocations, axisTags, glyphTimings=None):
     precompiled = {}
     masterModel = VariationModel(allLocations, axisTags)
     storeBuilder = OnlineVarStoreBuilder(axisTags)
+    locationIndices = {
+        tuplifyLocation(loc): index for index, loc in enumerate(allLocations)
+    }
+    # Most glyphs share the same set of masters, so share their sub models, too
+    subModels = {}
     for gn in vcData.keys():
+        t0 = time.perf_counter()
         components, locations = vcData[gn]
-        items = [None] * len(allLocations)
-        for loc in locations:
-            index = allLocations.index(loc)
-            items[index] = True  # anything not None
-        subModel, subItems = masterModel.getSubModel(items)
+        masterIndices = tuple(
+            sorted(locationIndices[tuplifyLocation(loc)] for loc in locations)
+        )
+        subModel = subModels.get(masterIndices)
+        if subModel is None:
+            items = [None] * len(allLocations)
+            for index in masterIndices:
+                items[index] = True  # anything not None
+            subModel, subItems = masterModel.getSubModel(items)
+            subModels[masterIndices] = subModel
         storeBuilder.setModel(subModel)
         components = [[c[i] for i in subModel.mapping] for c in components]
         # We will have to offer the master values in the model order to the store builder
@@ -35,7 +78,100 @@ def precompileAllComponents(vcData, allLocations, axisTags):
         if precompiledGlyph is not None:
             # glyph components do not contain data that has to go to the 'VarC' table
             precompiled[gn] = precompiledGlyph
-    return precompiled, storeBuilder.finish()
+        if glyphTimings is not None:
+            glyphTimings[gn] = time.perf_counter() - t0
+    return precompiled, storeBuilder.finish(), len(subModels)
+
+
+# The number of glyphs per chunk for precompileAllComponents(numWorkers=...).
+# It is fixed, so that the merged VarStore doesn't depend on the number of
+# workers.
+PRECOMPILE_CHUNK_SIZE = 256
+
+
+def _precompileAllComponentsParallel(
+    vcData, allLocations, axisTags, glyphTimings, numWorkers
+):
+    from concurrent.futures import ProcessPoolExecutor
+    import itertools
+
+    glyphNames = list(vcData.keys())
+    chunks = [
+        {gn: vcData[gn] for gn in glyphNames[i : i + PRECOMPILE_CHUNK_SIZE]}
+        for i in range(0, len(glyphNames), PRECOMPILE_CHUNK_SIZE)
+    ]
+    with ProcessPoolExecutor(numWorkers) as executor:
+        # map() yields the results in chunks order
+        chunkResults = list(
+            executor.map(
+                _precompileGlyphsWorker,
+                chunks,
+                itertools.repeat(allLocations),
+                itertools.repeat(axisTags),
+            )
+        )
+
+    store, mappings = mergeVarStores([store for _, store, _ in chunkResults], axisTags)
+    precompiled = {}
+    for (chunkPrecompiled, _, chunkTimings), mapping in zip(chunkResults, mappings):
+        remapVarIdxs(chunkPrecompiled, mapping)
+        precompiled.update(chunkPrecompiled)
+        if glyphTimings is not None:
+            glyphTimings.update(chunkTimings)
+    logger.info(
+        f"precompiled {len(vcData)} glyphs in {len(chunks)} chunks, "
+        f"merged into {len(store.VarData)} VarData subtables"
+    )
+    return precompiled, store
+
+
+def _precompileGlyphsWorker(vcData, allLocations, axisTags):
+    glyphTimings = {}
+    precompiled, store, _ = _precompileGlyphs(
+        vcData, allLocations, axisTags, glyphTimings
+    )
+    return precompiled, store, glyphTimings
+
+
+def mergeVarStores(stores, axisTags):
+    """Merge VarStore objects, as built by OnlineVarStoreBuilder, into a new
+    one. Return the merged store, and a list with, for each of the stores, a
+    dict mapping its varIdxs to varIdxs in the merged store, to be used with
+    remapVarIdxs().
+
+    The regions are shared, in order of first appearance, and the VarData
+    subtables are appended in stores order, so the result is deterministic.
+    Rows that occur in several stores are not merged here; VarStore.optimize()
+    takes care of that. The VarData subtables are moved into the merged store.
+    """
+    regionList = buildVarRegionList([], axisTags)
+    mergedStore = buildVarStore(regionList, [])
+    regionIndices = {}
+    mappings = []
+    for store in stores:
+        regionMap = []
+        for region in store.VarRegionList.Region:
+            key = tuple(
+                (axis.StartCoord, axis.PeakCoord, axis.EndCoord)
+                for axis in region.VarRegionAxis
+            )
+            regionIndex = regionIndices.get(key)
+            if regionIndex is None:
+                regionIndex = regionIndices[key] = len(regionList.Region)
+                regionList.Region.append(region)
+            regionMap.append(regionIndex)
+        mapping = {}
+        for outer, varData in enumerate(store.VarData):
+            newOuter = len(mergedStore.VarData)
+            varData.VarRegionIndex = [regionMap[i] for i in varData.VarRegionIndex]
+            mergedStore.VarData.append(varData)
+            for inner in range(len(varData.Item)):
+                mapping[(outer << 16) | inner] = (newOuter << 16) | inner
+        mappings.append(mapping)
+    assert len(mergedStore.VarData) <= 0xFFFF, "too many VarData subtables"
+    regionList.RegionCount = len(regionList.Region)
+    mergedStore.VarDataCount = len(mergedStore.VarData)
+    return mergedStore, mappings
 
 
 def precompileVarComponents(glyphName, components, storeBuilder, axisTags):
@@ -147,18 +283,168 @@ def remapVarIdxs(precompiled, mapping):
                     v[VARIDX_KEY] = mapping[v[VARIDX_KEY]]
 
 
-def buildVarCTable(ttf, vcData, allLocations):
+def getComponentVarIdxs(component):
+    """Return the varIdxs of a ComponentRecord, in the order in which they are
+    stored in the VarC table.
+    """
+    return [
+        v[VARIDX_KEY]
+        for valueDict in [component.coord, component.transform]
+        for v in valueDict.values()
+        if VARIDX_KEY in v
+    ]
+
+
+def calcVarIdxsSize(precompiled):
+    """Return the total number of bytes the varIdx arrays of the components in
+    precompiled take in the VarC table.
+    """
+    return sum(
+        len(packVarIdxs(getComponentVarIdxs(component)))
+        for components in precompiled.values()
+        for component in components
+    )
+
+
+def replaceNoVariationIndex(precompiled, store):
+    """Replace NO_VARIATION_INDEX, which VarStore.optimize() assigns to
+    all-zero rows, with cheaper alternatives: as its outer index is 0xFFFF, a
+    single one forces 4-byte entries onto the whole varIdx array of a
+    component. Coordinates simply lose their varIdx, as do transforms whose
+    varIdxs are all NO_VARIATION_INDEX. Transforms that mix it with other
+    varIdxs use a single all-zero row instead, which is added to the VarData
+    subtable with the fewest regions that has room for it, and which
+    optimizeVarIdxOrder() then orders like any other row. The store and the
+    varIdxs in precompiled are modified in place.
+    """
+    zeroVarIdx = None
+    for components in precompiled.values():
+        for component in components:
+            for valueDict in component.coord.values():
+                if valueDict.get(VARIDX_KEY) == NO_VARIATION_INDEX:
+                    del valueDict[VARIDX_KEY]
+            transformVarIdxs = [
+                valueDict.get(VARIDX_KEY) for valueDict in component.transform.values()
+            ]
+            if NO_VARIATION_INDEX not in transformVarIdxs:
+                continue
+            if all(varIdx == NO_VARIATION_INDEX for varIdx in transformVarIdxs):
+                for valueDict in component.transform.values():
+                    del valueDict[VARIDX_KEY]
+                continue
+            if zeroVarIdx is None:
+                zeroVarIdx = _addZeroRow(store)
+            for valueDict in component.transform.values():
+                if valueDict[VARIDX_KEY] == NO_VARIATION_INDEX:
+                    valueDict[VARIDX_KEY] = zeroVarIdx
+
+
+def _addZeroRow(store):
+    # Only called for components that also use other rows, so there is at
+    # least one VarData subtable
+    outers = [
+        outer
+        for outer, varData in enumerate(store.VarData)
+        if len(varData.Item) <= 0xFFFF
+    ]
+    assert outers, "no room for an all-zero VarStore row"
+    outer = min(outers, key=lambda outer: store.VarData[outer].VarRegionCount)
+    varData = store.VarData[outer]
+    varData.addItem([0] * varData.VarRegionCount)
+    return (outer << 16) | (len(varData.Item) - 1)
+
+
+def optimizeVarIdxOrder(precompiled, store):
+    """Reorder the VarData subtables of store, and the rows within them, so that
+    the varIdx arrays of the components get small outer and inner indices, and
+    with that narrow entries. A component's entry size depends on the largest
+    outer and inner index it uses, so the VarData subtables and rows that are
+    referenced most come first, weighted by the length of the varIdx arrays
+    they appear in. NO_VARIATION_INDEX is kept as is; use
+    replaceNoVariationIndex() first, so that it doesn't widen the entries. The
+    store is modified in place, the varIdxs in precompiled must be updated with
+    the returned mapping, using remapVarIdxs().
+    """
+    varDataWeights = Counter()
+    rowWeights = Counter()
+    for components in precompiled.values():
+        for component in components:
+            varIdxs = getComponentVarIdxs(component)
+            for varIdx in varIdxs:
+                if varIdx == NO_VARIATION_INDEX:
+                    continue
+                varDataWeights[varIdx >> 16] += len(varIdxs)
+                rowWeights[varIdx] += len(varIdxs)
+
+    outerOrder = sorted(
+        range(len(store.VarData)), key=lambda outer: (-varDataWeights[outer], outer)
+    )
+    mapping = {NO_VARIATION_INDEX: NO_VARIATION_INDEX}
+    varDatas = []
+    for newOuter, outer in enumerate(outerOrder):
+        varData = store.VarData[outer]
+        innerOrder = sorted(
+            range(len(varData.Item)),
+            key=lambda inner: (-rowWeights[(outer << 16) | inner], inner),
+        )
+        varData.Item = [varData.Item[inner] for inner in innerOrder]
+        for newInner, inner in enumerate(innerOrder):
+            mapping[(outer << 16) | inner] = (newOuter << 16) | newInner
+        varDatas.append(varData)
+    store.VarData = varDatas
+    return mapping
+
+
+def buildVarCTable(ttf, vcData, allLocations, numWorkers=1):
     axisTags = [axis.axisTag for axis in ttf["fvar"].axes]
     varc_table = ttf["VarC"] = newTable("VarC")
     varc_table.Version = 0x00010000
-    precompiled, store = precompileAllComponents(vcData, allLocations, axisTags)
+    glyphTimings = {}
+    t0 = time.perf_counter()
+    precompiled, store = precompileAllComponents(
+        vcData, allLocations, axisTags, glyphTimings, numWorkers
+    )
+    t1 = time.perf_counter()
     mapping = store.optimize()
+    t2 = time.perf_counter()
     remapVarIdxs(precompiled, mapping)
+    varIdxsSizeBefore = calcVarIdxsSize(precompiled)
+    replaceNoVariationIndex(precompiled, store)
+    remapVarIdxs(precompiled, optimizeVarIdxOrder(precompiled, store))
+    varIdxsSizeAfter = calcVarIdxsSize(precompiled)
+    t3 = time.perf_counter()
     varc_table.GlyphData = precompiled
     varc_table.VarStore = store
-
-
-def buildVarC(designspacePath, ttfPath, outTTFPath, doTTX, saveWoff2):
+    logger.info(
+        f"precompiling components: {t1 - t0:.3f}s "
+        f"(of which {sum(glyphTimings.values()):.3f}s spent in glyphs); "
+        f"optimizing VarStore: {t2 - t1:.3f}s; remapping varIdxs: {t3 - t2:.3f}s"
+    )
+    logger.info(
+        f"varIdx arrays: {varIdxsSizeBefore} bytes before replacing "
+        "NO_VARIATION_INDEX and reordering the VarStore, "
+        f"{varIdxsSizeAfter} bytes after"
+    )
+    if logger.isEnabledFor(logging.DEBUG):
+        slowest = sorted(glyphTimings.items(), key=lambda item: -item[1])
+        for glyphName, seconds in slowest[:20]:
+            numMasters = len(vcData[glyphName][1])
+            numComponents = len(vcData[glyphName][0])
+            logger.debug(
+                f"{glyphName}: {seconds * 1000:.2f}ms "
+                f"({numComponents} components, {numMasters} masters)"
+            )
+
+
+def buildVarC(
+    designspacePath,
+    ttfPath,
+    outTTFPath,
+    doTTX,
+    saveWoff2,
+    numWorkers=1,
+    useGlyphCache=False,
+):
     import pathlib
 
     registerCustomTableClass("VarC", "rcjktools.table_VarC", "table_VarC")
@@ -171,10 +457,14 @@ def buildVarC(designspacePath, ttfPath, outTTFPath, doTTX, saveWoff2):
 
     axisTags = [axis.axisTag for axis in ttf["fvar"].axes]
     globalAxisNames = {axisTag for axisTag in axisTags if axisTag[0] != "V"}
-    vcFont = VarCoFont(designspacePath)
-    vcData, allLocations = vcFont.extractVarCoData(globalAxisNames)
+    glyphCachePath = None
+    if useGlyphCache:
+        glyphCachePath = getDefaultGlyphCachePath(designspacePath)
+    vcFont = VarCoFont(designspacePath, glyphCachePath=glyphCachePath)
+    vcData, allLocations = vcFont.extractVarCoData(globalAxisNames, numWorkers)
+    vcFont.saveGlyphCache()
 
-    buildVarCTable(ttf, vcData, allLocations)
+    buildVarCTable(ttf, vcData, allLocations, numWorkers)
 
     if doTTX:
         outTTXPath = outTTFPath.parent / (outTTFPath.stem + "-before.ttx")
@@ -205,8 +495,41 @@ def main():
         "--ttx", action="store_true", help="write TTX dumps for the VarC table."
     )
     parser.add_argument("--no-woff2", action="store_true")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="the number of worker processes used to read the VarCo data and "
+        "to precompile the components; "
+        "0 means one per CPU core. (Default: 1)",
+    )
+    parser.add_argument(
+        "--glyph-cache",
+        action="store_true",
+        help="keep the parsed VarCo glyphs in a cache file next to the "
+        ".designspace, to speed up subsequent runs",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        help="report timings; repeat to list the slowest glyphs",
+    )
     args = parser.parse_args()
-    buildVarC(args.designspace, args.ttf, args.output, args.ttx, not args.no_woff2)
+    logging.basicConfig(format="%(name)s: %(message)s")
+    level = [logging.WARNING, logging.INFO, logging.DEBUG][min(args.verbose, 2)]
+    logging.getLogger("rcjktools").setLevel(level)
+    logger.setLevel(level)  # in case we're running as __main__
+    buildVarC(
+        args.designspace,
+        args.ttf,
+        args.output,
+        args.ttx,
+        not args.no_woff2,
+        args.workers or None,
+        args.glyph_cache,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,513 @@
+from collections.abc import Mapping
+from typing import NamedTuple
+from fontTools.ttLib.tables._g_l_y_f import (
+    ARG_1_AND_2_ARE_WORDS,
+    MORE_COMPONENTS,
+    WE_HAVE_A_SCALE,
+    WE_HAVE_A_TWO_BY_TWO,
+    WE_HAVE_AN_X_AND_Y_SCALE,
+)
+from fontTools.ttLib.tables.otTables import NO_VARIATION_INDEX
+from .table_VarC import (
+    AXIS_INDICES_ARE_WORDS,
+    COORD_PRECISIONBITS,
+    DEGREES_SCALE,
+    HAS_TRANSFORM_VARIATIONS,
+    NUM_INT_BITS_FOR_SCALE_MASK,
+    VARIDX_KEY,
+    transformDefaults,
+    transformFieldFlags,
+    transformFieldNames,
+)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+NUM_TRANSFORM_VALUES = len(transformFieldNames)
+
+
+class CompactVarCGlyph(NamedTuple):
+    """The VarC components of a glyph as flat arrays, instead of dicts per
+    value.
+
+    For each component, the values are the coordinate values for its axisTags,
+    followed by all NUM_TRANSFORM_VALUES transform values, in
+    transformFieldNames order. For each value there is a default, a divisor
+    that turns a VarStore delta into a value delta, and a delta index into the
+    deltas array of a VarStoreBatchInstancer (numDeltas for values without
+    variations, including those with a NO_VARIATION_INDEX varIdx).
+    """
+
+    glyphNames: tuple  # the base glyph of each component
+    axisTags: tuple  # a tuple of axis tags for each component
+    values: object  # numpy arrays, or lists if NumPy is not available
+    deltaDivisors: object
+    deltaIndices: object
+
+    def iterComponents(self, values):
+        """Yield (glyphName, location, transform) for each component, where
+        values are the glyph's values, as returned by
+        CompactVarCGlyphs.instantiateValues(), and transform is a list of
+        transform values.
+        """
+        pos = 0
+        for glyphName, axisTags in zip(self.glyphNames, self.axisTags):
+            transformStart = pos + len(axisTags)
+            transformEnd = transformStart + NUM_TRANSFORM_VALUES
+            location = dict(zip(axisTags, values[pos:transformStart]))
+            yield glyphName, location, values[transformStart:transformEnd]
+            pos = transformEnd
+
+
+class UnpackedGlyphs(NamedTuple):
+    """The values of glyphs unpacked by CompactVarCGlyphs.unpackAll(), as flat
+    arrays for all glyphs, or lists if they are only needed per glyph. The
+    starts lists have one extra item, for the end of the last glyph or
+    component.
+    """
+
+    componentStarts: list  # the index of the first component of each glyph
+    componentGlyphNames: list
+    axisStarts: list  # the index of the first axis of each component
+    axisTags: list
+    valueStarts: list  # the index of the first value of each component
+    values: object
+    deltaDivisors: object
+    deltaIndices: object
+
+    def getGlyph(self, glyphIndex):
+        """Return the CompactVarCGlyph for the glyph at glyphIndex."""
+        componentStart, componentEnd = self.componentStarts[glyphIndex : glyphIndex + 2]
+        axisStarts = self.axisStarts
+        axisTags = self.axisTags
+        valueStart = self.valueStarts[componentStart]
+        valueEnd = self.valueStarts[componentEnd]
+        return CompactVarCGlyph(
+            tuple(self.componentGlyphNames[componentStart:componentEnd]),
+            tuple(
+                tuple(axisTags[axisStarts[i] : axisStarts[i + 1]])
+                for i in range(componentStart, componentEnd)
+            ),
+            self.values[valueStart:valueEnd],
+            self.deltaDivisors[valueStart:valueEnd],
+            self.deltaIndices[valueStart:valueEnd],
+        )
+
+
+class CompactVarCGlyphs(Mapping):
+    """A read-only mapping of glyph names to CompactVarCGlyph objects for the
+    VarC table of ttFont. Glyphs are converted when first accessed, or all at
+    once with unpackAll(). The components of a lazily decompiled VarC table
+    are not kept around.
+    """
+
+    def __init__(self, ttFont):
+        varcTable = ttFont["VarC"]
+        self._glyphData = varcTable.GlyphData
+        self._glyfTable = ttFont["glyf"]
+        self._fvarAxisTags = [axis.axisTag for axis in ttFont["fvar"].axes]
+        self._varDataOffsets = []
+        self._varIdxs = []  # the varIdx for each delta index
+        if varcTable.VarStore is not None:
+            for outer, varData in enumerate(varcTable.VarStore.VarData):
+                self._varDataOffsets.append(len(self._varIdxs))
+                self._varIdxs.extend(
+                    (outer << 16) | inner for inner in range(len(varData.Item))
+                )
+        self.numDeltas = len(self._varIdxs)
+        self._axisTags = {}  # for sharing equal axisTags tuples between glyphs
+        self._glyphs = {}
+        # The glyphs unpacked by unpackAll(), and a dict mapping the names of
+        # those that were not accessed yet to their index in it
+        self._unpacked = None
+        self._unpackedGlyphs = {}
+
+    def __getitem__(self, glyphName):
+        compactGlyph = self._glyphs.get(glyphName)
+        if compactGlyph is None:
+            glyphIndex = self._unpackedGlyphs.pop(glyphName, None)
+            if glyphIndex is not None:
+                compactGlyph = self._unpacked.getGlyph(glyphIndex)
+            else:
+                peek = getattr(self._glyphData, "peek", self._glyphData.__getitem__)
+                compactGlyph = buildCompactVarCGlyph(
+                    peek(glyphName),
+                    self._glyfTable[glyphName].components,
+                    self._varDataOffsets,
+                    self.numDeltas,
+                )
+            axisTags = tuple(
+                self._axisTags.setdefault(tags, tags) for tags in compactGlyph.axisTags
+            )
+            compactGlyph = compactGlyph._replace(axisTags=axisTags)
+            self._glyphs[glyphName] = compactGlyph
+        return compactGlyph
+
+    def unpackAll(self):
+        """Convert all glyphs that were not converted yet. With NumPy, the
+        glyphs of a lazily decompiled VarC table that were not decompiled yet
+        are unpacked straight from the binary VarC and glyf data into flat
+        arrays, all in one go, which is much faster than building their
+        ComponentRecord objects. Their CompactVarCGlyph objects are cut from
+        these arrays when the glyphs are accessed.
+        """
+        getGlyphOffsets = getattr(self._glyphData, "getGlyphOffsets", None)
+        if numpy is not None and getGlyphOffsets is not None and self._unpacked is None:
+            glyfGlyphs = self._glyfTable.glyphs
+            glyphOffsets = {
+                glyphName: glyphOffset
+                for glyphName, glyphOffset in getGlyphOffsets().items()
+                if glyphName not in self._glyphs
+                and hasattr(glyfGlyphs[glyphName], "data")
+            }
+            if glyphOffsets:
+                self._unpackGlyphs(glyphOffsets)
+        for glyphName in self._glyphData:
+            if glyphName not in self._unpackedGlyphs:
+                self[glyphName]
+
+    def _unpackGlyphs(self, glyphOffsets):
+        """Unpack the glyphs at glyphOffsets, a dict mapping glyph names to
+        offsets into the VarC table data, with NumPy. The glyphs must not have
+        been expanded in the glyf table.
+        """
+        glyphNames = list(glyphOffsets)
+        glyfGlyphs = self._glyfTable.glyphs
+        componentGlyphIDs, numComponents = _unpackCompositeGlyphIDs(
+            [glyfGlyphs[glyphName].data for glyphName in glyphNames]
+        )
+        data = _bytesToArray(self._glyphData.data)
+        firstComponents = numpy.cumsum(numComponents) - numComponents
+        (
+            flags,
+            numAxes,
+            axisIndicesStart,
+            valuesStart,
+            varIdxsStart,
+            numVarIdxs,
+        ) = _unpackComponentLayouts(
+            data, numpy.array(list(glyphOffsets.values())), numComponents
+        )
+        numAllComponents = len(flags)
+
+        # The axis indices and coordinate values
+        componentOfAxis = numpy.repeat(numpy.arange(numAllComponents), numAxes)
+        axisOrdinals = numpy.arange(len(componentOfAxis)) - numpy.repeat(
+            numpy.cumsum(numAxes) - numAxes, numAxes
+        )
+        axisIndicesAreWords = (flags[componentOfAxis] & AXIS_INDICES_ARE_WORDS) != 0
+        pos = axisIndicesStart[componentOfAxis] + axisOrdinals * (
+            1 + axisIndicesAreWords
+        )
+        axisIndices = numpy.where(
+            axisIndicesAreWords, _unpackUInt16(data, pos), data[pos]
+        )
+        hasVarIdxFlags = numpy.where(axisIndicesAreWords, 0x8000, 0x80)
+        coordHasVarIdx = (axisIndices & hasVarIdxFlags) != 0
+        axisIndices &= hasVarIdxFlags - 1
+        coordValues = _unpackInt16(
+            data, valuesStart[componentOfAxis] + 2 * axisOrdinals
+        )
+
+        # Each component has its coordinate values, followed by all transform
+        # values, missing ones set to their defaults
+        numComponentValues = numAxes + NUM_TRANSFORM_VALUES
+        componentValuesStart = numpy.cumsum(numComponentValues) - numComponentValues
+        numValues = int(numComponentValues.sum())
+        rawValues = numpy.empty(numValues, dtype=numpy.float64)
+        deltaDivisors = numpy.empty(numValues, dtype=numpy.float64)
+        hasVarIdx = numpy.empty(numValues, dtype=bool)
+        pos = componentValuesStart[componentOfAxis] + axisOrdinals
+        rawValues[pos] = coordValues
+        deltaDivisors[pos] = 1 << COORD_PRECISIONBITS
+        hasVarIdx[pos] = coordHasVarIdx
+
+        # The transform values as (numAllComponents, NUM_TRANSFORM_VALUES)
+        # arrays, the columns in transformFieldNames order
+        flags = flags[:, numpy.newaxis]
+        fieldFlags = numpy.array(
+            [transformFieldFlags[fieldName] for fieldName in transformFieldNames]
+        )
+        hasField = (flags & fieldFlags) != 0
+        # The number of transform values stored before each one
+        fieldOrdinals = _countTransformFields(flags & (fieldFlags - 1))
+        fieldValues = _unpackInt16(
+            data, (valuesStart + 2 * numAxes)[:, numpy.newaxis] + 2 * fieldOrdinals
+        )
+        divisors = numpy.empty(hasField.shape, dtype=numpy.float64)
+        divisors[:] = [
+            _transformDeltaDivisors.get(fieldName, 0)
+            for fieldName in transformFieldNames
+        ]
+        scaleColumns = [
+            i
+            for i, fieldName in enumerate(transformFieldNames)
+            if fieldName not in _transformDeltaDivisors
+        ]
+        divisors[:, scaleColumns] = 1 << (16 - (flags & NUM_INT_BITS_FOR_SCALE_MASK))
+        defaults = [transformDefaults[fieldName] for fieldName in transformFieldNames]
+        pos = (componentValuesStart + numAxes)[:, numpy.newaxis] + numpy.arange(
+            NUM_TRANSFORM_VALUES
+        )
+        rawValues[pos] = numpy.where(hasField, fieldValues, defaults * divisors)
+        deltaDivisors[pos] = divisors
+        hasVarIdx[pos] = hasField & ((flags & HAS_TRANSFORM_VARIATIONS) != 0)
+
+        # The varIdxs are stored in the order of the values that have one
+        componentOfVarIdx = numpy.repeat(numpy.arange(numAllComponents), numVarIdxs)
+        varIdxOrdinals = numpy.arange(len(componentOfVarIdx)) - numpy.repeat(
+            numpy.cumsum(numVarIdxs) - numVarIdxs, numVarIdxs
+        )
+        entryFormats = data[varIdxsStart[componentOfVarIdx]]
+        entrySizes = (entryFormats >> 4) + 1
+        innerBits = (entryFormats & 0x0F) + 1
+        pos = varIdxsStart[componentOfVarIdx] + 1 + varIdxOrdinals * entrySizes
+        entries = numpy.zeros(len(pos), dtype=numpy.int64)
+        for i in range(4):
+            entries = numpy.where(
+                entrySizes > i, (entries << 8) | data[pos + i], entries
+            )
+        varIdxs = numpy.full(numValues, NO_VARIATION_INDEX, dtype=numpy.int64)
+        varIdxs[hasVarIdx] = ((entries >> innerBits) << 16) | (
+            entries & ((1 << innerBits) - 1)
+        )
+
+        hasVariations = varIdxs != NO_VARIATION_INDEX
+        outers = numpy.where(hasVariations, varIdxs >> 16, 0)
+        varDataOffsets = numpy.array(self._varDataOffsets or [0], dtype=numpy.int64)
+        deltaIndices = numpy.where(
+            hasVariations, varDataOffsets[outers] + (varIdxs & 0xFFFF), self.numDeltas
+        ).astype(numpy.int32)
+
+        glyphOrder = self._glyfTable.glyphOrder
+        fvarAxisTags = self._fvarAxisTags
+        self._unpacked = UnpackedGlyphs(
+            numpy.append(firstComponents, numAllComponents).tolist(),
+            [glyphOrder[glyphID] for glyphID in componentGlyphIDs],
+            numpy.append(0, numpy.cumsum(numAxes)).tolist(),
+            [fvarAxisTags[axisIndex] for axisIndex in axisIndices.tolist()],
+            numpy.append(componentValuesStart, numValues).tolist(),
+            rawValues / deltaDivisors,
+            deltaDivisors,
+            deltaIndices,
+        )
+        self._unpackedGlyphs = dict(zip(glyphNames, range(len(glyphNames))))
+
+    def __contains__(self, glyphName):
+        return glyphName in self._glyphData
+
+    def __iter__(self):
+        return iter(self._glyphData)
+
+    def __len__(self):
+        return len(self._glyphData)
+
+    def instantiateValues(self, compactGlyph, varcInstancer):
+        """Return a list with all values of compactGlyph at the location of
+        varcInstancer, which is either a VarStoreBatchInstancer or another
+        object that maps varIdxs to deltas, like VarStoreInstancer.
+        """
+        deltas = getattr(varcInstancer, "deltas", None)
+        if deltas is not None and numpy is not None:
+            values = deltas[compactGlyph.deltaIndices]
+            values /= compactGlyph.deltaDivisors
+            values += compactGlyph.values
+            return values.tolist()
+
+        values = compactGlyph.values
+        deltaDivisors = compactGlyph.deltaDivisors
+        deltaIndices = compactGlyph.deltaIndices
+        if numpy is not None:
+            values = values.tolist()
+            deltaDivisors = deltaDivisors.tolist()
+            deltaIndices = deltaIndices.tolist()
+        else:
+            values = list(values)
+        numDeltas = self.numDeltas
+        varIdxs = self._varIdxs
+        for valueIndex, deltaIndex in enumerate(deltaIndices):
+            if deltaIndex != numDeltas:
+                delta = varcInstancer[varIdxs[deltaIndex]]
+                values[valueIndex] += delta / deltaDivisors[valueIndex]
+        return values
+
+
+def buildCompactVarCGlyph(components, glyfComponents, varDataOffsets, numDeltas):
+    """Build a CompactVarCGlyph from a list of ComponentRecord objects and the
+    corresponding glyf components. The delta indices are computed for a
+    VarStore with VarData subtables starting at varDataOffsets in the flat
+    deltas array, and numDeltas rows in total.
+    """
+    assert len(components) == len(glyfComponents)
+    values = []
+    deltaDivisors = []
+    deltaIndices = []
+
+    def addValue(valueDict, deltaDivisor):
+        values.append(valueDict["value"])
+        deltaDivisors.append(deltaDivisor)
+        varIdx = valueDict.get(VARIDX_KEY)
+        if varIdx is None or varIdx == NO_VARIATION_INDEX:
+            deltaIndices.append(numDeltas)
+        else:
+            deltaIndices.append(varDataOffsets[varIdx >> 16] + (varIdx & 0xFFFF))
+
+    for component in components:
+        for valueDict in component.coord.values():
+            addValue(valueDict, 1 << COORD_PRECISIONBITS)
+        scaleDivisor = 1 << (16 - component.numIntBitsForScale)
+        for fieldName in transformFieldNames:
+            valueDict = component.transform.get(fieldName)
+            if valueDict is None:
+                valueDict = dict(value=transformDefaults[fieldName])
+            addValue(valueDict, _transformDeltaDivisors.get(fieldName, scaleDivisor))
+
+    if numpy is not None:
+        values = numpy.array(values, dtype=numpy.float64)
+        deltaDivisors = numpy.array(deltaDivisors, dtype=numpy.float64)
+        deltaIndices = numpy.array(deltaIndices, dtype=numpy.int32)
+    return CompactVarCGlyph(
+        tuple(glyfComponent.glyphName for glyfComponent in glyfComponents),
+        tuple(tuple(component.coord) for component in components),
+        values,
+        deltaDivisors,
+        deltaIndices,
+    )
+
+
+def _bytesToArray(data):
+    # Pad the data, so reading up to 4 bytes past any position is safe
+    return numpy.frombuffer(data + bytes(4), dtype=numpy.uint8).astype(numpy.int32)
+
+
+def _unpackUInt16(data, pos):
+    return (data[pos] << 8) | data[pos + 1]
+
+
+def _unpackInt16(data, pos):
+    values = _unpackUInt16(data, pos)
+    return values - ((values & 0x8000) << 1)
+
+
+_firstTransformFieldFlag = min(transformFieldFlags.values())
+_transformFieldsMask = sum(transformFieldFlags.values())
+if numpy is not None:
+    _transformFieldCounts = numpy.array(
+        [
+            bin(i).count("1")
+            for i in range(_transformFieldsMask // _firstTransformFieldFlag + 1)
+        ]
+    )
+
+
+def _countTransformFields(flags):
+    """Return the number of transform fields present for each of flags."""
+    return _transformFieldCounts[
+        (flags & _transformFieldsMask) // _firstTransformFieldFlag
+    ]
+
+
+def _unpackCompositeGlyphIDs(glyfDatas):
+    """Return the base glyph IDs of the components of the composite glyf glyphs
+    with the raw data glyfDatas as one array, and the number of components of
+    each glyph as another. The components of all glyphs are walked at once.
+    """
+    glyphLengths = numpy.array([len(glyfData) for glyfData in glyfDatas])
+    data = _bytesToArray(b"".join(glyfDatas))
+    glyphStarts = numpy.cumsum(glyphLengths) - glyphLengths
+    assert (_unpackInt16(data, glyphStarts) == -1).all(), "not a composite glyph"
+    glyphIndices = numpy.arange(len(glyfDatas))
+    pos = glyphStarts + 10  # skip the glyph header
+    componentGlyphIndices = []
+    componentGlyphIDs = []
+    while len(pos):
+        flags = _unpackUInt16(data, pos)
+        componentGlyphIndices.append(glyphIndices)
+        componentGlyphIDs.append(_unpackUInt16(data, pos + 2))
+        pos = pos + numpy.where(flags & ARG_1_AND_2_ARE_WORDS, 8, 6)
+        pos += numpy.select(
+            [
+                (flags & WE_HAVE_A_SCALE) != 0,
+                (flags & WE_HAVE_AN_X_AND_Y_SCALE) != 0,
+                (flags & WE_HAVE_A_TWO_BY_TWO) != 0,
+            ],
+            [2, 4, 8],
+        )
+        moreComponents = (flags & MORE_COMPONENTS) != 0
+        glyphIndices = glyphIndices[moreComponents]
+        pos = pos[moreComponents]
+    componentGlyphIndices = numpy.concatenate(componentGlyphIndices)
+    componentGlyphIDs = numpy.concatenate(componentGlyphIDs)
+    order = numpy.argsort(componentGlyphIndices, kind="stable")
+    return (
+        componentGlyphIDs[order].tolist(),
+        numpy.bincount(componentGlyphIndices, minlength=len(glyfDatas)),
+    )
+
+
+def _unpackComponentLayouts(data, glyphOffsets, numComponents):
+    """Return arrays with the flags, the number of axes, the position of the
+    axis indices, of the axis values and of the varIdxs, and the number of
+    varIdxs of all components of the glyphs at glyphOffsets in the VarC table
+    data, in glyph order. The i-th components of all glyphs are read at once.
+    """
+    # The number of bytes with the high bit set before each position, counting
+    # all bytes, and every other byte, for the axis indices that are bytes or
+    # words: the high bit of an axis index tells whether it has a varIdx
+    highBits = data >> 7
+    highBitCounts = numpy.zeros(len(data) + 1, dtype=numpy.int32)
+    highBitCounts[1:] = numpy.cumsum(highBits)
+    highBitCounts2 = numpy.zeros(len(data) + 2, dtype=numpy.int32)
+    highBitCounts2[2::2] = numpy.cumsum(highBits[0::2])
+    highBitCounts2[3::2] = numpy.cumsum(highBits[1::2])
+
+    firstComponents = numpy.cumsum(numComponents) - numComponents
+    layouts = numpy.zeros((6, int(numComponents.sum())), dtype=numpy.int64)
+    glyphIndices = numpy.arange(len(glyphOffsets))
+    pos = glyphOffsets
+    for i in range(int(numComponents.max(initial=0))):
+        hasComponent = numComponents[glyphIndices] > i
+        glyphIndices = glyphIndices[hasComponent]
+        pos = pos[hasComponent]
+
+        flags = _unpackUInt16(data, pos)
+        axisIndicesAreWords = (flags & AXIS_INDICES_ARE_WORDS) != 0
+        numAxes = numpy.where(
+            axisIndicesAreWords, _unpackUInt16(data, pos + 2), data[pos + 2]
+        )
+        axisIndicesStart = pos + 3 + axisIndicesAreWords
+        valuesStart = axisIndicesStart + numAxes * (1 + axisIndicesAreWords)
+        numVarIdxs = numpy.where(
+            axisIndicesAreWords,
+            highBitCounts2[valuesStart] - highBitCounts2[axisIndicesStart],
+            highBitCounts[valuesStart] - highBitCounts[axisIndicesStart],
+        )
+        numTransformFields = _countTransformFields(flags)
+        numVarIdxs += numpy.where(
+            flags & HAS_TRANSFORM_VARIATIONS, numTransformFields, 0
+        )
+        varIdxsStart = valuesStart + 2 * (numAxes + numTransformFields)
+        layouts[:, firstComponents[glyphIndices] + i] = (
+            flags,
+            numAxes,
+            axisIndicesStart,
+            valuesStart,
+            varIdxsStart,
+            numVarIdxs,
+        )
+        entrySizes = (data[varIdxsStart] >> 4) + 1
+        pos = varIdxsStart + 1 + entrySizes * numVarIdxs
+    return layouts
+
+
+# ScaleX and ScaleY deltas are divided by 1 << (16 - numIntBitsForScale)
+_transformDeltaDivisors = {
+    "Rotation": DEGREES_SCALE,
+    "SkewX": DEGREES_SCALE,
+    "SkewY": DEGREES_SCALE,
+    "TCenterX": 1,
+    "TCenterY": 1,
+}
@@ -0,0 +1,262 @@
+import argparse
+import logging
+import time
+from fontTools.ttLib import TTFont, newTable, registerCustomTableClass
+from fontTools.ttLib.tables.TupleVariation import TupleVariation
+from fontTools.ttLib.tables._g_l_y_f import Glyph, GlyphCoordinates, flagOnCurve
+from fontTools.varLib.iup import iup_delta_optimize
+from fontTools.varLib.models import VariationModel, allEqual, piecewiseLinearMap
+
+registerCustomTableClass("VarC", "rcjktools.table_VarC", "table_VarC")
+
+from .instantiateVarC import drawStaticGlyph, mapGlyphs  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+HIDDEN_AXIS = 0x0001  # fvar axis flag
+
+
+def decomposeVarCFont(fontPath, numWorkers=1, optimize=True):
+    """Convert the VarC font at fontPath into a standard variable font, and
+    return it as a TTFont. All glyphs are flattened into simple glyf outlines,
+    whose variations are sampled at a set of masters (see getMasterLocations())
+    and stored as gvar deltas for the user axes. The hidden axes, which only
+    serve the VarC components, are dropped, as is the VarC table.
+
+    The result matches the VarC font exactly at the masters; in between, it
+    interpolates linearly, where component transforms may not. Glyphs whose
+    masters turn out incompatible get no variations. numWorkers is as for
+    instantiateVarCFont(), and optimize enables IUP optimization of the gvar
+    deltas, like in fontTools.varLib.
+    """
+    ttFont = TTFont(fontPath)
+    fvarAxes = ttFont["fvar"].axes
+    userAxisTags = [axis.axisTag for axis in fvarAxes if not axis.flags & HIDDEN_AXIS]
+    hiddenAxisTags = [axis.axisTag for axis in fvarAxes if axis.flags & HIDDEN_AXIS]
+    masterLocations = getMasterLocations(ttFont, userAxisTags)
+    userLocations = [
+        _masterToUserLocation(ttFont, location) for location in masterLocations
+    ]
+    logger.info(f"{len(masterLocations)} masters for axes {', '.join(userAxisTags)}")
+
+    glyphNames = ttFont.getGlyphOrder()
+    glyphResults = mapGlyphs(
+        decomposeGlyphs,
+        fontPath,
+        glyphNames,
+        (userLocations, masterLocations, userAxisTags, optimize),
+        numWorkers,
+    )
+
+    for tableTag in ["VarC", "gvar"]:
+        if tableTag in ttFont:
+            del ttFont[tableTag]
+    if hiddenAxisTags:
+        # Without gvar, this only has to update fvar, avar, STAT, HVAR, etc.
+        from fontTools.varLib.instancer import instantiateVariableFont
+
+        instantiateVariableFont(
+            ttFont, {axisTag: None for axisTag in hiddenAxisTags}, inplace=True
+        )
+
+    glyfTable = ttFont["glyf"]
+    hmtxTable = ttFont["hmtx"]
+    gvarTable = newTable("gvar")
+    gvarTable.version = 1
+    gvarTable.reserved = 0
+    gvarTable.variations = {}
+    for glyphName, (glyphData, advanceWidth, lsb, variations) in zip(
+        glyphNames, glyphResults
+    ):
+        glyfTable[glyphName] = Glyph(glyphData)
+        hmtxTable[glyphName] = advanceWidth, lsb
+        gvarTable.variations[glyphName] = variations
+    if userAxisTags:
+        ttFont["gvar"] = gvarTable
+    return ttFont
+
+
+def getMasterLocations(ttFont, axisTags):
+    """Return the normalized master locations needed to reproduce the
+    variations of a VarC font along the axes in axisTags: the default location
+    first, followed by the minimum and maximum of each axis, and the peaks of
+    the VarC and gvar regions, projected onto these axes.
+    """
+    fvarAxes = ttFont["fvar"].axes
+    axisTags = set(axisTags)
+    peaks = set()
+    for axis in fvarAxes:
+        if axis.axisTag in axisTags:
+            if axis.minValue < axis.defaultValue:
+                peaks.add(((axis.axisTag, -1.0),))
+            if axis.maxValue > axis.defaultValue:
+                peaks.add(((axis.axisTag, 1.0),))
+
+    # The VarC regions are in the normalized space before avar, the gvar regions
+    # in the space after avar. Master locations are in the latter.
+    avarSegments = ttFont["avar"].segments if "avar" in ttFont else {}
+    regions = []
+    varStore = ttFont["VarC"].VarStore if "VarC" in ttFont else None
+    if varStore is not None:
+        for region in varStore.VarRegionList.Region:
+            support = region.get_support(fvarAxes)
+            regions.append(
+                {
+                    axisTag: _mapValue(peak, avarSegments.get(axisTag))
+                    for axisTag, (_, peak, _) in support.items()
+                }
+            )
+    if "gvar" in ttFont:
+        for variations in ttFont["gvar"].variations.values():
+            for var in variations:
+                regions.append(
+                    {axisTag: peak for axisTag, (_, peak, _) in var.axes.items()}
+                )
+
+    for region in regions:
+        peak = tuple(
+            sorted(
+                (axisTag, value)
+                for axisTag, value in region.items()
+                if axisTag in axisTags and value
+            )
+        )
+        if peak:
+            peaks.add(peak)
+    return [{}] + [dict(peak) for peak in sorted(peaks, key=lambda p: (len(p), p))]
+
+
+def decomposeGlyphs(
+    varcFont, glyphNames, userLocations, masterLocations, axisTags, optimize=True
+):
+    """Draw the glyphs of a TTVarCFont at the masters, given both in user
+    coordinates and as normalized master locations, with the default first.
+    Return a list with, for each glyph, a (glyphData, advanceWidth, lsb,
+    variations) tuple, where glyphData is the compiled, flattened default glyph,
+    and variations is a list of gvar TupleVariation objects.
+    """
+    model = VariationModel(masterLocations, axisTags)
+    masterGlyphs = [[] for _ in glyphNames]
+    # Draw all glyphs at one location before moving on to the next one, so
+    # that the per-location setup is done once
+    for location in userLocations:
+        for glyphName, glyphs in zip(glyphNames, masterGlyphs):
+            glyphs.append(drawStaticGlyph(varcFont, glyphName, location))
+
+    glyphResults = []
+    for glyphName, glyphs in zip(glyphNames, masterGlyphs):
+        defaultGlyph, advanceWidth = glyphs[0]
+        variations = buildGlyphVariations(glyphName, glyphs, model, optimize)
+        glyphData = defaultGlyph.compile(None, recalcBBoxes=False)
+        glyphResults.append((glyphData, advanceWidth, defaultGlyph.xMin, variations))
+    return glyphResults
+
+
+def buildGlyphVariations(glyphName, masterGlyphs, model, optimize=True):
+    """Return a list of TupleVariation objects for a glyph, given a list of
+    (glyph, advanceWidth) tuples for the masters of model. The glyphs are
+    simple glyf Glyph objects, with the left side bearing equal to xMin.
+    """
+    allCoords = []
+    allControls = []
+    for glyph, advanceWidth in masterGlyphs:
+        coords = GlyphCoordinates(glyph.coordinates)
+        # The phantom points, see glyf._getPhantomPoints(); the origin is the
+        # left side bearing point, and the vertical metrics don't vary
+        coords.extend([(0, 0), (advanceWidth, 0), (0, 0), (0, 0)])
+        allCoords.append(coords)
+        allControls.append(
+            (glyph.endPtsOfContours, [flag & flagOnCurve for flag in glyph.flags])
+        )
+    if not allEqual(allControls):
+        logger.warning(f"glyph {glyphName} has incompatible masters; no variations")
+        return []
+
+    deltas = model.getDeltas(allCoords, round=round)
+    origCoords = deltas[0]
+    endPts = allControls[0][0]
+    variations = []
+    for delta, support in zip(deltas[1:], model.supports[1:]):
+        if all(v == 0 for v in delta.array):
+            continue
+        var = TupleVariation(support, delta)
+        if optimize:
+            deltaOpt = iup_delta_optimize(delta, origCoords, endPts)
+            if None in deltaOpt:
+                # Use the optimized deltas only if they're smaller
+                varOpt = TupleVariation(support, deltaOpt)
+                axisTags = sorted(support)
+                if _getCompiledSize(varOpt, axisTags) < _getCompiledSize(var, axisTags):
+                    var = varOpt
+        variations.append(var)
+    return variations
+
+
+def _getCompiledSize(var, axisTags):
+    tupleData, auxData = var.compile(axisTags)
+    return len(tupleData) + len(auxData)
+
+
+def _masterToUserLocation(ttFont, location):
+    # The inverse of fontTools.varLib.models.normalizeLocation() followed by
+    # the avar mapping
+    avarSegments = ttFont["avar"].segments if "avar" in ttFont else {}
+    userLocation = {}
+    for axis in ttFont["fvar"].axes:
+        value = location.get(axis.axisTag, 0)
+        segments = avarSegments.get(axis.axisTag)
+        if segments:
+            segments = {v: k for k, v in segments.items()}
+        value = _mapValue(value, segments)
+        if value < 0:
+            value = axis.defaultValue + value * (axis.defaultValue - axis.minValue)
+        else:
+            value = axis.defaultValue + value * (axis.maxValue - axis.defaultValue)
+        userLocation[axis.axisTag] = value
+    return userLocation
+
+
+def _mapValue(value, avarSegments):
+    if not avarSegments:
+        return value
+    return piecewiseLinearMap(value, avarSegments)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a VarC font into a standard variable font, with "
+        "flattened glyf outlines and gvar deltas for the user axes"
+    )
+    parser.add_argument("font", help="a variable font with a VarC table")
+    parser.add_argument("output", help="the output variable font")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="the number of worker processes; 0 means one per CPU core. "
+        "(Default: 1)",
+    )
+    parser.add_argument(
+        "--no-optimize",
+        action="store_true",
+        help="don't do IUP optimization of the gvar deltas",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="report timings")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(name)s: %(message)s")
+    level = logging.INFO if args.verbose else logging.WARNING
+    logging.getLogger("rcjktools").setLevel(level)
+    logger.setLevel(level)  # in case we're running as __main__
+
+    t0 = time.perf_counter()
+    ttFont = decomposeVarCFont(
+        args.font, args.workers or None, optimize=not args.no_optimize
+    )
+    t1 = time.perf_counter()
+    ttFont.save(args.output)
+    logger.info(f"decomposing: {t1 - t0:.3f}s; saving: {time.perf_counter() - t1:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import argparse
+import logging
+import os
+import pathlib
+import struct
+import time
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from fontTools.ttLib import TTFont, registerCustomTableClass
+from fontTools.ttLib.tables._g_l_y_f import Glyph
+
+registerCustomTableClass("VarC", "rcjktools.table_VarC", "table_VarC")
+
+from .ttVarCFont import TTVarCFont  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+# The tables that make no sense in a static instance
+variationTables = [
+    "fvar",
+    "avar",
+    "gvar",
+    "cvar",
+    "HVAR",
+    "VVAR",
+    "MVAR",
+    "STAT",
+    "VarC",
+]
+
+
+def instantiateVarCFont(fontPath, locations, numWorkers=1):
+    """Instantiate the VarC font at fontPath at each of the locations, given in
+    user coordinates, with missing axes at their default. Return a list of
+    static TTFont objects, one for each location, in which all glyphs are
+    flattened into simple glyf outlines, and the variation tables are dropped.
+
+    The font is read once and each glyph is decoded once for all locations. If
+    numWorkers is larger than 1, the glyphs are processed in that many worker
+    processes; None means one per CPU core. The result does not depend on the
+    number of workers.
+    """
+    locations = [dict(location) for location in locations]
+    staticFonts = [_makeStaticFont(fontPath) for _ in locations]
+    glyphNames = staticFonts[0].getGlyphOrder() if staticFonts else []
+    glyphResults = mapGlyphs(
+        instantiateGlyphs, fontPath, glyphNames, (locations,), numWorkers
+    )
+    for glyphName, locationResults in zip(glyphNames, glyphResults):
+        for staticFont, (glyphData, advanceWidth, lsb) in zip(
+            staticFonts, locationResults
+        ):
+            staticFont["glyf"][glyphName] = Glyph(glyphData)
+            staticFont["hmtx"][glyphName] = advanceWidth, lsb
+    return staticFonts
+
+
+def instantiateGlyphs(varcFont, glyphNames, locations):
+    """Draw the glyphs of a TTVarCFont at each of the locations, and return a
+    list with, for each glyph, a list with a (glyphData, advanceWidth, lsb)
+    tuple per location, where glyphData is the compiled, flattened glyf glyph.
+    """
+    glyphResults = [[] for _ in glyphNames]
+    # Draw all glyphs at one location before moving on to the next one, so
+    # that the per-location setup is done once
+    for location in locations:
+        for glyphName, locationResults in zip(glyphNames, glyphResults):
+            glyph, advanceWidth = drawStaticGlyph(varcFont, glyphName, location)
+            try:
+                glyphData = glyph.compile(None, recalcBBoxes=False)
+            except struct.error as e:
+                raise ValueError(
+                    f"can't instantiate {glyphName!r} at {location}: the "
+                    f"outline doesn't fit in the glyf table ({e})"
+                ) from e
+            locationResults.append((glyphData, advanceWidth, glyph.xMin))
+    return glyphResults
+
+
+def drawStaticGlyph(varcFont, glyphName, location):
+    """Draw a glyph of a TTVarCFont at location, and return it as a simple glyf
+    Glyph with its bounding box computed, and its advance width.
+    """
+    pen = TTGlyphPen(None)
+    varcFont.drawGlyph(pen, glyphName, location)
+    glyph = pen.glyph()
+    glyph.recalcBounds(None)
+    return glyph, varcFont.getAdvanceWidth(glyphName, location)
+
+
+def mapGlyphs(func, fontPath, glyphNames, args=(), numWorkers=1):
+    """Call func(varcFont, glyphNames, *args) with a TTVarCFont for the font at
+    fontPath, for chunks of glyphNames, where func returns a list with a result
+    for each glyph. Yield the results in glyphNames order.
+
+    If numWorkers is larger than 1, the chunks are processed in that many
+    worker processes, each with its own TTVarCFont; None means one per CPU
+    core. func and args must then be picklable.
+    """
+    if numWorkers is not None and numWorkers <= 1:
+        with TTVarCFont(fontPath) as varcFont:
+            yield from func(varcFont, glyphNames, *args)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    if numWorkers is None:
+        numWorkers = os.cpu_count()
+    # Several chunks per worker, to even out the load
+    chunkSize = max(1, len(glyphNames) // (8 * numWorkers))
+    chunks = [
+        glyphNames[i : i + chunkSize] for i in range(0, len(glyphNames), chunkSize)
+    ]
+    with ProcessPoolExecutor(
+        numWorkers,
+        initializer=_initMapGlyphsWorker,
+        initargs=(fontPath, func, args),
+    ) as executor:
+        # map() yields the results in chunks order
+        for chunkResults in executor.map(_mapGlyphsWorker, chunks):
+            yield from chunkResults
+
+
+# Per-process state for mapGlyphs(numWorkers=...)
+_workerFont = None
+_workerFunc = None
+_workerArgs = None
+
+
+def _initMapGlyphsWorker(fontPath, func, args):
+    from multiprocessing.util import Finalize
+
+    global _workerFont, _workerFunc, _workerArgs
+    _workerFont = TTVarCFont(fontPath)
+    # Close the font when the worker process exits
+    Finalize(_workerFont, _workerFont.close, exitpriority=0)
+    _workerFunc = func
+    _workerArgs = args
+
+
+def _mapGlyphsWorker(glyphNames):
+    return _workerFunc(_workerFont, glyphNames, *_workerArgs)
+
+
+def _makeStaticFont(fontPath):
+    staticFont = TTFont(fontPath)
+    for tableTag in variationTables:
+        if tableTag in staticFont:
+            del staticFont[tableTag]
+    return staticFont
+
+
+def parseLocation(s):
+    """Parse a location like "wght=700,wdth=100" into a dict."""
+    location = {}
+    for item in s.split(","):
+        if not item:
+            continue
+        axisTag, _, value = item.partition("=")
+        location[axisTag.strip()] = float(value)
+    return location
+
+
+def _locationToFileNamePart(location):
+    if not location:
+        return "default"
+    return "-".join(f"{axisTag}_{value:g}" for axisTag, value in location.items())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Instantiate a VarC font at one or more locations, as static "
+        "TTF fonts with flattened glyf outlines"
+    )
+    parser.add_argument("font", help="a variable font with a VarC table")
+    parser.add_argument(
+        "-l",
+        "--location",
+        type=parseLocation,
+        action="append",
+        help="a location in user coordinates, like wght=700,wdth=100; can be "
+        "repeated to make several instances in one run (default: the default "
+        "location)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        help="the folder to write the instances to (default: next to the font)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="the number of worker processes; 0 means one per CPU core. "
+        "(Default: 1)",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="report timings")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(name)s: %(message)s")
+    level = logging.INFO if args.verbose else logging.WARNING
+    logging.getLogger("rcjktools").setLevel(level)
+    logger.setLevel(level)  # in case we're running as __main__
+
+    fontPath = pathlib.Path(args.font)
+    outputDir = pathlib.Path(args.output_dir) if args.output_dir else fontPath.parent
+    locations = args.location or [{}]
+
+    t0 = time.perf_counter()
+    staticFonts = instantiateVarCFont(fontPath, locations, args.workers or None)
+    t1 = time.perf_counter()
+    for location, staticFont in zip(locations, staticFonts):
+        outputPath = outputDir / (
+            f"{fontPath.stem}-{_locationToFileNamePart(location)}{fontPath.suffix}"
+        )
+        staticFont.save(outputPath)
+        logger.info(f"saved {outputPath}")
+    logger.info(
+        f"instantiating {len(locations)} locations: {t1 - t0:.3f}s; "
+        f"saving: {time.perf_counter() - t1:.3f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -53,6 +53,13 @@ class Glyph(_MathMixin):
         self.lib = dict(glyphObject.lib)
         return self
 
+    @classmethod
+    def loadFromGlyphSet(cls, glyphSet, glyphName):
+        # glyphSet is a fontTools.ufoLib.glifLib.GlyphSet object
+        self = cls()
+        glyphSet.readGlyph(glyphName, self, self.getPointPen())
+        return self
+
     def __init__(self):
         self.name = None
         self.width = 0
@@ -79,11 +86,16 @@ class Glyph(_MathMixin):
         self.outline.draw(pen)
 
     def instantiate(self, location):
+        if self.model is None:
+            return self  # XXX raise error?
+        location = normalizeLocation(location, self.axes)
+        return self.instantiateNormalized(location)
+
+    def instantiateNormalized(self, location):
         if self.model is None:
             return self  # XXX raise error?
         if self.deltas is None:
             self.deltas = self.model.getDeltas([self] + self.variations)
-        location = normalizeLocation(location, self.axes)
         return self.model.interpolateFromDeltas(location, self.deltas)
 
     def _doBinaryOperatorScalar(self, scalar, op):
@@ -0,0 +1,436 @@
+import argparse
+import asyncio
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import json
+import logging
+import os
+import pathlib
+import threading
+import urllib.parse
+from fontTools.pens.svgPathPen import SVGPathPen
+from fontTools.ttLib import registerCustomTableClass
+from fontTools.varLib.models import normalizeValue
+from .varco import quantizeLocation
+
+logger = logging.getLogger(__name__)
+
+
+# Like the previewers, show the 1000 unit em square, with the baseline 120
+# units from the bottom (the Ideographic Em Square)
+svgTemplate = (
+    '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 -880 1000 1000">'
+    '<path transform="scale(1 -1)" d="{path}"/></svg>\n'
+)
+
+
+class PreviewFont:
+    """A font opened with the backend the previewers use for its file type:
+    RoboCJKProject for .rcjk, VarCoFont for .designspace and TTVarCFont for .ttf.
+    axes is a list of (axisTag, minValue, defaultValue, maxValue) tuples, in the
+    coordinates that the backend's drawGlyph() takes.
+    """
+
+    def __init__(self, fontID, path):
+        self.id = fontID
+        self.path = os.fspath(path)
+        ext = os.path.splitext(self.path)[1].lower()
+        if ext == ".designspace":
+            from .varco import VarCoFont, getDefaultGlyphCachePath
+
+            # Only use the glyph cache when it was opted into, for example
+            # with buildvarc --glyph-cache
+            glyphCachePath = getDefaultGlyphCachePath(self.path)
+            if not glyphCachePath.exists():
+                glyphCachePath = None
+            self.font = VarCoFont(self.path, glyphCachePath=glyphCachePath)
+            self.axes = [
+                (axisTag, *triple) for axisTag, triple in self.font.axes.items()
+            ]
+        elif ext == ".ttf":
+            from .ttVarCFont import TTVarCFont
+
+            registerCustomTableClass("VarC", "rcjktools.table_VarC", "table_VarC")
+            self.font = TTVarCFont(self.path)
+            self.axes = [
+                (axis.axisTag, axis.minValue, axis.defaultValue, axis.maxValue)
+                for axis in self.font.ttFont["fvar"].axes
+                if not axis.flags & 0x0001
+            ]
+        elif ext == ".rcjk":
+            from .project import RoboCJKProject
+
+            self.font = RoboCJKProject(self.path, decomposeClassicComponents=True)
+            # RoboCJKProject.drawGlyph() takes normalized coordinates
+            self.axes = [(axisTag, 0, 0, 1) for axisTag in self.font.axes]
+        else:
+            raise ValueError(f"unsupported file type: {self.path}")
+        self._axisTriples = {axisTag: triple for axisTag, *triple in self.axes}
+        self.backend = type(self.font).__name__
+        self.glyphNames = sorted(self.font.keys())
+        self._glyphNameSet = set(self.glyphNames)
+        # Only TTVarCFont can draw from several threads at once
+        if ext == ".ttf":
+            self._lock = contextlib.nullcontext()
+        else:
+            self._lock = threading.Lock()
+
+    def __contains__(self, glyphName):
+        return glyphName in self._glyphNameSet
+
+    def quantizeLocation(self, location):
+        """Return location normalized, rounded to the F2Dot14 grid and in
+        hashable form, as varco.quantizeLocation() does, so that locations the
+        font can't tell apart give the same cache key.
+        """
+        normLocation = {}
+        for axisTag, value in location.items():
+            triple = self._axisTriples.get(axisTag)
+            if triple is not None:
+                value = normalizeValue(value, triple)
+            normLocation[axisTag] = value
+        return quantizeLocation(normLocation)
+
+    def renderSVG(self, glyphName, location):
+        """Return the glyph at location as an SVG document, encoded as UTF-8."""
+        pen = SVGPathPen(None, ntos=_formatNumber)
+        with self._lock:
+            self.font.drawGlyph(pen, glyphName, location)
+        return svgTemplate.format(path=pen.getCommands()).encode("utf-8")
+
+    def close(self):
+        if hasattr(self.font, "saveGlyphCache"):
+            self.font.saveGlyphCache()
+        if hasattr(self.font, "close"):
+            self.font.close()
+
+
+class PreviewServer:
+    """An asyncio HTTP server that renders glyphs of one or more fonts as SVG,
+    for previewing in a browser. Rendering happens in a thread pool, so the
+    server stays responsive while glyphs are drawn. Responses are kept in an
+    LRU cache of cacheSize entries, and identical requests that come in while
+    a glyph is being rendered wait for that same render.
+
+    GET /                   a preview page with a glyph list and axis sliders
+    GET /fonts              the fonts and their axes, as JSON
+    GET /glyphs?font=ID     the glyph names of a font, as JSON
+    GET /svg?font=ID&glyph=NAME&AXIS=VALUE...
+                            a glyph at a location, as an SVG document
+    GET /stats              cache statistics, as JSON
+    """
+
+    def __init__(self, fontPaths, cacheSize=1024, numWorkers=None):
+        self.fonts = {}
+        for fontPath in fontPaths:
+            fontID = pathlib.Path(fontPath).stem
+            if fontID in self.fonts:
+                fontID = f"{fontID}-{len(self.fonts)}"
+            self.fonts[fontID] = PreviewFont(fontID, fontPath)
+        self.cacheSize = cacheSize
+        self.stats = Counter(hits=0, misses=0, coalesced=0)
+        self._cache = OrderedDict()
+        self._renderTasks = {}  # the renders in progress, by cache key
+        self._executor = ThreadPoolExecutor(numWorkers)
+
+    async def getSVG(self, previewFont, glyphName, location):
+        """Return the SVG document for a glyph at location, from the cache if
+        possible, and otherwise from a new or an already running render.
+        """
+        key = (previewFont.id, glyphName, previewFont.quantizeLocation(location))
+        svg = self._cache.get(key)
+        if svg is not None:
+            self.stats["hits"] += 1
+            self._cache.move_to_end(key)
+            return svg
+        task = self._renderTasks.get(key)
+        if task is None:
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(
+                self._render(key, previewFont, glyphName, location)
+            )
+            self._renderTasks[key] = task
+            task.add_done_callback(lambda task: self._renderTasks.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+        # A waiting request that is cancelled must not cancel the shared render
+        return await asyncio.shield(task)
+
+    async def _render(self, key, previewFont, glyphName, location):
+        loop = asyncio.get_running_loop()
+        svg = await loop.run_in_executor(
+            self._executor, previewFont.renderSVG, glyphName, location
+        )
+        self._cache[key] = svg
+        if len(self._cache) > self.cacheSize:
+            self._cache.popitem(last=False)
+        return svg
+
+    async def handleRequest(self, method, target):
+        """Return a (status, contentType, body) tuple for a request."""
+        if method != "GET":
+            return 405, "text/plain", b"only GET is supported\n"
+        url = urllib.parse.urlsplit(target)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if url.path == "/":
+            return 200, "text/html; charset=utf-8", indexHTML.encode("utf-8")
+        elif url.path == "/fonts":
+            fonts = [
+                dict(id=f.id, path=f.path, backend=f.backend, axes=f.axes)
+                for f in self.fonts.values()
+            ]
+            return _jsonResponse(fonts)
+        elif url.path == "/stats":
+            return _jsonResponse(dict(self.stats, cacheSize=len(self._cache)))
+        elif url.path not in {"/glyphs", "/svg"}:
+            return 404, "text/plain", b"not found\n"
+
+        previewFont = self.fonts.get(query.pop("font", None))
+        if previewFont is None:
+            return 404, "text/plain", b"unknown font\n"
+        if url.path == "/glyphs":
+            return _jsonResponse(previewFont.glyphNames)
+
+        glyphName = query.pop("glyph", None)
+        if glyphName not in previewFont:
+            return 404, "text/plain", b"unknown glyph\n"
+        try:
+            location = {axisTag: float(value) for axisTag, value in query.items()}
+        except ValueError:
+            return 400, "text/plain", b"axis values must be numbers\n"
+        try:
+            svg = await self.getSVG(previewFont, glyphName, location)
+        except Exception as e:
+            logger.exception(f"can't render {glyphName} at {location}")
+            return 500, "text/plain", f"{type(e).__name__}: {e}\n".encode("utf-8")
+        return 200, "image/svg+xml", svg
+
+    async def handleConnection(self, reader, writer):
+        """Serve the HTTP/1.x requests of one connection, keeping it open
+        between requests unless the client asks otherwise.
+        """
+        try:
+            while True:
+                requestLine = await reader.readline()
+                if not requestLine.strip():
+                    break
+                method, target, version = requestLine.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                if (
+                    headers.get("content-length", "0") != "0"
+                    or "transfer-encoding" in headers
+                ):
+                    # We don't read request bodies
+                    status, contentType, body = 400, "text/plain", b"no body\n"
+                    keepAlive = False
+                else:
+                    status, contentType, body = await self.handleRequest(method, target)
+                    connection = headers.get("connection", "").lower()
+                    if version == "HTTP/1.1":
+                        keepAlive = connection != "close"
+                    else:
+                        keepAlive = connection == "keep-alive"
+                logger.debug(f"{method} {target} {status}")
+                writer.write(
+                    (
+                        f"HTTP/1.1 {status} {_reasons.get(status, '')}\r\n"
+                        f"Content-Type: {contentType}\r\n"
+                        f"Content-Length: {len(body)}\r\n"
+                        f"Connection: {'keep-alive' if keepAlive else 'close'}\r\n"
+                        "\r\n"
+                    ).encode("latin-1")
+                    + body
+                )
+                await writer.drain()
+                if not keepAlive:
+                    break
+        except (ConnectionError, ValueError):
+            pass  # the client went away, or sent a malformed request
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8000):
+        server = await asyncio.start_server(self.handleConnection, host, port)
+        logger.info(f"serving {', '.join(self.fonts)} on http://{host}:{port}/")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        for previewFont in self.fonts.values():
+            previewFont.close()
+
+
+def _formatNumber(value):
+    # Like project.roundFuncOneDecimal(), for compact SVG paths
+    value = round(value, 1)
+    i = int(value)
+    return str(i) if i == value else str(value)
+
+
+def _jsonResponse(obj):
+    return 200, "application/json", json.dumps(obj).encode("utf-8")
+
+
+_reasons = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+
+indexHTML = """\
+<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>VarC Preview</title>
+<style>
+body { font-family: sans-serif; display: flex; height: 100vh; margin: 0; }
+#side { width: 220px; padding: 8px; display: flex; flex-direction: column; gap: 6px; }
+#glyphs { flex: 1; }
+#axes label { display: block; font-size: small; }
+#axes input { width: 100%; }
+#view { flex: 1; padding: 16px; }
+#view svg { width: 100%; height: 100%; fill: rgba(0, 0, 0, 0.3); stroke: black; }
+</style>
+</head>
+<body>
+<div id="side">
+<select id="font"></select>
+<input id="filter" placeholder="Find glyph">
+<select id="glyphs" size="20"></select>
+<div id="axes"></div>
+</div>
+<div id="view"></div>
+<script>
+const $ = (id) => document.getElementById(id);
+let fonts = [];
+let glyphNames = [];
+let inFlight = false;
+let dirty = false;
+
+async function getJSON(url) {
+  const response = await fetch(url);
+  return response.json();
+}
+
+async function selectFont() {
+  const font = fonts[$("font").selectedIndex];
+  glyphNames = await getJSON("/glyphs?font=" + encodeURIComponent(font.id));
+  $("axes").replaceChildren();
+  for (const [axisTag, minValue, defaultValue, maxValue] of font.axes) {
+    const label = document.createElement("label");
+    const slider = document.createElement("input");
+    Object.assign(slider, {
+      type: "range", min: minValue, max: maxValue, step: "any", value: defaultValue,
+    });
+    slider.dataset.axisTag = axisTag;
+    slider.oninput = update;
+    label.append(axisTag, slider);
+    $("axes").append(label);
+  }
+  filterGlyphs();
+}
+
+function filterGlyphs() {
+  const pattern = $("filter").value.toLowerCase();
+  const names = glyphNames.filter((name) => name.toLowerCase().includes(pattern));
+  $("glyphs").replaceChildren(...names.slice(0, 5000).map((name) => new Option(name)));
+}
+
+// Keep at most one request in flight: while it runs, slider moves are folded
+// into one follow-up request for the latest location
+async function update() {
+  if (inFlight) {
+    dirty = true;
+    return;
+  }
+  const glyphName = $("glyphs").value;
+  if (!glyphName) {
+    return;
+  }
+  const params = new URLSearchParams({
+    font: fonts[$("font").selectedIndex].id, glyph: glyphName,
+  });
+  for (const slider of $("axes").querySelectorAll("input")) {
+    params.set(slider.dataset.axisTag, slider.value);
+  }
+  inFlight = true;
+  try {
+    const response = await fetch("/svg?" + params);
+    $("view").innerHTML = await response.text();
+  } finally {
+    inFlight = false;
+  }
+  if (dirty) {
+    dirty = false;
+    update();
+  }
+}
+
+async function init() {
+  fonts = await getJSON("/fonts");
+  $("font").replaceChildren(...fonts.map((font) => new Option(font.id)));
+  $("font").onchange = selectFont;
+  $("filter").oninput = filterGlyphs;
+  $("glyphs").onchange = update;
+  await selectFont();
+}
+
+init();
+</script>
+</body>
+</html>
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve SVG previews of the glyphs of .rcjk projects, VarCo "
+        ".designspace files and VarC .ttf fonts, for viewing in a browser"
+    )
+    parser.add_argument("fonts", nargs="+", help="the fonts to serve")
+    parser.add_argument("--host", default="127.0.0.1", help="the address to listen on")
+    parser.add_argument(
+        "--port", type=int, default=8000, help="the port to listen on (default: 8000)"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=1024,
+        help="the number of SVG responses to cache (default: 1024)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="the number of rendering threads (default: based on the CPU count)",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="log requests")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(name)s: %(message)s")
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.getLogger("rcjktools").setLevel(level)
+    logger.setLevel(level)  # in case we're running as __main__
+
+    server = PreviewServer(args.fonts, args.cache_size, args.workers)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import random
+from fontTools.fontBuilder import FontBuilder
+from fontTools.misc.fixedTools import fixedToFloat
+from fontTools.misc.timeTools import timestampSinceEpoch
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from fontTools.ttLib import newTable, registerCustomTableClass
+from fontTools.ttLib.tables._g_l_y_f import Glyph, GlyphComponent
+from fontTools.varLib.builder import buildVarData, buildVarRegionList, buildVarStore
+
+registerCustomTableClass("VarC", "rcjktools.table_VarC", "table_VarC")
+
+from .table_VarC import (  # noqa: E402
+    COORD_PRECISIONBITS,
+    ComponentRecord,
+    VARIDX_KEY,
+    intToDegrees,
+    transformFieldNames,
+)
+
+
+# The VarStore layout per varIdx entry size: the number of rows of the first
+# VarData subtable, and the number of single-row VarData subtables that follow.
+# Components that mix varIdxs from the first and from the last subtables get the
+# widest varIdx entries, see packVarIdxs().
+varStoreLayouts = {
+    1: (0x100, 0),  # inner < 0x100
+    2: (0x400, 0),  # inner < 0x400
+    3: (0x100, 0x1FF),  # inner < 0x100, outer < 0x200
+    4: (0x1000, 0x1FFF),  # inner < 0x1000, outer < 0x2000
+}
+
+
+def buildSyntheticVarCFont(
+    numGlyphs=1000,
+    numAxes=16,
+    maxComponentsPerGlyph=5,
+    maxAxesPerComponent=4,
+    maxTransformFieldsPerComponent=3,
+    coordVariationProbability=0.5,
+    transformVariationProbability=0.5,
+    nestedComponentProbability=0.2,
+    varIdxEntrySize=2,
+    numRegions=8,
+    seed=0,
+):
+    """Build a TTFont with a VarC table filled with random data, for testing and
+    benchmarking the VarC table code. The font has glyf, gvar and fvar tables,
+    and can be drawn with TTVarCFont once it is saved.
+
+    About 1 in 5 glyphs are simple base glyphs, the others are VarC composites
+    that use base glyphs and, with nestedComponentProbability, other composites
+    as components. The composites are mapped to code points from U+4E00.
+
+    The axes are named "V000", "V001", etc. and have a -1..0..1 range. Use more
+    than 128 axes to get components with word-sized axis indices
+    (AXIS_INDICES_ARE_WORDS). varIdxEntrySize (1-4) determines the VarStore
+    layout, and with that the widest varIdx entries the table will contain.
+    """
+    assert 10 <= numGlyphs <= 0xFFFF
+    assert 1 <= numAxes <= 1000
+    rnd = random.Random(seed)
+
+    axisTags = [f"V{axisIndex:03}" for axisIndex in range(numAxes)]
+    numBaseGlyphs = max(1, numGlyphs // 5)
+    baseGlyphNames = [f"base{i}" for i in range(numBaseGlyphs)]
+    varcGlyphNames = [f"varc{i}" for i in range(numGlyphs - numBaseGlyphs - 1)]
+    glyphOrder = [".notdef"] + baseGlyphNames + varcGlyphNames
+
+    fb = FontBuilder(1000, isTTF=True)
+    fb.updateHead(created=timestampSinceEpoch(0), modified=timestampSinceEpoch(0))
+    fb.setupGlyphOrder(glyphOrder)
+    fb.setupCharacterMap(dict(zip(_iterCodePoints(), varcGlyphNames)))
+
+    glyphs = {".notdef": Glyph()}
+    for glyphName in baseGlyphNames:
+        glyphs[glyphName] = _makeBaseGlyph(rnd)
+    for glyphIndex, glyphName in enumerate(varcGlyphNames):
+        glyph = Glyph()
+        glyph.numberOfContours = -1
+        glyph.components = []
+        for _ in range(rnd.randint(1, maxComponentsPerGlyph)):
+            component = GlyphComponent()
+            if glyphIndex and rnd.random() < nestedComponentProbability:
+                component.glyphName = varcGlyphNames[rnd.randrange(glyphIndex)]
+            else:
+                component.glyphName = rnd.choice(baseGlyphNames)
+            component.x = rnd.randint(-200, 200)
+            component.y = rnd.randint(-200, 200)
+            component.flags = 0x4  # ROUND_XY_TO_GRID
+            glyph.components.append(component)
+        glyphs[glyphName] = glyph
+
+    fb.setupGlyf(glyphs)
+    fb.setupHorizontalMetrics({glyphName: (1000, 0) for glyphName in glyphOrder})
+    fb.setupHorizontalHeader()
+    fb.setupNameTable(dict(familyName="SyntheticVarC", styleName="Regular"))
+    fb.setupOS2()
+    # The glyph names don't fit in a format 2 post table for the largest fonts
+    fb.setupPost(keepGlyphNames=numGlyphs + 258 <= 0xFFFF)
+    fb.setupFvar([(axisTag, -1, 0, 1, axisTag) for axisTag in axisTags], [])
+    fb.setupGvar({glyphName: [] for glyphName in glyphOrder})
+
+    varStore = _makeVarStore(rnd, axisTags, varIdxEntrySize, numRegions)
+    numVarDatas = len(varStore.VarData)
+    numFirstRows = len(varStore.VarData[0].Item)
+
+    def makeValueDict(value, hasVariations):
+        valueDict = dict(value=value)
+        if hasVariations:
+            if numVarDatas == 1 or rnd.random() < 0.5:
+                valueDict[VARIDX_KEY] = rnd.randrange(numFirstRows)
+            else:
+                valueDict[VARIDX_KEY] = rnd.randrange(1, numVarDatas) << 16
+        return valueDict
+
+    glyphData = {}
+    for glyphName in varcGlyphNames:
+        components = []
+        for _ in glyphs[glyphName].components:
+            coord = {}
+            numComponentAxes = rnd.randint(0, min(maxAxesPerComponent, numAxes))
+            for axisTag in rnd.sample(axisTags, numComponentAxes):
+                value = fixedToFloat(rnd.randint(-4096, 4096), COORD_PRECISIONBITS)
+                coord[axisTag] = makeValueDict(
+                    value, rnd.random() < coordVariationProbability
+                )
+
+            numIntBitsForScale = rnd.choice([2, 3])
+            hasTransformVariations = rnd.random() < transformVariationProbability
+            transform = {}
+            for fieldName in rnd.sample(
+                transformFieldNames, rnd.randint(0, maxTransformFieldsPerComponent)
+            ):
+                transform[fieldName] = makeValueDict(
+                    _randomTransformValue(rnd, fieldName, numIntBitsForScale),
+                    hasTransformVariations,
+                )
+            components.append(ComponentRecord(coord, transform, numIntBitsForScale))
+        glyphData[glyphName] = components
+
+    varcTable = newTable("VarC")
+    varcTable.Version = 0x00010000
+    varcTable.GlyphData = glyphData
+    varcTable.VarStore = varStore
+    fb.font["VarC"] = varcTable
+    return fb.font
+
+
+def _iterCodePoints():
+    yield from range(0x4E00, 0xA000)
+    yield from range(0x20000, 0x30000)
+
+
+def _makeBaseGlyph(rnd):
+    pen = TTGlyphPen(None)
+    xMin, yMin = rnd.randint(0, 400), rnd.randint(0, 400)
+    xMax, yMax = xMin + rnd.randint(50, 500), yMin + rnd.randint(50, 500)
+    pen.moveTo((xMin, yMin))
+    pen.lineTo((xMin, yMax))
+    pen.lineTo((xMax, yMax))
+    pen.lineTo((xMax, yMin))
+    pen.closePath()
+    return pen.glyph()
+
+
+def _makeVarStore(rnd, axisTags, varIdxEntrySize, numRegions):
+    regions = []
+    for _ in range(numRegions):
+        peak = rnd.choice([-1, 1])
+        region = {rnd.choice(axisTags): (min(0, peak), peak, max(0, peak))}
+        regions.append(region)
+    regionList = buildVarRegionList(regions, axisTags)
+
+    numFirstRows, numSingleRowVarDatas = varStoreLayouts[varIdxEntrySize]
+    varDatas = []
+    for numRows in [numFirstRows] + [1] * numSingleRowVarDatas:
+        regionIndices = sorted(rnd.sample(range(numRegions), min(2, numRegions)))
+        rows = [[rnd.randint(-300, 300) for _ in regionIndices] for _ in range(numRows)]
+        varDatas.append(buildVarData(regionIndices, rows, optimize=False))
+    return buildVarStore(regionList, varDatas)
+
+
+def _randomTransformValue(rnd, fieldName, numIntBitsForScale):
+    # All values are exactly representable in the binary format, so they
+    # survive a compile/decompile round trip unchanged
+    if fieldName in {"ScaleX", "ScaleY"}:
+        precisionBits = 16 - numIntBitsForScale
+        one = 1 << precisionBits
+        return fixedToFloat(rnd.randint(one // 2, one + one // 2), precisionBits)
+    elif fieldName in {"Rotation", "SkewX", "SkewY"}:
+        return intToDegrees(rnd.randint(-0x1000, 0x1000))
+    else:
+        return rnd.randint(-500, 500)
@@ -1,5 +1,7 @@
-from ast import literal_eval
+from collections.abc import MutableMapping
 import functools
+import logging
+import math
 import struct
 from typing import NamedTuple
 from fontTools.misc.fixedTools import (
@@ -9,10 +11,22 @@ from fontTools.misc.fixedTools import (
     otRound,
     strToFixedToFloat,
 )
+from fontTools.misc.xmlReader import XMLReader
+from fontTools.misc.xmlWriter import escapeattr
 from fontTools.ttLib.tables.DefaultTable import DefaultTable
+from fontTools.ttLib.tables._g_l_y_f import (
+    ARG_1_AND_2_ARE_WORDS,
+    MORE_COMPONENTS,
+    WE_HAVE_A_SCALE,
+    WE_HAVE_A_TWO_BY_TWO,
+    WE_HAVE_AN_X_AND_Y_SCALE,
+)
 from fontTools.ttLib.tables.otTables import VarStore
 
 
+logger = logging.getLogger(__name__)
+
+
 VARIDX_KEY = "varIdx"
 
 NUM_INT_BITS_FOR_SCALE_MASK = 0x07
@@ -141,14 +155,13 @@ class ComponentRecord(NamedTuple):
     numIntBitsForScale: int
 
 
-def _getSubWriter(writer):
-    subWriter = writer.getSubWriter()
-    subWriter.longOffset = True
-    writer.writeSubTable(subWriter)
-    return subWriter
-
-
 class table_VarC(DefaultTable):
+    # The default options for toXML(); ttxv overrides them on the table it
+    # dumps, from the command line
+    dumpComments = True
+    dumpGlyphNames = None  # only dump these glyphs (and their components)
+    dumpUnicodes = None  # only dump the glyphs for these code points
+
     def decompile(self, data, ttFont):
         from fontTools.ttLib.tables.otConverters import OTTableReader
 
@@ -160,17 +173,16 @@ class table_VarC(DefaultTable):
         if self.Version != 0x00010000:
             raise ValueError(f"unknown VarC.Version: {self.Version:08X}")
 
-        self.GlyphData = {}
         glyphOrder = ttFont.getGlyphOrder()
 
         numGlyphs = reader.readUShort()
-        for glyphID in range(numGlyphs):
-            glyphOffset = reader.readULong()
-            if glyphOffset:
-                sub = reader.getSubReader(glyphOffset)
-                glyphName = glyphOrder[glyphID]
-                glyfGlyph = glyfTable[glyphName]
-                self.GlyphData[glyphName] = decompileGlyph(sub, glyfGlyph, axisTags)
+        glyphOffsets = {
+            glyphOrder[glyphID]: glyphOffset
+            for glyphID, glyphOffset in enumerate(reader.readArray("I", 4, numGlyphs))
+            if glyphOffset
+        }
+        # The glyphs are only decompiled when they are accessed
+        self.GlyphData = LazyGlyphData(data, glyphOffsets, glyfTable, axisTags)
 
         varStoreOffset = reader.readULong()
         if varStoreOffset:
@@ -186,9 +198,7 @@ class table_VarC(DefaultTable):
         axisTagToIndex = {tag: i for i, tag in enumerate(axisTags)}
         glyfTable = ttFont["glyf"]
 
-        writer = OTTableWriter()
         assert self.Version == 0x00010000
-        writer.writeULong(self.Version)
 
         glyphData = self.GlyphData
         glyphOrder = ttFont.getGlyphOrder()
@@ -198,38 +208,73 @@ class table_VarC(DefaultTable):
             if glyphName in glyphData:
                 numGlyphs = max(numGlyphs, glyphID + 1)
 
-        writer.writeUShort(numGlyphs)  # numGlyphs <= maxp.numGlyphs
+        # Rather than building an OTTableWriter tree with a sub writer per
+        # glyph, all glyph subtables are packed into one flat bytes object.
+        # The layout is the same as OTTableWriter.getAllData() would produce:
+        # the header, the glyph subtables in glyph order, then the VarStore.
+        # Many glyphs have byte-identical component data; those share a
+        # single subtable, which is placed at its last reference.
+        glyphSubtables = [None] * numGlyphs
+        lastReferences = {}
+        numSharedGlyphs = 0
         for glyphID in range(numGlyphs):
             glyphName = glyphOrder[glyphID]
             components = glyphData.get(glyphName)
             if components:
-                glyfGlyph = glyfTable[glyphName]
-                assert glyfGlyph.isComposite()
-                assert len(components) == len(glyfGlyph.components)
-                sub = _getSubWriter(writer)
-                compileGlyph(sub, components, axisTags, axisTagToIndex)
-            else:
-                writer.writeULong(0x00000000)
+                assert len(components) == getNumComponents(glyfTable, glyphName)
+                data = compileGlyphData(components, axisTags, axisTagToIndex)
+                if data in lastReferences:
+                    numSharedGlyphs += 1
+                lastReferences[data] = glyphID
+                glyphSubtables[glyphID] = data
+
+        if numSharedGlyphs:
+            logger.info(
+                f"{numSharedGlyphs} glyphs share their VarC glyph data with another glyph"
+            )
+
+        pos = 4 + 2 + 4 * numGlyphs + 4  # header size
+        subtables = sorted(lastReferences, key=lastReferences.__getitem__)
+        subtableOffsets = {}
+        for data in subtables:
+            subtableOffsets[data] = pos
+            pos += len(data)
+        glyphOffsets = [
+            0 if data is None else subtableOffsets[data] for data in glyphSubtables
+        ]
 
         if self.VarStore is not None:
-            sub = _getSubWriter(writer)
-            self.VarStore.compile(sub, ttFont)
+            varStoreWriter = OTTableWriter()
+            self.VarStore.compile(varStoreWriter, ttFont)
+            varStoreData = varStoreWriter.getAllData()
+            varStoreOffset = pos
         else:
-            writer.writeULong(0x00000000)
+            varStoreData = b""
+            varStoreOffset = 0
 
-        return writer.getAllData()
+        data = bytearray(struct.pack(">LH", self.Version, numGlyphs))
+        data += struct.pack(f">{numGlyphs}L", *glyphOffsets)
+        data += struct.pack(">L", varStoreOffset)
+        for subtable in subtables:
+            data += subtable
+        data += varStoreData
+        return bytes(data)
 
     def toXML(self, writer, ttFont, **kwargs):
         glyfTable = ttFont["glyf"]
         writer.simpletag("Version", [("value", f"0x{self.Version:08X}")])
         writer.newline()
 
+        # The glyphs are written one by one, straight to the writer, and the
+        # glyphs that were not decompiled before are not kept around
+        glyphData = self.GlyphData
+        getComponents = getattr(glyphData, "peek", glyphData.__getitem__)
+
         writer.begintag("GlyphData")
         writer.newline()
-        for glyphName, glyphData in sorted(self.GlyphData.items()):
-            try:
-                glyfGlyph = glyfTable[glyphName]
-            except KeyError:
+        for glyphName in self.getDumpGlyphNames(ttFont):
+            glyfGlyph = glyfTable.glyphs.get(glyphName)
+            if glyfGlyph is None:
                 print(f"WARNING: glyph {glyphName} does not exist in the VF, skipping")
                 continue
             if not glyfGlyph.isComposite():
@@ -237,57 +282,18 @@ class table_VarC(DefaultTable):
                     f"WARNING: glyph {glyphName} is not a composite in the VF, skipping"
                 )
                 continue
-            assert len(glyfGlyph.components) == len(glyphData)  # TODO: Proper error
+            components = getComponents(glyphName)
+            if self.dumpComments:
+                glyfComponents = glyfTable[glyphName].components
+            else:
+                glyfComponents = [None] * getNumComponents(glyfTable, glyphName)
+            assert len(glyfComponents) == len(components)  # TODO: Proper error
             writer.begintag("Glyph", [("name", glyphName)])
             writer.newline()
             for index, (varcComponent, glyfComponent) in enumerate(
-                zip(glyphData, glyfGlyph.components)
+                zip(components, glyfComponents)
             ):
-                writer.begintag(
-                    "Component",
-                    [("numIntBitsForScale", varcComponent.numIntBitsForScale)],
-                )
-                writer.newline()
-                writer.comment(
-                    f"component index: {index}; "
-                    f"base glyph: {glyfComponent.glyphName}; "
-                    f"offset: ({glyfComponent.x},{glyfComponent.y})"
-                )
-                writer.newline()
-
-                for axisName, valueDict in sorted(varcComponent.coord.items()):
-                    attrs = [
-                        ("axis", axisName),
-                        (
-                            "value",
-                            floatToFixedToStr(valueDict["value"], COORD_PRECISIONBITS),
-                        ),
-                    ]
-                    if "varIdx" in valueDict:
-                        outer, inner = splitVarIdx(valueDict["varIdx"])
-                        attrs.extend([("outer", outer), ("inner", inner)])
-                    writer.simpletag("Coord", attrs)
-                    writer.newline()
-
-                scalePrecisionBits = 16 - varcComponent.numIntBitsForScale
-
-                for transformFieldName, valueDict in sorted(
-                    varcComponent.transform.items()
-                ):
-                    value = valueDict["value"]
-                    if transformFieldName in {"ScaleX", "ScaleY"}:
-                        value = floatToFixedToStr(value, scalePrecisionBits)
-                    elif transformFieldName in {"Rotation", "SkewX", "SkewY"}:
-                        value = degreestToIntToStr(value)
-                    attrs = [("value", value)]
-                    if "varIdx" in valueDict:
-                        outer, inner = splitVarIdx(valueDict["varIdx"])
-                        attrs.extend([("outer", outer), ("inner", inner)])
-                    writer.simpletag(transformFieldName, attrs)
-                    writer.newline()
-
-                writer.endtag("Component")
-                writer.newline()
+                _componentToXML(writer, index, varcComponent, glyfComponent)
             writer.endtag("Glyph")
             writer.newline()
         writer.endtag("GlyphData")
@@ -296,14 +302,43 @@ class table_VarC(DefaultTable):
         if hasattr(self, "VarStore") and self.VarStore is not None:
             self.VarStore.toXML(writer, ttFont)
 
+    def getDumpGlyphNames(self, ttFont):
+        """Return the sorted names of the glyphs toXML() should write: all
+        glyphs, or the ones selected by dumpGlyphNames and dumpUnicodes,
+        including the glyphs they use as components.
+        """
+        glyphData = self.GlyphData
+        if self.dumpGlyphNames is None and self.dumpUnicodes is None:
+            return sorted(glyphData.keys())
+
+        glyphNames = set(self.dumpGlyphNames or ())
+        if self.dumpUnicodes:
+            cmap = ttFont.getBestCmap()
+            glyphNames.update(cmap[uni] for uni in self.dumpUnicodes if uni in cmap)
+
+        # Glyphs without VarC data, like plain glyf composites, are not dumped,
+        # but their components may have VarC data
+        glyfTable = ttFont["glyf"]
+        seenGlyphNames = set()
+        stack = sorted(glyphNames)
+        while stack:
+            glyphName = stack.pop()
+            if glyphName in seenGlyphNames:
+                continue
+            seenGlyphNames.add(glyphName)
+            if glyphName in glyfTable:
+                stack.extend(glyfTable[glyphName].getComponentNames(glyfTable))
+        return sorted(
+            glyphName for glyphName in seenGlyphNames if glyphName in glyphData
+        )
+
     def fromXML(self, name, attrs, content, ttFont):
         if name == "Version":
-            self.Version = literal_eval(attrs["value"])
+            self.Version = int(attrs["value"], 0)
         elif name == "GlyphData":
             self.GlyphData = {}
             for name, attrs, content in _filterContent(content):
-                glyphName = attrs["name"]
-                self.GlyphData[glyphName] = _glyph_fromXML(name, attrs, content, ttFont)
+                self.glyphFromXML(name, attrs, content, ttFont)
         elif name == "VarStore":
             self.VarStore = VarStore()
             for name, attrs, content in _filterContent(content):
@@ -311,6 +346,217 @@ class table_VarC(DefaultTable):
         else:
             assert False, f"Unknown VarC sub-element {name}"
 
+    def beginGlyphDataXML(self):
+        """Start an empty GlyphData, whose glyphs are then passed to
+        glyphFromXML() one by one, as VarCXMLReader does.
+        """
+        self.GlyphData = {}
+
+    def glyphFromXML(self, name, attrs, content, ttFont):
+        if not hasattr(self, "GlyphData"):
+            self.GlyphData = {}
+        self.GlyphData[attrs["name"]] = _glyph_fromXML(name, attrs, content, ttFont)
+
+
+class VarCXMLReader(XMLReader):
+    """An XMLReader that passes each Glyph element of a VarC table to the table
+    as soon as it is parsed, instead of first building the element tree for the
+    entire GlyphData element. Use it instead of XMLReader where a font is read
+    from TTX, as ttxv does.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._elementNames = []  # the open elements outside VarC GlyphData
+        self._varcTable = None  # the VarC table, while in its GlyphData
+        self._glyphElements = []  # the open elements in VarC GlyphData
+
+    def _startElementHandler(self, name, attrs):
+        if self._varcTable is not None:
+            element = (name, attrs, [])
+            if self._glyphElements:
+                self._glyphElements[-1][2].append(element)
+            self._glyphElements.append(element)
+        elif name == "GlyphData" and self._elementNames == ["ttFont", "VarC"]:
+            varcTable = self.ttFont["VarC"]
+            varcTable.beginGlyphDataXML()
+            self._varcTable = varcTable
+        else:
+            self._elementNames.append(name)
+            super()._startElementHandler(name, attrs)
+
+    def _endElementHandler(self, name):
+        if self._varcTable is not None:
+            if not self._glyphElements:  # the end of GlyphData
+                self._varcTable = None
+                return
+            element = self._glyphElements.pop()
+            if not self._glyphElements:
+                self._varcTable.glyphFromXML(*element, self.ttFont)
+        else:
+            self._elementNames.pop()
+            super()._endElementHandler(name)
+
+    def _characterDataHandler(self, data):
+        if self._varcTable is not None:
+            if self._glyphElements:
+                self._glyphElements[-1][2].append(data)
+        else:
+            super()._characterDataHandler(data)
+
+
+class LazyGlyphData(MutableMapping):
+    """The GlyphData of a decompiled VarC table: a mapping of glyph names to
+    lists of ComponentRecord objects. Initially only the offsets of the glyph
+    subtables are known, a glyph's components are decompiled when it is first
+    accessed.
+    """
+
+    def __init__(self, data, glyphOffsets, glyfTable, axisTags):
+        self.data = data  # the VarC table data
+        self._glyfTable = glyfTable
+        self._axisTags = axisTags
+        # Values are either an offset (int) or a list of components
+        self._glyphs = dict(glyphOffsets)
+
+    def __getitem__(self, glyphName):
+        components = self._glyphs[glyphName]
+        if isinstance(components, int):
+            components = self._decompileGlyph(glyphName, components)
+            self._glyphs[glyphName] = components
+        return components
+
+    def peek(self, glyphName):
+        """Like __getitem__, but don't keep the components if they had to be
+        decompiled.
+        """
+        components = self._glyphs[glyphName]
+        if isinstance(components, int):
+            components = self._decompileGlyph(glyphName, components)
+        return components
+
+    def getGlyphOffsets(self):
+        """Return a dict mapping the names of the glyphs whose components were
+        not decompiled or set yet to the offsets of their subtables in
+        self.data. The other glyphs may have been modified.
+        """
+        return {
+            glyphName: glyphOffset
+            for glyphName, glyphOffset in self._glyphs.items()
+            if isinstance(glyphOffset, int)
+        }
+
+    def _decompileGlyph(self, glyphName, glyphOffset):
+        from fontTools.ttLib.tables.otConverters import OTTableReader
+
+        reader = OTTableReader(self.data, offset=glyphOffset)
+        numComponents = getNumComponents(self._glyfTable, glyphName)
+        return decompileGlyph(reader, numComponents, self._axisTags)
+
+    def __setitem__(self, glyphName, components):
+        self._glyphs[glyphName] = components
+
+    def __delitem__(self, glyphName):
+        del self._glyphs[glyphName]
+
+    def __contains__(self, glyphName):
+        return glyphName in self._glyphs
+
+    def __iter__(self):
+        return iter(self._glyphs)
+
+    def __len__(self):
+        return len(self._glyphs)
+
+
+def getNumComponents(glyfTable, glyphName):
+    """Return the number of components of a composite glyf glyph. If the glyph
+    was not yet expanded, the count is taken from the raw glyph data, without
+    decompiling it.
+    """
+    glyfGlyph = glyfTable.glyphs[glyphName]
+    if hasattr(glyfGlyph, "data"):
+        return countCompositeComponents(glyfGlyph.data)
+    assert glyfGlyph.isComposite()
+    return len(glyfGlyph.components)
+
+
+def countCompositeComponents(glyfData):
+    (numberOfContours,) = struct.unpack_from(">h", glyfData)
+    assert numberOfContours == -1, "not a composite glyph"
+    pos = 10  # skip the glyph header
+    numComponents = 0
+    flags = MORE_COMPONENTS
+    while flags & MORE_COMPONENTS:
+        (flags,) = struct.unpack_from(">H", glyfData, pos)
+        numComponents += 1
+        pos += 8 if flags & ARG_1_AND_2_ARE_WORDS else 6
+        if flags & WE_HAVE_A_SCALE:
+            pos += 2
+        elif flags & WE_HAVE_AN_X_AND_Y_SCALE:
+            pos += 4
+        elif flags & WE_HAVE_A_TWO_BY_TWO:
+            pos += 8
+    return numComponents
+
+
+def _componentToXML(writer, index, varcComponent, glyfComponent):
+    writer.begintag(
+        "Component", [("numIntBitsForScale", varcComponent.numIntBitsForScale)]
+    )
+    writer.newline()
+    if glyfComponent is not None:
+        writer.comment(
+            f"component index: {index}; "
+            f"base glyph: {glyfComponent.glyphName}; "
+            f"offset: ({glyfComponent.x},{glyfComponent.y})"
+        )
+        writer.newline()
+
+    # XMLWriter.simpletag() is slow, so the tags are formatted here. None of
+    # the values need to be escaped, except for the axis names.
+    for axisName, valueDict in sorted(varcComponent.coord.items()):
+        writer._writeraw(
+            f'<Coord axis="{_escapeAxisName(axisName)}" '
+            f'value="{_coordToStr(valueDict["value"])}"'
+            f"{_varIdxToAttrStr(valueDict)}/>"
+        )
+        writer.newline()
+
+    scalePrecisionBits = 16 - varcComponent.numIntBitsForScale
+
+    for transformFieldName, valueDict in sorted(varcComponent.transform.items()):
+        value = valueDict["value"]
+        if transformFieldName in {"ScaleX", "ScaleY"}:
+            value = _floatToFixedToStr(value, scalePrecisionBits)
+        elif transformFieldName in {"Rotation", "SkewX", "SkewY"}:
+            value = _degreesToIntToStr(value)
+        writer._writeraw(
+            f'<{transformFieldName} value="{value}"{_varIdxToAttrStr(valueDict)}/>'
+        )
+        writer.newline()
+
+    writer.endtag("Component")
+    writer.newline()
+
+
+def _varIdxToAttrStr(valueDict):
+    varIdx = valueDict.get(VARIDX_KEY)
+    if varIdx is None:
+        return ""
+    outer, inner = splitVarIdx(varIdx)
+    return f' outer="{outer}" inner="{inner}"'
+
+
+# Many values repeat throughout the table, so formatting them is cached
+_escapeAxisName = functools.lru_cache(maxsize=None)(escapeattr)
+_floatToFixedToStr = functools.lru_cache(maxsize=0x10000)(floatToFixedToStr)
+_degreesToIntToStr = functools.lru_cache(maxsize=0x10000)(degreestToIntToStr)
+
+
+def _coordToStr(value):
+    return _floatToFixedToStr(value, COORD_PRECISIONBITS)
+
 
 def _glyph_fromXML(name, attrs, content, ttFont):
     assert name == "Glyph"
@@ -322,41 +568,52 @@ def _glyph_fromXML(name, attrs, content, ttFont):
 
 def _component_fromXML(name, attrs, content, ttFont):
     assert name == "Component"
-    numIntBitsForScale = literal_eval(attrs["numIntBitsForScale"])
-    scaleConverter = functools.partial(
-        strToFixedToFloat, precisionBits=16 - numIntBitsForScale
-    )
+    numIntBitsForScale = int(attrs["numIntBitsForScale"])
+    scaleConverter = _getStrToFloatConverterForNumIntBitsForScale(numIntBitsForScale)
     coord = dict()
     transform = dict()
     for name, attrs, content in _filterContent(content):
         if name == "Coord":
-            coord[attrs["axis"]] = _makeValueDict(attrs, strToFixedCoordToFloat)
+            coord[attrs["axis"]] = _makeValueDict(attrs, _strToCoord)
         else:
             if name in {"ScaleX", "ScaleY"}:
                 converter = scaleConverter
             elif name in {"Rotation", "SkewX", "SkewY"}:
-                converter = strToIntToDegrees
+                converter = _strToIntToDegrees
             else:
-                converter = None
+                converter = _strToNumber
             transform[name] = _makeValueDict(attrs, converter)
     return ComponentRecord(coord, transform, numIntBitsForScale)
 
 
-def _makeValueDict(attrs, converter=None):
-    value = attrs["value"]
-    if converter is not None:
-        value = converter(value)
-    else:
-        value = literal_eval(value)
-    valueDict = dict(value=value)
+def _makeValueDict(attrs, converter):
+    valueDict = dict(value=converter(attrs["value"]))
     if "outer" in attrs:
-        outer = literal_eval(attrs["outer"])
-        inner = literal_eval(attrs["inner"])
+        outer = int(attrs["outer"])
+        inner = int(attrs["inner"])
         varIdx = (outer << 16) | inner
         valueDict[VARIDX_KEY] = varIdx
     return valueDict
 
 
+def _strToNumber(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+_strToCoord = functools.lru_cache(maxsize=0x10000)(strToFixedCoordToFloat)
+_strToIntToDegrees = functools.lru_cache(maxsize=0x10000)(strToIntToDegrees)
+
+
+@functools.lru_cache(maxsize=None)
+def _getStrToFloatConverterForNumIntBitsForScale(numIntBits):
+    return functools.lru_cache(maxsize=0x10000)(
+        functools.partial(strToFixedToFloat, precisionBits=16 - numIntBits)
+    )
+
+
 def _filterContent(content):
     return [item for item in content if isinstance(item, tuple)]
 
@@ -369,227 +626,353 @@ def splitVarIdx(value):
 # Compile
 
 
-def compileGlyph(writer, components, axisTags, axisTagToIndex):
-    for component in components:
-        compileComponent(writer, component, axisTags, axisTagToIndex)
-
-
-def compileComponent(writer, component, axisTags, axisTagToIndex):
-    flags = component.numIntBitsForScale
-    assert flags == flags & NUM_INT_BITS_FOR_SCALE_MASK
-
-    numAxes = len(component.coord)
-    coordFlags, coordData, coordVarIdxs = _compileCoords(
-        component.coord, axisTags, axisTagToIndex
+def compileGlyphData(components, axisTags, axisTagToIndex):
+    return b"".join(
+        [packComponent(component, axisTags, axisTagToIndex) for component in components]
     )
-    flags |= coordFlags
 
-    transformFlags, transformData, transformVarIdxs = _compileTransform(
-        component.transform, component.numIntBitsForScale
-    )
-    flags |= transformFlags
-    varIdxs = coordVarIdxs + transformVarIdxs
 
-    writer.writeUShort(flags)
-    if flags & AXIS_INDICES_ARE_WORDS:
-        writer.writeUShort(numAxes)
-    else:
-        writer.writeUInt8(numAxes)
-
-    writer.writeData(coordData)
-    writer.writeData(transformData)
-    compileVarIdxs(writer, varIdxs)
+def compileGlyph(writer, components, axisTags, axisTagToIndex):
+    writer.writeData(compileGlyphData(components, axisTags, axisTagToIndex))
 
 
-def _compileCoords(coordDict, axisTags, axisTagToIndex):
-    coordFlags = 0
-    axisIndices = sorted(axisTagToIndex[k] for k in coordDict)
-    numAxes = len(axisIndices)
-    if numAxes and max(axisIndices) > 127:
-        axisIndexFormat = ">" + "H" * numAxes
-        coordFlags |= AXIS_INDICES_ARE_WORDS
-        maxAxisIndex = 0x7FFF
-        hasVarIdxFlag = 0x8000
+def compileComponent(writer, component, axisTags, axisTagToIndex):
+    writer.writeData(packComponent(component, axisTags, axisTagToIndex))
+
+
+def packComponent(component, axisTags, axisTagToIndex):
+    """Compile a ComponentRecord, return bytes."""
+    numIntBitsForScale = component.numIntBitsForScale
+    assert numIntBitsForScale == numIntBitsForScale & NUM_INT_BITS_FOR_SCALE_MASK
+    flags = numIntBitsForScale
+
+    values = []
+    varIdxs = []
+
+    coordDict = component.coord
+    numAxes = len(coordDict)
+    if numAxes:
+        axisIndices = [axisTagToIndex[axisTag] for axisTag in coordDict]
+        valueDicts = list(coordDict.values())
+        if numAxes > 1:
+            sortedAxisIndices = sorted(axisIndices)
+            if axisIndices != sortedAxisIndices:
+                order = sorted(range(numAxes), key=axisIndices.__getitem__)
+                valueDicts = [valueDicts[i] for i in order]
+                axisIndices = sortedAxisIndices
+        maxAxisIndex = axisIndices[-1]
+        if maxAxisIndex > 127:
+            assert maxAxisIndex <= 0x7FFF
+            flags |= AXIS_INDICES_ARE_WORDS
+            hasVarIdxFlag = 0x8000
+        else:
+            hasVarIdxFlag = 0x80
+        for i, valueDict in enumerate(valueDicts):
+            # Same as fixedCoord(), inlined
+            values.append(_floor(valueDict["value"] * _coordFactor + 0.5))
+            varIdx = valueDict.get(VARIDX_KEY)
+            if varIdx is not None:
+                axisIndices[i] |= hasVarIdxFlag
+                varIdxs.append(varIdx)
     else:
-        axisIndexFormat = ">" + "B" * numAxes
-        maxAxisIndex = 0x7F
-        hasVarIdxFlag = 0x80
+        axisIndices = []
 
-    coordValues = []
-    coordVarIdxs = []
-    for i, axisIndex in enumerate(axisIndices):
-        assert axisIndex <= maxAxisIndex
-        axisName = axisTags[axisIndex]
-        valueDict = coordDict[axisName]
-        coordValues.append(fixedCoord(valueDict["value"]))
-        if VARIDX_KEY in valueDict:
-            coordVarIdxs.append(valueDict[VARIDX_KEY])
-            axisIndices[i] |= hasVarIdxFlag
-
-    axisIndicesData = struct.pack(axisIndexFormat, *axisIndices)
-    axisValuesData = struct.pack(">" + "h" * numAxes, *coordValues)
-    return coordFlags, axisIndicesData + axisValuesData, coordVarIdxs
-
-
-def _compileTransform(transformDict, numIntBitsForScale):
-    transformFlags = 0
-    hasTransformVariations = transformDict and VARIDX_KEY in next(
-        iter(transformDict.values())
+    transformDict = component.transform
+    if transformDict:
+        hasTransformVariations = VARIDX_KEY in next(iter(transformDict.values()))
+        if hasTransformVariations:
+            flags |= HAS_TRANSFORM_VARIATIONS
+        transformFlags, transformFields = _getTransformPackLayout(
+            tuple(transformDict), numIntBitsForScale
+        )
+        flags |= transformFlags
+        for fieldName, convert, factor, limit in transformFields:
+            valueDict = transformDict[fieldName]
+            value = valueDict["value"]
+            if factor is not None and -limit < value < limit:
+                # Same as convert(value), inlined
+                values.append(_floor(value * factor + 0.5))
+            else:
+                values.append(convert(value))
+            if hasTransformVariations:
+                varIdxs.append(valueDict[VARIDX_KEY])
+
+    # The varIdx array is packed along with the rest of the component, except
+    # for 3-byte entries, which struct has no format for
+    if varIdxs:
+        entryFormat, entrySize, entries = _encodeVarIdxs(varIdxs)
+    else:
+        entryFormat, entrySize, entries = 0, 1, varIdxs
+    if entrySize == 3:
+        componentStruct = _getComponentPackStruct(flags, numAxes, 0, 1)
+        data = componentStruct.pack(flags, numAxes, *axisIndices, *values, entryFormat)
+        return data + b"".join(entry.to_bytes(3, "big") for entry in entries)
+    componentStruct = _getComponentPackStruct(flags, numAxes, len(entries), entrySize)
+    return componentStruct.pack(
+        flags, numAxes, *axisIndices, *values, entryFormat, *entries
     )
-    if hasTransformVariations:
-        transformFlags |= HAS_TRANSFORM_VARIATIONS
 
-    scaleConverter = getToFixedConverterForNumIntBitsForScale(numIntBitsForScale)
 
-    transformValues = []
-    transformVarIdxs = []
+_floor = math.floor
+_coordFactor = 1 << COORD_PRECISIONBITS
+
+_componentPackStructCache = {}
+
+
+def _getComponentPackStruct(flags, numAxes, numVarIdxs, entrySize):
+    """Return a struct.Struct object to pack a whole component in one go: the
+    flags, the number of axes, the axis indices, the axis values, the transform
+    values, the varIdx entry format and the varIdx entries.
+    """
+    key = flags, numAxes, numVarIdxs, entrySize
+    componentStruct = _componentPackStructCache.get(key)
+    if componentStruct is None:
+        numTransformValues = sum(
+            1 for mask in transformFieldFlags.values() if flags & mask
+        )
+        axisIndexFormat = "H" if flags & AXIS_INDICES_ARE_WORDS else "B"
+        componentStruct = struct.Struct(
+            f">H{axisIndexFormat}{numAxes}{axisIndexFormat}"
+            f"{numAxes + numTransformValues}h"
+            f"B{numVarIdxs}{_varIdxEntryFormats[entrySize]}"
+        )
+        _componentPackStructCache[key] = componentStruct
+    return componentStruct
+
+
+@functools.lru_cache(maxsize=None)
+def _getTransformPackLayout(fieldNames, numIntBitsForScale):
+    """Return the flags for a transform with the fields in fieldNames, and a
+    (fieldName, converter, factor, limit) tuple for each of these fields, in
+    the order they are stored. For values between -limit and limit, the
+    converter returns otRound(value * factor); the factor is None for
+    converters that don't round.
+    """
+    scaleConverter = getToFixedConverterForNumIntBitsForScale(numIntBitsForScale)
+    scaleFactor = 1 << (16 - numIntBitsForScale)
+    flags = 0
+    fields = []
     for fieldName in transformFieldNames:
-        valueDict = transformDict.get(fieldName)
-        if valueDict is None:
+        if fieldName not in fieldNames:
             continue
-        convert = transformToIntConverters[fieldName]
-        if convert is None:
-            assert fieldName in {"ScaleX", "ScaleY"}
-            convert = scaleConverter
-        transformFlags |= transformFieldFlags[fieldName]
-        transformValues.append(convert(valueDict["value"]))
-        if hasTransformVariations:
-            transformVarIdxs.append(valueDict[VARIDX_KEY])
-
-    transformData = struct.pack(">" + "h" * len(transformValues), *transformValues)
-    return transformFlags, transformData, transformVarIdxs
+        flags |= transformFieldFlags[fieldName]
+        convert = transformToIntConverters[fieldName] or scaleConverter
+        if convert is degreesToInt:
+            factor, limit = DEGREES_SCALE, 360
+        elif convert is scaleConverter:
+            factor, limit = scaleFactor, math.inf
+        else:
+            factor = limit = None
+        fields.append((fieldName, convert, factor, limit))
+    return flags, fields
 
 
 def compileVarIdxs(writer, varIdxs):
+    writer.writeData(packVarIdxs(varIdxs))
+
+
+def packVarIdxs(varIdxs):
+    """Compile a varIdx array, return bytes."""
+    if not varIdxs:
+        return b"\0"  # 1-byte entries, 1 inner bit
+    entryFormat, entrySize, entries = _encodeVarIdxs(varIdxs)
+    if entrySize == 3:
+        varIdxData = b"".join(entry.to_bytes(3, "big") for entry in entries)
+    else:
+        varIdxData = _getVarIdxStruct(entrySize, len(entries)).pack(*entries)
+    return bytes([entryFormat]) + varIdxData
+
+
+def _encodeVarIdxs(varIdxs):
+    """Return the entry format, the entry size and the entries of a non-empty
+    varIdx array.
+    """
     # Mostly taken from fontTools.ttLib.tables.otTables.VarIdxMap.preWrite()
     ored = 0
     for idx in varIdxs:
         ored |= idx
 
-    inner = ored & 0xFFFF
-    innerBits = 0
-    while inner:
-        innerBits += 1
-        inner >>= 1
-    innerBits = max(innerBits, 1)
-    assert innerBits <= 16
-    innerMask = (1 << innerBits) - 1
-    outerMask = 0xFFFFFFFF - innerMask
+    innerBits = (ored & 0xFFFF).bit_length() or 1
+    if innerBits == 16 or not ored >> 16:
+        # outer and inner are stored as is
+        entries = varIdxs
+    else:
+        # The bits of inner above innerBits are all zero, the outer bits move
+        # down to follow the inner bits
+        ored = ((ored >> 16) << innerBits) | (ored & 0xFFFF)
+        entries = [((idx >> 16) << innerBits) | (idx & 0xFFFF) for idx in varIdxs]
 
-    ored = (ored >> (16 - innerBits)) | (ored & ((1 << innerBits) - 1))
     if ored <= 0x000000FF:
         entrySize = 1
-        write = writer.writeUInt8
     elif ored <= 0x0000FFFF:
         entrySize = 2
-        write = writer.writeUShort
     elif ored <= 0x00FFFFFF:
         entrySize = 3
-        write = writer.writeUInt24
     else:
         entrySize = 4
-        write = writer.writeULong
 
     entryFormat = ((entrySize - 1) << 4) | (innerBits - 1)
-    writer.writeUInt8(entryFormat)
-    outerShift = 16 - innerBits
-    varIdxInts = [
-        ((idx & outerMask) >> outerShift) | (idx & innerMask) for idx in varIdxs
-    ]
-    for value in varIdxInts:
-        write(value)
+    return entryFormat, entrySize, entries
+
+
+_varIdxEntryFormats = {1: "B", 2: "H", 4: "I"}
 
 
 # Decompile
 
 
-def decompileGlyph(reader, glyfGlyph, axisTags):
-    assert glyfGlyph.isComposite()
-    numComponents = len(glyfGlyph.components)
+def decompileGlyph(reader, numComponents, axisTags):
+    data = reader.data
+    pos = reader.pos
     components = []
     for i in range(numComponents):
-        components.append(decompileComponent(reader, axisTags))
+        component, pos = unpackComponent(data, pos, axisTags)
+        components.append(component)
+    reader.pos = pos
     return components
 
 
 def decompileComponent(reader, axisTags):
-    flags = reader.readUShort()
-
-    numIntBitsForScale = flags & NUM_INT_BITS_FOR_SCALE_MASK
-    scaleConverter = getToFloatConverterForNumIntBitsForScale(numIntBitsForScale)
+    component, reader.pos = unpackComponent(reader.data, reader.pos, axisTags)
+    return component
+
+
+_unpackUShort = struct.Struct(">H").unpack_from
+_coordScale = 1 / (1 << COORD_PRECISIONBITS)
+
+_componentFormatCache = {}
+
+
+def _getComponentFormat(flags, numAxes):
+    """Return a struct.Struct object to unpack the axis indices, axis values and
+    transform values of a component in one go, plus the names of the transform
+    fields present and their converters, based on the component's flags and
+    number of axes.
+    """
+    key = flags, numAxes
+    componentFormat = _componentFormatCache.get(key)
+    if componentFormat is None:
+        transformFields = [
+            fieldName for fieldName, mask in transformFieldFlags.items() if flags & mask
+        ]
+        scaleConverter = getToFloatConverterForNumIntBitsForScale(
+            flags & NUM_INT_BITS_FOR_SCALE_MASK
+        )
+        transformConverters = [
+            transformFromIntConverters[fieldName] or scaleConverter
+            for fieldName in transformFields
+        ]
+        axisIndexFormat = "H" if flags & AXIS_INDICES_ARE_WORDS else "B"
+        componentStruct = struct.Struct(
+            f">{numAxes}{axisIndexFormat}{numAxes + len(transformFields)}h"
+        )
+        componentFormat = (
+            componentStruct,
+            list(zip(transformFields, transformConverters)),
+        )
+        _componentFormatCache[key] = componentFormat
+    return componentFormat
+
+
+def unpackComponent(data, pos, axisTags):
+    """Decompile the component record at data[pos:], return the ComponentRecord
+    and the position following the record.
+    """
+    (flags,) = _unpackUShort(data, pos)
 
     if flags & AXIS_INDICES_ARE_WORDS:
-        numAxes = reader.readUShort()
-        axisIndices = reader.readArray("H", 2, numAxes)
+        (numAxes,) = _unpackUShort(data, pos + 2)
+        pos += 4
         hasVarIdxFlag = 0x8000
-        axisIndexMask = 0xFFFF - hasVarIdxFlag
     else:
-        numAxes = reader.readUInt8()
-        axisIndices = reader.readArray("B", 1, numAxes)
+        numAxes = data[pos + 2]
+        pos += 3
         hasVarIdxFlag = 0x80
-        axisIndexMask = 0xFF - hasVarIdxFlag
 
-    axisHasVarIdx = [bool(axisIndex & hasVarIdxFlag) for axisIndex in axisIndices]
-    axisIndices = [axisIndex & axisIndexMask for axisIndex in axisIndices]
+    componentStruct, transformFields = _getComponentFormat(flags, numAxes)
+    values = componentStruct.unpack_from(data, pos)
+    pos += componentStruct.size
 
-    coord = [
-        (axisTags[i], dict(value=fixedToFloat(reader.readShort(), COORD_PRECISIONBITS)))
-        for i in axisIndices
-    ]
-    numVarIdxs = sum(axisHasVarIdx)
+    axisIndices = values[:numAxes]
+    axisHasVarIdx = [axisIndex & hasVarIdxFlag for axisIndex in axisIndices]
+    numVarIdxs = numAxes - axisHasVarIdx.count(0)
+    hasTransformVariations = flags & HAS_TRANSFORM_VARIATIONS
+    if hasTransformVariations:
+        numVarIdxs += len(transformFields)
+    if numVarIdxs:
+        varIdxs, pos = unpackVarIdxs(data, pos, numVarIdxs)
+        varIdxs = iter(varIdxs)
+    else:
+        pos += 1  # skip the entry format of the empty varIdx array
+
+    coord = {}
+    if numAxes:
+        axisIndexMask = hasVarIdxFlag - 1
+        for axisIndex, hasVarIdx, value in zip(
+            axisIndices, axisHasVarIdx, values[numAxes : 2 * numAxes]
+        ):
+            if hasVarIdx:
+                valueDict = {"value": value * _coordScale, VARIDX_KEY: next(varIdxs)}
+            else:
+                valueDict = {"value": value * _coordScale}
+            coord[axisTags[axisIndex & axisIndexMask]] = valueDict
+
+    transform = {}
+    if transformFields:
+        for (fieldName, convert), value in zip(transformFields, values[2 * numAxes :]):
+            if hasTransformVariations:
+                valueDict = {"value": convert(value), VARIDX_KEY: next(varIdxs)}
+            else:
+                valueDict = {"value": convert(value)}
+            transform[fieldName] = valueDict
 
-    transform = []
-    for fieldName, mask in transformFieldFlags.items():
-        if not (flags & mask):
-            continue
-        value = reader.readShort()
+    return (
+        ComponentRecord(coord, transform, flags & NUM_INT_BITS_FOR_SCALE_MASK),
+        pos,
+    )
 
-        convert = transformFromIntConverters[fieldName]
-        if convert is None:
-            assert fieldName in {"ScaleX", "ScaleY"}
-            convert = scaleConverter
-        transform.append((fieldName, dict(value=convert(value))))
 
-    if flags & HAS_TRANSFORM_VARIATIONS:
-        numVarIdxs += len(transform)
+def decompileVarIdxs(reader, count):
+    varIdxs, reader.pos = unpackVarIdxs(reader.data, reader.pos, count)
+    return varIdxs
 
-    varIdxs = decompileVarIdxs(reader, numVarIdxs)
-    assert len(axisHasVarIdx) == len(coord)
-    for hasVarIdx, (axisTag, valueDict) in zip(axisHasVarIdx, coord):
-        if hasVarIdx:
-            valueDict[VARIDX_KEY] = varIdxs.pop(0)
 
-    if flags & HAS_TRANSFORM_VARIATIONS:
-        for fieldName, valueDict in transform:
-            valueDict[VARIDX_KEY] = varIdxs.pop(0)
+_varIdxStructCache = {}
 
-    assert not varIdxs
 
-    return ComponentRecord(dict(coord), dict(transform), numIntBitsForScale)
+def _getVarIdxStruct(entrySize, count):
+    key = entrySize, count
+    varIdxStruct = _varIdxStructCache.get(key)
+    if varIdxStruct is None:
+        varIdxStruct = struct.Struct(f">{count}{_varIdxEntryFormats[entrySize]}")
+        _varIdxStructCache[key] = varIdxStruct
+    return varIdxStruct
 
 
-def decompileVarIdxs(reader, count):
-    entryFormat = reader.readUInt8()
+def unpackVarIdxs(data, pos, count):
+    """Decompile count varIdxs starting at data[pos:], return a list of varIdxs
+    and the position following the data.
+    """
+    entryFormat = data[pos]
+    pos += 1
     innerBits = (entryFormat & 0x0F) + 1
     entrySize = (entryFormat >> 4) + 1
-    innerMask = (1 << innerBits) - 1
-    outerMask = 0xFFFFFFFF - innerMask
-    outerShift = 16 - innerBits
-    if entrySize == 1:
-        varIdxs = reader.readArray("B", 1, count)
-    elif entrySize == 2:
-        varIdxs = reader.readArray("H", 2, count)
-    elif entrySize == 3:
-        varIdxs = [reader.readUInt24() for i in range(count)]
-    elif entrySize == 4:
-        varIdxs = reader.readArray("I", 4, count)
+    if entrySize == 3:
+        varIdxs = [
+            int.from_bytes(data[i : i + 3], "big")
+            for i in range(pos, pos + 3 * count, 3)
+        ]
     else:
-        assert False, "oops"
+        varIdxs = _getVarIdxStruct(entrySize, count).unpack_from(data, pos)
+    pos += entrySize * count
+    if innerBits == 16:
+        # outer and inner are stored as is
+        return list(varIdxs), pos
+    innerMask = (1 << innerBits) - 1
     varIdxs = [
-        (varIdx & innerMask) + ((varIdx & outerMask) << outerShift)
-        for varIdx in varIdxs
+        (varIdx & innerMask) | ((varIdx >> innerBits) << 16) for varIdx in varIdxs
     ]
-    return varIdxs
+    return varIdxs, pos
 
 
 # Helpers
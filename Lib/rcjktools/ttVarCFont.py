@@ -1,103 +1,448 @@
+from collections import OrderedDict
+import functools
+import mmap
+import os
+import threading
+from fontTools.misc.fixedTools import floatToFixed
+from fontTools.misc.transform import Identity
+from fontTools.pens.recordingPen import RecordingPen, replayRecording
+from fontTools.pens.teePen import TeePen
 from fontTools.pens.transformPen import TransformPen
 from fontTools.ttLib import TTFont
 from fontTools.ttLib.tables._g_l_y_f import GlyphCoordinates
 from fontTools.varLib.iup import iup_delta
-from fontTools.varLib.models import normalizeLocation, supportScalar
+from fontTools.varLib.models import normalizeValue, supportScalar
 from fontTools.varLib.varStore import VarStoreInstancer
 import uharfbuzz as hb
+from rcjktools.compactVarC import CompactVarCGlyphs
 from rcjktools.table_VarC import COORD_PRECISIONBITS, VARIDX_KEY, intToDegrees
 from rcjktools.utils import makeTransformVarCo
+from rcjktools.varStoreInstancer import VarStoreBatchInstancer
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 class TTVarCFont:
-    def __init__(self, path, ttFont=None, hbFont=None):
+    """Draw the glyphs of a VarC font. Drawing is thread-safe: each thread gets
+    its own HarfBuzz font for the shared face, as HarfBuzz fonts carry the
+    variation location, and access to the lazily loaded tables and the shared
+    caches is serialized.
+    """
+
+    def __init__(self, path, ttFont=None, hbFont=None, leafCacheSize=4096):
         if ttFont is not None:
             assert hbFont is not None
             assert path is None
             self.ttFont = ttFont
+            self._fontData = None
         else:
             assert hbFont is None
-            self.ttFont = TTFont(path)
+            # The file is mapped, not read: the TTFont loads its tables from
+            # the mapping when they are first needed
+            with open(path, "rb") as f:
+                self._fontData = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # TTFont only reads tables from the file as they are needed with
+            # lazy=True; with the default lazy=None it first copies the whole
+            # file into memory
+            self.ttFont = TTFont(self._fontData, lazy=True)
+            # But after loading, lazy=None is what the tables need: with
+            # lazy=True, otConverters decompiles the arrays and subtables of
+            # OpenType tables, like the VarStore of VarC that the instancers
+            # read, on first access, which isn't safe from several threads.
+            # glyf and gvar still decompile their glyphs on first access,
+            # which is guarded by self._lock.
+            self.ttFont.lazy = None
         self.axes = {
             axis.axisTag: (axis.minValue, axis.defaultValue, axis.maxValue)
             for axis in self.ttFont["fvar"].axes
         }
+        self.path = path
         if hbFont is not None:
-            self.hbFont = hbFont
+            self._hbFace = hbFont.face
         else:
-            with open(path, "rb") as f:
-                face = hb.Face(f.read())
-            self.hbFont = hb.Font(face)
+            # HarfBuzz maps the file itself, so its pages are shared with ours
+            blob = hb.Blob.from_file_path(os.fspath(path))
+            self._hbFace = hb.Face(blob)
+        self._threadState = threading.local()
+        self._lock = threading.RLock()
+        self._compactVarCGlyphs = None
+        self._componentOffsetModels = {}
+        # Recorded outlines of non-composite glyphs, keyed by glyph ID and
+        # quantized location, least recently used first
+        self.leafCacheSize = leafCacheSize
+        self.leafCacheHits = 0
+        self.leafCacheMisses = 0
+        self._leafOutlines = OrderedDict()
+        self._batchVarCInstancer = None
+        self._batchVarCInstancers = functools.lru_cache(maxsize=8)(
+            self._makeBatchVarCInstancer
+        )
+
+    def close(self):
+        """Close the TTFont and the font file mapping, if this object opened
+        them. The font can't be used after that.
+        """
+        with self._lock:
+            if self._fontData is not None:
+                self.ttFont.close()
+                self._fontData.close()
+                self._fontData = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
 
     def keys(self):
-        return self.ttFont.getGlyphNames()
+        with self._lock:
+            return self.ttFont.getGlyphNames()
 
     def __contains__(self, glyphName):
-        return glyphName in self.ttFont.getReverseGlyphMap()
+        with self._lock:
+            return glyphName in self.ttFont.getReverseGlyphMap()
+
+    @property
+    def hbFont(self):
+        """The HarfBuzz font of the current thread."""
+        return self._getThreadState().hbFont
 
     def drawGlyph(self, pen, glyphName, location):
-        normLocation = normalizeLocation(location, self.axes)
-        fvarTable = self.ttFont["fvar"]
-        glyfTable = self.ttFont["glyf"]
-        varcTable = self.ttFont.get("VarC")
-        if varcTable is not None:
-            glyphData = varcTable.GlyphData
-        else:
-            glyphData = {}
+        self.getRenderContext(location).drawGlyph(pen, glyphName)
+
+    def drawText(self, pen, text, location, features=None, lineHeight=None):
+        """Shape text with HarfBuzz at location, and draw the glyphs with pen,
+        starting at the origin. features is passed on to uharfbuzz.shape(), as
+        a dict like {"kern": True, "liga": False}. Lines are separated by
+        newlines. Each line is drawn lineHeight units below the previous one;
+        by default this is the hhea line height. Return the number of glyphs
+        drawn.
+        """
+        with self._lock:
+            if lineHeight is None:
+                hhea = self.ttFont["hhea"]
+                lineHeight = hhea.ascent - hhea.descent + hhea.lineGap
+            glyphOrder = self.ttFont.getGlyphOrder()
+        context = self.getRenderContext(location)
+        numGlyphs = 0
+        for lineIndex, line in enumerate(text.split("\n")):
+            if not line:
+                continue
+            buf = hb.Buffer()
+            buf.add_str(line)
+            buf.guess_segment_properties()
+            hbFont = self._setHBLocation(context.location)
+            hb.shape(hbFont, buf, features)
+            x, y = 0, -lineIndex * lineHeight
+            for info, pos in zip(buf.glyph_infos, buf.glyph_positions):
+                transform = Identity.translate(x + pos.x_offset, y + pos.y_offset)
+                self._drawGlyph(pen, glyphOrder[info.codepoint], context, transform)
+                x += pos.x_advance
+                y += pos.y_advance
+            numGlyphs += len(buf.glyph_infos)
+        return numGlyphs
+
+    def getAdvanceWidth(self, glyphName, location):
+        """Return the horizontal advance of glyphName at location, as computed
+        by HarfBuzz from the font's HVAR or gvar table.
+        """
+        hbFont = self._setHBLocation(dict(location))
+        with self._lock:
+            glyphID = self.ttFont.getGlyphID(glyphName)
+        return hbFont.get_glyph_h_advance(glyphID)
+
+    def getRenderContext(self, location):
+        """Return a VarCRenderContext for location. Drawing many glyphs with
+        the same context avoids redoing the per-location setup. The context
+        of the previous call from the same thread is reused if the location
+        didn't change. A context should only be used by one thread.
+        """
+        state = self._getThreadState()
+        context = state.renderContext
+        if context is None or context.location != location:
+            context = VarCRenderContext(self, location)
+            state.renderContext = context
+        return context
 
-        g = glyfTable[glyphName]
-        varComponents = glyphData.get(glyphName)
+    def renderMany(self, glyphNames, location, workers=1, processes=False):
+        """Draw the glyphs at location, and return a list with the RecordingPen
+        value of each glyph. With more than 1 workers (None means one per CPU
+        core), the glyphs are drawn by a pool of that many threads, which share
+        the caches of this font, but only run in parallel as far as the GIL
+        allows. With processes=True, worker processes are used instead, which
+        each open the font from self.path.
+        """
+        glyphNames = list(glyphNames)
+        if workers is not None and workers <= 1:
+            return recordGlyphs(self, glyphNames, location)
+        if processes:
+            from rcjktools.instantiateVarC import mapGlyphs
+
+            assert self.path is not None, "the font must be opened from a path"
+            return list(
+                mapGlyphs(recordGlyphs, self.path, glyphNames, (location,), workers)
+            )
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        if workers is None:
+            workers = os.cpu_count()
+        chunkSize = max(1, len(glyphNames) // (8 * workers))
+        chunks = [
+            glyphNames[i : i + chunkSize] for i in range(0, len(glyphNames), chunkSize)
+        ]
+        recordings = []
+        with ThreadPoolExecutor(workers) as executor:
+            for chunkRecordings in executor.map(
+                lambda chunk: recordGlyphs(self, chunk, location), chunks
+            ):
+                recordings.extend(chunkRecordings)
+        return recordings
+
+    def normalizeLocation(self, location):
+        """Like fontTools.varLib.models.normalizeLocation(), but leave out the
+        axes that are at their default, which is equivalent for computing
+        variations, and much cheaper for fonts with many axes.
+        """
+        normLocation = {}
+        for axisTag, value in location.items():
+            triple = self.axes.get(axisTag)
+            if triple is not None:
+                value = normalizeValue(value, triple)
+                if value:
+                    normLocation[axisTag] = value
+        return normLocation
+
+    def _drawGlyph(self, pen, glyphName, context, transform=Identity):
+        # The transforms of nested components are combined, so that a leaf
+        # glyph is drawn through at most one TransformPen
+        with self._lock:
+            g = self.ttFont["glyf"][glyphName]
         if g.isComposite():
-            if varComponents is not None:
-                assert len(g.components) == len(varComponents)
-                varcInstancer = VarStoreInstancer(
-                    varcTable.VarStore, fvarTable.axes, normLocation
-                )
-                componentOffsets = instantiateComponentOffsets(
-                    self.ttFont, glyphName, normLocation
+            compactGlyph = self._getCompactVarCGlyph(glyphName)
+            componentOffsets = self._getComponentOffsetModel(glyphName).instantiate(
+                context.normLocation
+            )
+            if compactGlyph is not None:
+                assert len(g.components) == len(compactGlyph.glyphNames)
+                values = self._compactVarCGlyphs.instantiateValues(
+                    compactGlyph, context.varcInstancer
                 )
-                for (x, y), gc, vc in zip(
-                    componentOffsets, g.components, varComponents
-                ):
-                    componentLocation = unpackComponentLocation(vc.coord, varcInstancer)
-                    transform = unpackComponentTransform(
-                        vc.transform, varcInstancer, vc.numIntBitsForScale
+                components = compactGlyph.iterComponents(values)
+                for (x, y), component in zip(componentOffsets, components):
+                    baseGlyphName, componentLocation, componentTransform = component
+                    componentTransform = transform.transform(
+                        makeTransformVarCo(x, y, *componentTransform)
+                    )
+                    componentContext = VarCRenderContext(
+                        self, componentLocation, isTopLevel=False
+                    )
+                    self._drawGlyph(
+                        pen, baseGlyphName, componentContext, componentTransform
                     )
-                    tPen = TransformPen(pen, _makeTransform(x, y, transform))
-                    self.drawGlyph(tPen, gc.glyphName, componentLocation)
             else:
-                componentOffsets = instantiateComponentOffsets(
-                    self.ttFont, glyphName, normLocation
-                )
+                defaultContext = VarCRenderContext(self, {}, isTopLevel=False)
                 for (x, y), gc in zip(componentOffsets, g.components):
-                    tPen = TransformPen(pen, (1, 0, 0, 1, x, y))
-                    self.drawGlyph(tPen, gc.glyphName, {})
+                    componentTransform = transform.translate(x, y)
+                    self._drawGlyph(
+                        pen, gc.glyphName, defaultContext, componentTransform
+                    )
         else:
+            if transform != Identity:
+                pen = TransformPen(pen, transform)
+            self._drawLeafGlyph(pen, glyphName, context)
+
+    def _drawLeafGlyph(self, pen, glyphName, context):
+        with self._lock:
             glyphID = self.ttFont.getGlyphID(glyphName)
-            self.hbFont.set_variations(location)
-            self.hbFont.draw_glyph_with_pen(glyphID, pen)
+            if not self.leafCacheSize:
+                recording = None
+            else:
+                key = (glyphID, context.quantizedLocation)
+                recording = self._leafOutlines.get(key)
+                if recording is None:
+                    self.leafCacheMisses += 1
+                else:
+                    self.leafCacheHits += 1
+                    self._leafOutlines.move_to_end(key)
+        if not self.leafCacheSize:
+            self._drawHBGlyph(pen, glyphID, context.location)
+        elif recording is None:
+            recordingPen = RecordingPen()
+            self._drawHBGlyph(TeePen(recordingPen, pen), glyphID, context.location)
+            with self._lock:
+                self._leafOutlines[key] = recordingPen.value
+                if len(self._leafOutlines) > self.leafCacheSize:
+                    self._leafOutlines.popitem(last=False)
+        else:
+            replayRecording(recording, pen)
+
+    def _drawHBGlyph(self, pen, glyphID, location):
+        self._setHBLocation(location).draw_glyph_with_pen(glyphID, pen)
+
+    def _setHBLocation(self, location):
+        # Return the HarfBuzz font of the current thread, set to location
+        state = self._getThreadState()
+        if location != state.hbLocation:
+            state.hbFont.set_variations(location)
+            state.hbLocation = location
+        return state.hbFont
+
+    def _getThreadState(self):
+        state = self._threadState
+        if not hasattr(state, "hbFont"):
+            state.hbFont = hb.Font(self._hbFace)
+            state.hbLocation = None  # the location last passed to set_variations
+            state.renderContext = None
+        return state
+
+    def clearLeafCache(self):
+        with self._lock:
+            self._leafOutlines.clear()
+            self.leafCacheHits = self.leafCacheMisses = 0
+
+    def _getCompactVarCGlyph(self, glyphName):
+        with self._lock:
+            if self._compactVarCGlyphs is None:
+                if "VarC" not in self.ttFont:
+                    return None
+                self._compactVarCGlyphs = CompactVarCGlyphs(self.ttFont)
+            return self._compactVarCGlyphs.get(glyphName)
+
+    def _getComponentOffsetModel(self, glyphName):
+        model = self._componentOffsetModels.get(glyphName)
+        if model is None:
+            with self._lock:
+                model = ComponentOffsetModel(self.ttFont, glyphName)
+            self._componentOffsetModels[glyphName] = model
+        return model
+
+    def _getVarCInstancer(self, normLocation, isTopLevel):
+        # When drawing many glyphs at the same location, a batch instancer that
+        # computes all VarStore deltas at once is cheaper. The locations of
+        # nested components vary too much for that to pay off.
+        with self._lock:
+            if isTopLevel and numpy is not None:
+                return self._batchVarCInstancers(tuple(sorted(normLocation.items())))
+            return VarStoreInstancer(
+                self.ttFont["VarC"].VarStore, self.ttFont["fvar"].axes, normLocation
+            )
+
+    def _makeBatchVarCInstancer(self, normLocation):
+        if self._batchVarCInstancer is None:
+            self._batchVarCInstancer = VarStoreBatchInstancer(
+                self.ttFont["VarC"].VarStore, self.ttFont["fvar"].axes
+            )
+        return self._batchVarCInstancer.atLocation(dict(normLocation))
+
+
+class VarCRenderContext:
+    """The state for drawing glyphs of a TTVarCFont at one location: the
+    normalized location and the VarC instancer, which are set up once for all
+    glyphs drawn with the context. Get one with TTVarCFont.getRenderContext().
+    """
+
+    def __init__(self, varcFont, location, isTopLevel=True):
+        self.varcFont = varcFont
+        self.location = dict(location)
+        self.normLocation = varcFont.normalizeLocation(location)
+        self._isTopLevel = isTopLevel
+        self._varcInstancer = None
+        self._quantizedLocation = None
+
+    @property
+    def varcInstancer(self):
+        if self._varcInstancer is None:
+            self._varcInstancer = self.varcFont._getVarCInstancer(
+                self.normLocation, self._isTopLevel
+            )
+        return self._varcInstancer
+
+    @property
+    def quantizedLocation(self):
+        # The normalized location on the F2Dot14 grid, which is what HarfBuzz
+        # uses to instantiate glyphs, as a hashable tuple
+        if self._quantizedLocation is None:
+            quantizedLocation = []
+            for axisTag, value in sorted(self.normLocation.items()):
+                value = floatToFixed(value, 14)
+                if value:
+                    quantizedLocation.append((axisTag, value))
+            self._quantizedLocation = tuple(quantizedLocation)
+        return self._quantizedLocation
+
+    def drawGlyph(self, pen, glyphName):
+        self.varcFont._drawGlyph(pen, glyphName, self)
+
+
+class ComponentOffsetModel:
+    """The component offsets of a composite glyph and their gvar variations.
+    Sparse deltas are expanded with IUP up front, so that instantiating the
+    offsets at a location takes computing one scalar per variation, and a
+    scalars-deltas matrix product.
+    """
+
+    def __init__(self, ttFont, glyphName):
+        glyfTable = ttFont["glyf"]
+        assert glyfTable[glyphName].isComposite()
+        # The vertical phantom points don't matter here, only the offsets do
+        coordinates, controls = glyfTable._getCoordinatesAndControls(
+            glyphName, ttFont["hmtx"].metrics
+        )
+        numComponents = len(coordinates) - 4
+        assert numComponents == len(glyfTable[glyphName].components)
+        self.defaultOffsets = list(coordinates[:numComponents])
+        self.supports = []
+        deltas = []
+        for var in ttFont["gvar"].variations[glyphName]:
+            delta = var.coordinates
+            if None in delta:
+                delta = iup_delta(delta, coordinates, controls.endPts)
+            self.supports.append(var.axes)
+            deltas.append(GlyphCoordinates(delta[:numComponents]))
+        if numpy is not None:
+            self._offsets = numpy.array(self.defaultOffsets, dtype=numpy.float64)
+            self._deltas = numpy.array(deltas, dtype=numpy.float64).reshape(
+                len(deltas), numComponents * 2
+            )
+        else:
+            self._deltas = deltas
+
+    def instantiate(self, location):
+        """Return the component offsets at the normalized location, as a list
+        of (x, y) pairs.
+        """
+        scalars = [supportScalar(location, support) for support in self.supports]
+        if not any(scalars):
+            return self.defaultOffsets
+        if numpy is not None:
+            deltas = (numpy.array(scalars) @ self._deltas).reshape(-1, 2)
+            return (self._offsets + deltas).tolist()
+        offsets = GlyphCoordinates(self.defaultOffsets)
+        for scalar, delta in zip(scalars, self._deltas):
+            if scalar:
+                offsets += delta * scalar
+        return list(offsets)
+
+
+def recordGlyphs(varcFont, glyphNames, location):
+    """Draw the glyphs of a TTVarCFont at location, and return a list with the
+    RecordingPen value of each glyph.
+    """
+    context = varcFont.getRenderContext(location)
+    recordings = []
+    for glyphName in glyphNames:
+        pen = RecordingPen()
+        context.drawGlyph(pen, glyphName)
+        recordings.append(pen.value)
+    return recordings
 
 
 def instantiateComponentOffsets(ttFont, glyphName, location):
-    glyfTable = ttFont["glyf"]
-    gvarTable = ttFont["gvar"]
-    assert glyfTable[glyphName].isComposite()
-    variations = gvarTable.variations[glyphName]
-    coordinates, _ = glyfTable.getCoordinatesAndControls(glyphName, ttFont)
-    origCoords, endPts = None, None
-    for var in variations:
-        scalar = supportScalar(location, var.axes)
-        if not scalar:
-            continue
-        delta = var.coordinates
-        if None in delta:
-            if origCoords is None:
-                origCoords, g = glyfTable.getCoordinatesAndControls(glyphName, ttFont)
-                endPts = g.endPts
-            delta = iup_delta(delta, origCoords, endPts)
-        coordinates += GlyphCoordinates(delta) * scalar
-    assert len(coordinates) == len(glyfTable[glyphName].components) + 4
-    return coordinates[:-4]
+    return ComponentOffsetModel(ttFont, glyphName).instantiate(location)
 
 
 def unpackComponentLocation(coordDict, varcInstancer):
@@ -124,17 +469,3 @@ def unpackComponentTransform(transformDict, varcInstancer, numIntBitsForScale):
             value += delta
         transform[name] = value
     return transform
-
-
-def _makeTransform(x, y, transform):
-    return makeTransformVarCo(
-        x=x,
-        y=y,
-        rotation=transform.get("Rotation", 0),
-        scalex=transform.get("ScaleX", 1.0),
-        scaley=transform.get("ScaleY", 1.0),
-        skewx=transform.get("SkewX", 0),
-        skewy=transform.get("SkewY", 0),
-        tcenterx=transform.get("TCenterX", 0),
-        tcentery=transform.get("TCenterY", 0),
-    )
@@ -1,8 +1,171 @@
+import argparse
+import getopt
+import os
 import sys
-from fontTools.ttLib import registerCustomTableClass
-from fontTools.ttx import main as ttx_main
+from fontTools import configLogger, ttx
+from fontTools.misc.timeTools import timestampSinceEpoch
+from fontTools.ttLib import TTFont, TTLibError, registerCustomTableClass
+from fontTools.unicode import setUnicodeData
 
 
-def main():
+def parseUnicodes(s):
+    """Parse a comma-separated list of hex code points or ranges, for example
+    "4E00,U+4E8C,4E03-4E09".
+    """
+    unicodes = set()
+    for item in s.replace(" ", ",").split(","):
+        if not item:
+            continue
+        start, _, end = item.partition("-")
+        start = int(_stripUnicodePrefix(start), 16)
+        end = int(_stripUnicodePrefix(end), 16) if end else start
+        unicodes.update(range(start, end + 1))
+    return unicodes
+
+
+def _stripUnicodePrefix(s):
+    s = s.strip()
+    for prefix in ["U+", "u+", "0x", "0X"]:
+        if s.startswith(prefix):
+            return s[len(prefix) :]
+    return s
+
+
+def ttDump(input, output, options):
+    """Like fontTools.ttx.ttDump(), but with the VarC dump options set on the
+    VarC table.
+    """
+    inputName = input
+    if input == "-":
+        input, inputName = sys.stdin.buffer, sys.stdin.name
+    outputName = output
+    if output == "-":
+        output, outputName = sys.stdout, sys.stdout.name
+    ttx.log.info('Dumping "%s" to "%s"...', inputName, outputName)
+    if options.unicodedata:
+        setUnicodeData(options.unicodedata)
+    ttf = TTFont(
+        input,
+        0,
+        ignoreDecompileErrors=options.ignoreDecompileErrors,
+        fontNumber=options.fontNumber,
+    )
+    if "VarC" in ttf:
+        varcTable = ttf["VarC"]
+        varcTable.dumpGlyphNames = options.varcGlyphNames
+        varcTable.dumpUnicodes = options.varcUnicodes
+        varcTable.dumpComments = options.varcComments
+    ttf.saveXML(
+        output,
+        tables=options.onlyTables,
+        skipTables=options.skipTables,
+        splitTables=options.splitTables,
+        splitGlyphs=options.splitGlyphs,
+        disassembleInstructions=options.disassembleInstructions,
+        bitmapGlyphDataFormat=options.bitmapGlyphDataFormat,
+        newlinestr=options.newlinestr,
+    )
+    ttf.close()
+
+
+def ttCompile(input, output, options):
+    """Like fontTools.ttx.ttCompile(), but read the TTX file with
+    VarCXMLReader, which parses the VarC GlyphData glyph by glyph.
+    """
+    from .table_VarC import VarCXMLReader
+
+    inputName = input
+    if input == "-":
+        input, inputName = sys.stdin, sys.stdin.name
+    outputName = output
+    if output == "-":
+        output, outputName = sys.stdout.buffer, sys.stdout.name
+    ttx.log.info('Compiling "%s" to "%s"...', inputName, outputName)
+    if options.useZopfli:
+        from fontTools.ttLib import sfnt
+
+        sfnt.USE_ZOPFLI = True
+    ttf = TTFont(
+        options.mergeFile,
+        flavor=options.flavor,
+        recalcBBoxes=options.recalcBBoxes,
+        recalcTimestamp=options.recalcTimestamp,
+    )
+    # As in TTFont.importXML(): load the glyph order before the tables it is
+    # read from are replaced
+    if "maxp" in ttf and "post" in ttf:
+        ttf.getGlyphOrder()
+    VarCXMLReader(input, ttf).read()
+
+    if options.recalcTimestamp is None and "head" in ttf and input is not sys.stdin:
+        # use TTX file modification time for head "modified" timestamp
+        mtime = os.path.getmtime(input)
+        ttf["head"].modified = timestampSinceEpoch(mtime)
+
+    ttf.save(output)
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+
+    # Options for the VarC table, everything else is passed on to ttx
+    parser = argparse.ArgumentParser(prog="ttxv", add_help=False, allow_abbrev=False)
+    parser.add_argument(
+        "--glyphs",
+        help="Comma-separated glyph names: only dump these glyphs, and the glyphs "
+        "they use as components, from the VarC table",
+    )
+    parser.add_argument(
+        "--unicodes",
+        type=parseUnicodes,
+        help="Comma-separated hex code points or ranges, like 4E00,4E8C-4E8F: only "
+        "dump the glyphs for these code points, and the glyphs they use as "
+        "components, from the VarC table",
+    )
+    parser.add_argument(
+        "--no-varc-comments",
+        action="store_true",
+        help="Don't write a comment with the glyf component for each VarC component",
+    )
+    options, ttxArgs = parser.parse_known_args(args)
+
+    if "-h" in ttxArgs or "--help" in ttxArgs:
+        parser.print_help()
+        print()
+
     registerCustomTableClass("VarC", "rcjktools.table_VarC", "table_VarC")
-    sys.exit(ttx_main())
+
+    try:
+        jobs, ttxOptions = ttx.parseOptions(ttxArgs)
+    except getopt.GetoptError as e:
+        print(f"{ttx.__doc__}\nERROR: {e}", file=sys.stderr)
+        sys.exit(2)
+    if options.glyphs is None:
+        ttxOptions.varcGlyphNames = None
+    else:
+        ttxOptions.varcGlyphNames = [
+            glyphName for glyphName in options.glyphs.split(",") if glyphName
+        ]
+    ttxOptions.varcUnicodes = options.unicodes
+    ttxOptions.varcComments = not options.no_varc_comments
+
+    configLogger(level=ttxOptions.logLevel)
+
+    # The same as fontTools.ttx.main(), with our own dump and compile actions
+    actions = {ttx.ttDump: ttDump, ttx.ttCompile: ttCompile}
+    try:
+        for action, input, output in jobs:
+            actions.get(action, action)(input, output, ttxOptions)
+    except KeyboardInterrupt:
+        ttx.log.error("(Cancelled.)")
+        sys.exit(1)
+    except SystemExit:
+        raise
+    except TTLibError as e:
+        ttx.log.error(e)
+        sys.exit(1)
+    except Exception:
+        ttx.log.exception("Unhandled exception has occurred")
+        sys.exit(1)
+    sys.exit(0)
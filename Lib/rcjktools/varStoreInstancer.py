@@ -0,0 +1,70 @@
+import copy
+from fontTools.ttLib.tables.otTables import NO_VARIATION_INDEX
+from fontTools.varLib.models import supportScalar
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class VarStoreBatchInstancer:
+    """Compute the deltas of all rows of a VarStore for a location at once.
+    This requires NumPy.
+
+    Like with fontTools' VarStoreInstancer, instancer[varIdx] returns the delta
+    for varIdx at the current (normalized) location. But instead of computing
+    the deltas one by one when they are requested, all region scalars are
+    computed once per location, and each VarData subtable is evaluated as a
+    matrix-vector product. The result is the flat `deltas` array, which can be
+    indexed with getDeltaIndex(varIdx). It has one extra item at index
+    numDeltas, which is always 0, for values without variations.
+    """
+
+    def __init__(self, varStore, fvarAxes, location={}):
+        assert numpy is not None, "VarStoreBatchInstancer requires NumPy"
+        self.fvarAxes = fvarAxes
+        self._supports = [
+            region.get_support(fvarAxes) for region in varStore.VarRegionList.Region
+        ]
+        self.varDataOffsets = []
+        self._varData = []
+        offset = 0
+        for varData in varStore.VarData:
+            self.varDataOffsets.append(offset)
+            numRows = len(varData.Item)
+            if numRows and varData.VarRegionIndex:
+                regionIndices = numpy.array(varData.VarRegionIndex, dtype=numpy.intp)
+                rows = numpy.array(varData.Item, dtype=numpy.float64)
+                self._varData.append((offset, regionIndices, rows))
+            offset += numRows
+        self.numDeltas = offset
+        self.setLocation(location)
+
+    def setLocation(self, location):
+        self.location = dict(location)
+        scalars = numpy.array(
+            [supportScalar(self.location, support) for support in self._supports]
+        )
+        deltas = numpy.zeros(self.numDeltas + 1)
+        for offset, regionIndices, rows in self._varData:
+            varDataScalars = scalars[regionIndices]
+            if varDataScalars.any():
+                deltas[offset : offset + len(rows)] = rows @ varDataScalars
+        self.deltas = deltas
+
+    def atLocation(self, location):
+        """Return a new instancer for location, which shares the VarData
+        matrices with this one.
+        """
+        instancer = copy.copy(self)
+        instancer.setLocation(location)
+        return instancer
+
+    def getDeltaIndex(self, varIdx):
+        return self.varDataOffsets[varIdx >> 16] + (varIdx & 0xFFFF)
+
+    def __getitem__(self, varIdx):
+        if varIdx == NO_VARIATION_INDEX:
+            return 0.0
+        return float(self.deltas[self.getDeltaIndex(varIdx)])
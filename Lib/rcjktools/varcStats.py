@@ -0,0 +1,274 @@
+import argparse
+from collections import Counter
+import json
+import struct
+import sys
+from typing import NamedTuple
+from fontTools.ttLib import TTFont, registerCustomTableClass
+from fontTools.ttLib.tables.otTables import NO_VARIATION_INDEX
+from .table_VarC import (
+    AXIS_INDICES_ARE_WORDS,
+    HAS_TRANSFORM_VARIATIONS,
+    getNumComponents,
+    transformFieldFlags,
+)
+
+
+class ComponentEncoding(NamedTuple):
+    wordAxisIndices: bool
+    axisIndices: list
+    transformFields: list
+    hasTransformVariations: bool
+    varIdxEntrySize: int  # 0 if the component has no varIdxs
+    varIdxs: list
+    sizes: dict  # the number of bytes per part of the component record
+
+
+def getVarCStats(ttFont, numLargestGlyphs=20):
+    """Analyze the binary VarC table of ttFont, and return a dict with statistics
+    about where its bytes go and how its components are encoded. The dict can be
+    serialized as JSON.
+    """
+    data = ttFont.getTableData("VarC")
+    glyphOrder = ttFont.getGlyphOrder()
+    glyfTable = ttFont["glyf"]
+
+    version, numGlyphs = struct.unpack_from(">LH", data)
+    glyphOffsets = struct.unpack_from(f">{numGlyphs}L", data, 6)
+    (varStoreOffset,) = struct.unpack_from(">L", data, 6 + 4 * numGlyphs)
+
+    byteCounts = Counter(header=6 + 4 * numGlyphs + 4)
+    glyphSizes = {}
+    glyphSizesByOffset = {}
+    componentsPerGlyph = []
+    axesPerComponent = []
+    axisIndexFormats = Counter()
+    varIdxEntrySizes = Counter()
+    transformFields = Counter()
+    axesUsed = set()
+    varIdxsUsed = set()
+    numComponents = numTransformVariations = 0
+    numSharedGlyphs = numSharedBytes = 0
+
+    for glyphID, glyphOffset in enumerate(glyphOffsets):
+        if not glyphOffset:
+            continue
+        glyphName = glyphOrder[glyphID]
+        glyphSize = glyphSizesByOffset.get(glyphOffset)
+        if glyphSize is not None:
+            # The glyph shares its subtable with a previous glyph
+            numSharedGlyphs += 1
+            numSharedBytes += glyphSize
+            glyphSizes[glyphName] = glyphSize
+            continue
+
+        numGlyphComponents = getNumComponents(glyfTable, glyphName)
+        componentsPerGlyph.append(numGlyphComponents)
+        pos = glyphOffset
+        for i in range(numGlyphComponents):
+            component, pos = scanComponent(data, pos)
+            numComponents += 1
+            byteCounts.update(component.sizes)
+            axesPerComponent.append(len(component.axisIndices))
+            axisIndexFormats["word" if component.wordAxisIndices else "byte"] += 1
+            axesUsed.update(component.axisIndices)
+            varIdxEntrySizes[component.varIdxEntrySize or "none"] += 1
+            varIdxsUsed.update(component.varIdxs)
+            transformFields.update(component.transformFields)
+            numTransformVariations += component.hasTransformVariations
+
+        glyphSize = pos - glyphOffset
+        glyphSizesByOffset[glyphOffset] = glyphSize
+        glyphSizes[glyphName] = glyphSize
+
+    varStoreStats = None
+    if varStoreOffset:
+        varStoreStats = getVarStoreStats(data, varStoreOffset, varIdxsUsed)
+        byteCounts["varStore"] = varStoreStats["size"]
+
+    largestGlyphs = sorted(glyphSizes.items(), key=lambda item: item[1], reverse=True)
+    return dict(
+        version=f"0x{version:08X}",
+        size=len(data),
+        bytes=dict(byteCounts),
+        numGlyphs=len(glyphSizes),
+        numComponents=numComponents,
+        bytesPerGlyph=_summarize(glyphSizes.values()),
+        largestGlyphs=dict(largestGlyphs[:numLargestGlyphs]),
+        sharedGlyphs=dict(count=numSharedGlyphs, bytesSaved=numSharedBytes),
+        componentsPerGlyph=_histogram(componentsPerGlyph),
+        axesPerComponent=_histogram(axesPerComponent),
+        numAxesUsed=len(axesUsed),
+        axisIndexFormats=dict(axisIndexFormats),
+        varIdxEntrySizes={
+            str(k): v for k, v in sorted(varIdxEntrySizes.items(), key=str)
+        },
+        transformFields=dict(sorted(transformFields.items())),
+        numTransformVariations=numTransformVariations,
+        varStore=varStoreStats,
+    )
+
+
+def scanComponent(data, pos):
+    """Scan the component record at data[pos:] like unpackComponent() does,
+    return a ComponentEncoding and the position following the record.
+    """
+    start = pos
+    (flags,) = struct.unpack_from(">H", data, pos)
+    wordAxisIndices = bool(flags & AXIS_INDICES_ARE_WORDS)
+    if wordAxisIndices:
+        (numAxes,) = struct.unpack_from(">H", data, pos + 2)
+        pos += 4
+        axisIndices = struct.unpack_from(f">{numAxes}H", data, pos)
+        hasVarIdxFlag = 0x8000
+    else:
+        numAxes = data[pos + 2]
+        pos += 3
+        axisIndices = data[pos : pos + numAxes]
+        hasVarIdxFlag = 0x80
+    componentHeaderSize = pos - start
+    numVarIdxs = sum(1 for axisIndex in axisIndices if axisIndex & hasVarIdxFlag)
+    axisIndices = [axisIndex & (hasVarIdxFlag - 1) for axisIndex in axisIndices]
+    axisIndicesSize = (2 if wordAxisIndices else 1) * numAxes
+    pos += axisIndicesSize + 2 * numAxes
+
+    fields = [
+        fieldName for fieldName, mask in transformFieldFlags.items() if flags & mask
+    ]
+    pos += 2 * len(fields)
+    hasTransformVariations = bool(flags & HAS_TRANSFORM_VARIATIONS)
+    if hasTransformVariations:
+        numVarIdxs += len(fields)
+
+    varIdxsStart = pos
+    entryFormat = data[pos]
+    pos += 1
+    entrySize = (entryFormat >> 4) + 1
+    innerBits = (entryFormat & 0x0F) + 1
+    innerMask = (1 << innerBits) - 1
+    varIdxs = []
+    for i in range(numVarIdxs):
+        value = int.from_bytes(data[pos : pos + entrySize], "big")
+        varIdxs.append(((value >> innerBits) << 16) | (value & innerMask))
+        pos += entrySize
+
+    sizes = dict(
+        componentHeaders=componentHeaderSize,
+        axisIndices=axisIndicesSize,
+        axisValues=2 * numAxes,
+        transformValues=2 * len(fields),
+        varIdxs=pos - varIdxsStart,
+    )
+    component = ComponentEncoding(
+        wordAxisIndices,
+        axisIndices,
+        fields,
+        hasTransformVariations,
+        entrySize if numVarIdxs else 0,
+        varIdxs,
+        sizes,
+    )
+    return component, pos
+
+
+def getVarStoreStats(data, offset, varIdxsUsed=()):
+    """Return statistics about the binary VarStore at data[offset:]: the size of
+    the region list and of each VarData subtable. If varIdxsUsed is given, also
+    count how many of the rows are referenced. VarData subtables that several
+    offsets point to are counted once in the sizes.
+    """
+    _, regionListOffset, varDataCount = struct.unpack_from(">HLH", data, offset)
+    varDataOffsets = struct.unpack_from(f">{varDataCount}L", data, offset + 8)
+    axisCount, regionCount = struct.unpack_from(">HH", data, offset + regionListOffset)
+    regionListSize = 4 + 6 * axisCount * regionCount
+
+    varIdxsUsed = set(varIdxsUsed)
+    varIdxsUsed.discard(NO_VARIATION_INDEX)
+    usedRowsPerVarData = Counter(varIdx >> 16 for varIdx in varIdxsUsed)
+    varDatas = []
+    varDataSizes = {}  # by offset
+    for outer, varDataOffset in enumerate(varDataOffsets):
+        itemCount, wordCount, regionIndexCount = struct.unpack_from(
+            ">HHH", data, offset + varDataOffset
+        )
+        longWords = bool(wordCount & 0x8000)
+        wordCount &= 0x7FFF
+        wordSize = 4 if longWords else 2
+        rowSize = wordCount * wordSize + (regionIndexCount - wordCount) * (
+            wordSize // 2
+        )
+        size = 6 + 2 * regionIndexCount + itemCount * rowSize
+        varDataSizes[varDataOffset] = size
+        varDatas.append(
+            dict(
+                itemCount=itemCount,
+                regionCount=regionIndexCount,
+                wordCount=wordCount,
+                longWords=longWords,
+                size=size,
+                usedItemCount=usedRowsPerVarData[outer],
+            )
+        )
+
+    varDataSize = sum(varDataSizes.values())
+    return dict(
+        size=8 + 4 * varDataCount + regionListSize + varDataSize,
+        axisCount=axisCount,
+        regionCount=regionCount,
+        regionListSize=regionListSize,
+        varDataCount=varDataCount,
+        sharedVarDataCount=varDataCount - len(varDataSizes),
+        varDataSize=varDataSize,
+        itemCount=sum(varData["itemCount"] for varData in varDatas),
+        usedItemCount=len(varIdxsUsed),
+        varData=varDatas,
+    )
+
+
+def _summarize(values):
+    values = sorted(values)
+    if not values:
+        return dict(count=0)
+    total = sum(values)
+    return dict(
+        count=len(values),
+        total=total,
+        min=values[0],
+        max=values[-1],
+        mean=round(total / len(values), 2),
+        median=values[len(values) // 2],
+    )
+
+
+def _histogram(values):
+    return {str(k): v for k, v in sorted(Counter(values).items())}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report where the bytes of a VarC table go, as JSON"
+    )
+    parser.add_argument("font", help="a font with a VarC table")
+    parser.add_argument("-o", "--output", help="write the JSON to this file")
+    parser.add_argument(
+        "--largest",
+        type=int,
+        default=20,
+        help="the number of largest glyphs to list (default: 20)",
+    )
+    args = parser.parse_args()
+
+    registerCustomTableClass("VarC", "rcjktools.table_VarC", "table_VarC")
+    ttFont = TTFont(args.font, lazy=True)
+    stats = getVarCStats(ttFont, numLargestGlyphs=args.largest)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(stats, f, indent=2)
+            f.write("\n")
+    else:
+        json.dump(stats, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
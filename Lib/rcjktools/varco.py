@@ -1,16 +1,27 @@
+import functools
+import logging
+import os
+import pathlib
+import pickle
 from fontTools.designspaceLib import DesignSpaceDocument
+from fontTools.misc.fixedTools import floatToFixedToFloat
 from fontTools.pens.pointPen import PointToSegmentPen
+from fontTools.ufoLib import UFOReader
 from fontTools.varLib.models import VariationModel, allEqual, normalizeLocation
-from ufoLib2 import Font as UFont
 from .objects import Component, Glyph, MathDict, MathOutline
+from .objects import normalizeLocation as normalizeGlyphLocation
 from .utils import makeTransformVarCo
 
 
+logger = logging.getLogger(__name__)
+
+
 class VarCoGlyph(Glyph):
     @classmethod
     def loadFromUFOs(cls, ufos, locations, glyphName, axes):
-        uglyph = ufos[0][glyphName]
-        self = cls.loadFromGlyphObject(uglyph)
+        if glyphName not in ufos[0]:
+            raise KeyError(glyphName)
+        self = cls.loadFromGlyphSet(ufos[0].glyphSet, glyphName)
         self.axes = axes
         self._postParse(ufos, locations)
         return self
@@ -71,10 +82,12 @@ class VarCoGlyph(Glyph):
             assert len(ufos) == len(locations)
             for ufo, location in zip(ufos[1:], locations[1:]):
                 if self.name not in ufo:
+                    # Cheap lookup in the layer's glyph name index; only the
+                    # masters this glyph actually has get loaded
                     continue
                 for axisName, axisValue in location.items():
                     assert 0 <= axisValue <= 1, (axisName, axisValue)
-                varGlyph = self.__class__.loadFromGlyphObject(ufo[self.name])
+                varGlyph = self.__class__.loadFromGlyphSet(ufo.glyphSet, self.name)
                 varGlyph._postParse([], [])
                 varGlyph.location = location
                 self.variations.append(varGlyph)
@@ -84,7 +97,12 @@ class VarCoGlyph(Glyph):
 
 
 class VarCoFont:
-    def __init__(self, designSpacePath):
+    def __init__(self, designSpacePath, instanceCacheSize=4096, glyphCachePath=None):
+        self.designSpacePath = designSpacePath
+        if glyphCachePath is not None:
+            self.glyphCache = VarCoGlyphCache(glyphCachePath, designSpacePath)
+        else:
+            self.glyphCache = None
         doc = DesignSpaceDocument.fromfile(designSpacePath)
         self.axes, self.ufos, self.locations = unpackDesignSpace(doc)
         self.glyphAxes = {}
@@ -92,22 +110,46 @@ class VarCoFont:
             assert minValue == defaultValue
             self.glyphAxes[axisName] = minValue, maxValue
         self.varcoGlyphs = {}
+        # Flattened outlines of instantiated glyphs, keyed by glyph name and
+        # quantized normalized location, shared by all drawing calls
+        self._instanceOutlines = functools.lru_cache(maxsize=instanceCacheSize)(
+            self._instantiateOutline
+        )
 
     def drawGlyph(self, pen, glyphName, location):
         self.drawPointsGlyph(PointToSegmentPen(pen), glyphName, location)
 
     def drawPointsGlyph(self, pen, glyphName, location, transform=None):
-        varGlyph = self[glyphName]
-        instanceGlyph = varGlyph.instantiate(location)
-        outline = instanceGlyph.outline
+        outline = self.instantiateOutline(glyphName, location)
         if transform is not None:
             outline = outline.transform(transform)
         outline.drawPoints(pen)
+
+    def instantiateOutline(self, glyphName, location):
+        """Return the outline of the glyph at location, with all variable
+        components flattened. The result is cached and shared: do not modify it.
+        """
+        location = normalizeGlyphLocation(location, self[glyphName].axes)
+        return self._instanceOutlines(glyphName, quantizeLocation(location))
+
+    def _instantiateOutline(self, glyphName, location):
+        instanceGlyph = self[glyphName].instantiateNormalized(dict(location))
+        outline = MathOutline()
+        instanceGlyph.outline.drawPoints(outline)
         for component in instanceGlyph.components:
             t = makeTransformVarCo(**component.transform)
-            if transform is not None:
-                t = transform.transform(t)
-            self.drawPointsGlyph(pen, component.name, component.coord, t)
+            compoOutline = self.instantiateOutline(component.name, component.coord)
+            compoOutline.transform(t).drawPoints(outline)
+        return outline
+
+    def instanceCacheInfo(self):
+        """Return the hits, misses, maxsize and currsize of the instance cache,
+        as a functools.lru_cache cache_info() named tuple.
+        """
+        return self._instanceOutlines.cache_info()
+
+    def clearInstanceCache(self):
+        self._instanceOutlines.cache_clear()
 
     def keys(self):
         return self.ufos[0].keys()
@@ -119,17 +161,38 @@ class VarCoFont:
         return len(self.ufos[0])
 
     def __iter__(self):
-        return iter(self.ufos[0].keys())
+        return iter(self.ufos[0])
 
     def __getitem__(self, glyphName):
         varcoGlyph = self.varcoGlyphs.get(glyphName)
         if varcoGlyph is None:
-            varcoGlyph = VarCoGlyph.loadFromUFOs(
-                self.ufos, self.locations, glyphName, self.glyphAxes
-            )
+            if self.glyphCache is None:
+                varcoGlyph = self._loadGlyph(glyphName)
+            else:
+                glyphStamp = self._getGlyphStamp(glyphName)
+                varcoGlyph = self.glyphCache.get(glyphName, glyphStamp)
+                if varcoGlyph is None:
+                    varcoGlyph = self._loadGlyph(glyphName)
+                    self.glyphCache.set(glyphName, glyphStamp, varcoGlyph)
             self.varcoGlyphs[glyphName] = varcoGlyph
         return varcoGlyph
 
+    def _loadGlyph(self, glyphName):
+        return VarCoGlyph.loadFromUFOs(
+            self.ufos, self.locations, glyphName, self.glyphAxes
+        )
+
+    def _getGlyphStamp(self, glyphName):
+        return tuple(
+            (layerIndex, *layer.getGLIFStamp(glyphName))
+            for layerIndex, layer in enumerate(self.ufos)
+            if glyphName in layer
+        )
+
+    def saveGlyphCache(self):
+        if self.glyphCache is not None:
+            self.glyphCache.save()
+
     def get(self, glyphName, default=None):
         try:
             glyph = self[glyphName]
@@ -137,54 +200,173 @@ class VarCoFont:
             glyph = default
         return glyph
 
-    def extractVarCoData(self, globalAxisNames):
+    def extractVarCoData(self, globalAxisNames, numWorkers=1):
+        """Collect the VarC data for all glyphs. If numWorkers is larger than 1,
+        the glyphs are processed in that many worker processes; None means one
+        per CPU core. The result does not depend on the number of workers.
+        """
+        glyphNames = sorted(self.keys())
+        if numWorkers is None or numWorkers > 1:
+            glyphResults = self._extractVarCoDataParallel(glyphNames, numWorkers)
+        else:
+            glyphResults = map(self._extractGlyphVarCoData, glyphNames)
+
         allLocations = set()
         vcData = {}
-        for glyphName in sorted(self.keys()):
-            glyph = self[glyphName]
-            masters = [glyph] + glyph.variations
-
-            if not glyph.outline.isEmpty() and glyph.components:
-                assert not any(
-                    c.coord for c in glyph.components
-                ), "can't mix outlines and variable components"
-                # ensure only the offset may vary across masters
-                for attr in [
-                    "rotation",
-                    "scalex",
-                    "scaley",
-                    "skewx",
-                    "skewy",
-                    "tcenterx",
-                    "tcentery",
-                ]:
-                    values = {c.transform[attr] for m in masters for c in m.components}
-                    assert len(values) == 1, f"classic component varies {attr}"
-                # This glyph mixes outlines and classic components, it will be
-                # flattened upon TTF compilation, so should not be part of the VarC table
+        for glyphName, glyphResult in zip(glyphNames, glyphResults):
+            if glyphResult is None:
                 continue
-
-            locations = [m.location for m in masters]
+            components, locations = glyphResult
             allLocations.update(tuplifyLocation(loc) for loc in locations)
-            components = []
-            for i in range(len(glyph.components)):
-                assert allEqual([m.components[i].name for m in masters])
-                coords = [m.components[i].coord for m in masters]
-                transforms = [
-                    # Filter out x and y, as they'll be in glyf and gvar
-                    {
-                        _transformFieldMapping[k]: v
-                        for k, v in m.components[i].transform.items()
-                        if k not in {"x", "y"}
-                    }
-                    for m in masters
-                ]
-                components.append(list(zip(coords, transforms)))
             if components:
                 vcData[glyphName] = components, locations
         allLocations = [dict(items) for items in sorted(allLocations)]
         return vcData, allLocations
 
+    def _extractVarCoDataParallel(self, glyphNames, numWorkers):
+        from concurrent.futures import ProcessPoolExecutor
+
+        if numWorkers is None:
+            numWorkers = os.cpu_count()
+        # Several chunks per worker, to even out the load
+        chunkSize = max(1, len(glyphNames) // (8 * numWorkers))
+        glyphCachePath = None if self.glyphCache is None else self.glyphCache.path
+        with ProcessPoolExecutor(
+            numWorkers,
+            initializer=_initExtractWorker,
+            initargs=(self.designSpacePath, glyphCachePath),
+        ) as executor:
+            # map() yields the results in glyphNames order
+            results = executor.map(
+                _extractGlyphVarCoDataWorker, glyphNames, chunksize=chunkSize
+            )
+            for glyphName, (glyphResult, cacheEntry) in zip(glyphNames, results):
+                if cacheEntry is not None:
+                    # The worker had to parse the glyph: keep it for next time
+                    self.glyphCache.setEntry(glyphName, cacheEntry)
+                yield glyphResult
+
+    def _extractGlyphVarCoData(self, glyphName):
+        glyph = self[glyphName]
+        masters = [glyph] + glyph.variations
+
+        if not glyph.outline.isEmpty() and glyph.components:
+            assert not any(
+                c.coord for c in glyph.components
+            ), "can't mix outlines and variable components"
+            # ensure only the offset may vary across masters
+            for attr in [
+                "rotation",
+                "scalex",
+                "scaley",
+                "skewx",
+                "skewy",
+                "tcenterx",
+                "tcentery",
+            ]:
+                values = {c.transform[attr] for m in masters for c in m.components}
+                assert len(values) == 1, f"classic component varies {attr}"
+            # This glyph mixes outlines and classic components, it will be
+            # flattened upon TTF compilation, so should not be part of the VarC table
+            return None
+
+        locations = [m.location for m in masters]
+        components = []
+        for i in range(len(glyph.components)):
+            assert allEqual([m.components[i].name for m in masters])
+            coords = [m.components[i].coord for m in masters]
+            transforms = [
+                # Filter out x and y, as they'll be in glyf and gvar
+                {
+                    _transformFieldMapping[k]: v
+                    for k, v in m.components[i].transform.items()
+                    if k not in {"x", "y"}
+                }
+                for m in masters
+            ]
+            components.append(list(zip(coords, transforms)))
+        return components, locations
+
+
+# Per-process state for VarCoFont.extractVarCoData(numWorkers=...)
+_workerFont = None
+
+
+def _initExtractWorker(designSpacePath, glyphCachePath):
+    global _workerFont
+    _workerFont = VarCoFont(designSpacePath, glyphCachePath=glyphCachePath)
+
+
+def _extractGlyphVarCoDataWorker(glyphName):
+    glyphResult = _workerFont._extractGlyphVarCoData(glyphName)
+    glyphCache = _workerFont.glyphCache
+    cacheEntry = None
+    if glyphCache is not None:
+        cacheEntry = glyphCache.popNewEntry(glyphName)
+    return glyphResult, cacheEntry
+
+
+class VarCoGlyphCache:
+    """A persistent cache of parsed VarCoGlyph objects, stored in a single
+    (pickle) file. Each entry is validated against the modification times and
+    sizes of the glyph's .glif files in all layers, so editing a source only
+    invalidates the glyphs that were touched. Any change to the .designspace
+    file invalidates the whole cache.
+    """
+
+    formatVersion = 1
+
+    def __init__(self, path, designSpacePath):
+        self.path = pathlib.Path(path)
+        st = os.stat(designSpacePath)
+        self.fontStamp = (self.formatVersion, st.st_mtime_ns, st.st_size)
+        self.entries = {}
+        self.newEntries = set()
+        if self.path.exists():
+            try:
+                with open(self.path, "rb") as f:
+                    fontStamp, entries = pickle.load(f)
+            except Exception as e:
+                logger.warning(f"ignoring unreadable glyph cache {self.path}: {e!r}")
+            else:
+                if fontStamp == self.fontStamp:
+                    self.entries = entries
+
+    def get(self, glyphName, glyphStamp):
+        entry = self.entries.get(glyphName)
+        if entry is None or entry[0] != glyphStamp:
+            return None
+        return pickle.loads(entry[1])
+
+    def set(self, glyphName, glyphStamp, glyph):
+        # Pickle right away, before the glyph object accumulates any state
+        data = pickle.dumps(glyph, pickle.HIGHEST_PROTOCOL)
+        self.setEntry(glyphName, (glyphStamp, data))
+
+    def setEntry(self, glyphName, entry):
+        self.entries[glyphName] = entry
+        self.newEntries.add(glyphName)
+
+    def popNewEntry(self, glyphName):
+        if glyphName not in self.newEntries:
+            return None
+        self.newEntries.remove(glyphName)
+        return self.entries[glyphName]
+
+    def save(self):
+        if not self.newEntries:
+            return
+        tmpPath = self.path.with_name(self.path.name + ".tmp")
+        with open(tmpPath, "wb") as f:
+            pickle.dump((self.fontStamp, self.entries), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, self.path)
+        self.newEntries = set()
+
+
+def getDefaultGlyphCachePath(designSpacePath):
+    designSpacePath = pathlib.Path(designSpacePath)
+    return designSpacePath.parent / (designSpacePath.stem + ".varcocache")
+
 
 def unpackDesignSpace(doc):
     axisTagMapping = {axis.name: axis.tag for axis in doc.axes}
@@ -197,7 +379,7 @@ def unpackDesignSpace(doc):
     ufos = []
     locations = []
 
-    _loaded = {}
+    _readers = {}
 
     for src in sources:
         loc = src.location
@@ -209,15 +391,7 @@ def unpackDesignSpace(doc):
             axisName: axisValue for axisName, axisValue in loc.items() if axisValue != 0
         }
         locations.append(loc)
-        ufo = _loaded.get(src.path)
-        if ufo is None:
-            ufo = UFont(src.path)
-            _loaded[src.path] = ufo
-        if src.layerName is None:
-            ufo.layers.defaultLayer
-        else:
-            ufo = ufo.layers[src.layerName]
-        ufos.append(ufo)
+        ufos.append(VarCoLayer(src.path, src.layerName, _readers))
 
     userAxes = {
         axis.tag: (axis.minimum, axis.default, axis.maximum)
@@ -227,6 +401,55 @@ def unpackDesignSpace(doc):
     return userAxes, ufos, locations
 
 
+class VarCoLayer:
+    """A glyph layer of a VarCo UFO source, opened lazily: the UFO is only
+    read upon first access, and the glyph name index of the layer is built
+    from contents.plist once. Glyphs themselves are not cached here, see
+    VarCoFont.
+    """
+
+    def __init__(self, ufoPath, layerName, readers):
+        self.ufoPath = ufoPath
+        self.layerName = layerName  # None means the default layer
+        self._readers = readers  # shared between the layers of the same UFO
+        self._glyphSet = None
+        self._glyphNames = None
+
+    @property
+    def glyphSet(self):
+        if self._glyphSet is None:
+            reader = self._readers.get(self.ufoPath)
+            if reader is None:
+                reader = UFOReader(self.ufoPath, validate=False)
+                self._readers[self.ufoPath] = reader
+            self._glyphSet = reader.getGlyphSet(self.layerName, validateRead=False)
+        return self._glyphSet
+
+    @property
+    def glyphNames(self):
+        if self._glyphNames is None:
+            self._glyphNames = frozenset(self.glyphSet.contents)
+        return self._glyphNames
+
+    def getGLIFStamp(self, glyphName):
+        """Return the modification time and size of the .glif file."""
+        glyphSet = self.glyphSet
+        info = glyphSet.fs.getinfo(glyphSet.contents[glyphName], namespaces=["details"])
+        return info.modified.timestamp(), info.size
+
+    def keys(self):
+        return self.glyphSet.keys()
+
+    def __contains__(self, glyphName):
+        return glyphName in self.glyphNames
+
+    def __len__(self):
+        return len(self.glyphNames)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
 _transformFieldMapping = {
     "rotation": "Rotation",
     "scalex": "ScaleX",
@@ -242,6 +465,17 @@ def tuplifyLocation(loc):
     return tuple(sorted(loc.items()))
 
 
+def quantizeLocation(loc, precisionBits=14):
+    """Round the (normalized) location to the F2Dot14 grid and return it in
+    hashable form, leaving out axes that are at their default.
+    """
+    loc = {
+        axisName: floatToFixedToFloat(axisValue, precisionBits)
+        for axisName, axisValue in loc.items()
+    }
+    return tuplifyLocation({k: v for k, v in loc.items() if v != 0})
+
+
 if __name__ == "__main__":
     import sys
 
@@ -0,0 +1,203 @@
+import pathlib
+import pytest
+from fontTools.fontBuilder import FontBuilder
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from fontTools.ttLib import newTable, registerCustomTableClass
+from fontTools.ttLib.tables.otTables import NO_VARIATION_INDEX
+from fontTools.varLib.builder import buildVarData, buildVarRegionList, buildVarStore
+from fontTools.varLib.varStore import VarStoreInstancer
+
+registerCustomTableClass("VarC", "rcjktools.table_VarC", "table_VarC")
+
+from rcjktools.buildVarC import (  # noqa: E402
+    buildVarCTable,
+    calcVarIdxsSize,
+    getComponentVarIdxs,
+    optimizeVarIdxOrder,
+    remapVarIdxs,
+    replaceNoVariationIndex,
+)
+from rcjktools.table_VarC import (  # noqa: E402
+    VARIDX_KEY,
+    ComponentRecord,
+    CoordinateRecord,
+    TransformRecord,
+    fixedCoord,
+    getToFixedConverterForNumIntBitsForScale,
+    transformDefaults,
+    transformToIntConverters,
+)
+from rcjktools.varco import VarCoFont  # noqa: E402
+
+dataDir = pathlib.Path(__file__).resolve().parent / "data"
+
+
+@pytest.fixture(scope="module")
+def varcoTestData():
+    vcFont = VarCoFont(dataDir / "VarCoTest.designspace")
+    globalAxisNames = {axisTag for axisTag in vcFont.axes if axisTag[0] != "V"}
+    return vcFont.extractVarCoData(globalAxisNames)
+
+
+def makeSkeletonFont(vcData, allLocations):
+    """Build a font with an fvar axis for each axis used by vcData, with a
+    normalized range, and a composite glyf glyph for each glyph in vcData,
+    with the same number of components.
+    """
+    axisTags = sorted(
+        {axisTag for location in allLocations for axisTag in location}
+        | {
+            axisTag
+            for components, _ in vcData.values()
+            for masters in components
+            for coord, _ in masters
+            for axisTag in coord
+        }
+    )
+    glyphOrder = [".notdef", "base"] + sorted(vcData)
+    glyphs = {".notdef": TTGlyphPen(None).glyph(), "base": TTGlyphPen(None).glyph()}
+    for glyphName, (components, _) in vcData.items():
+        pen = TTGlyphPen({"base": glyphs["base"]})
+        for _ in components:
+            pen.addComponent("base", (1, 0, 0, 1, 0, 0))
+        glyphs[glyphName] = pen.glyph()
+
+    fb = FontBuilder(1000, isTTF=True)
+    fb.setupGlyphOrder(glyphOrder)
+    fb.setupGlyf(glyphs)
+    fb.setupNameTable(dict(familyName="VarCoTest", styleName="Regular"))
+    fb.setupFvar([(axisTag, 0, 0, 1, axisTag) for axisTag in axisTags], [])
+    return fb.font
+
+
+def getComponentValues(component, varcInstancer):
+    """Return the values of a ComponentRecord at the location of
+    varcInstancer, as the integers they are stored as.
+    """
+    scaleConvert = getToFixedConverterForNumIntBitsForScale(
+        component.numIntBitsForScale
+    )
+    values = {}
+    for axisTag, valueDict in component.coord.items():
+        values[axisTag] = fixedCoord(valueDict["value"])
+        if VARIDX_KEY in valueDict:
+            values[axisTag] += varcInstancer[valueDict[VARIDX_KEY]]
+    for fieldName, default in transformDefaults.items():
+        convert = transformToIntConverters[fieldName] or scaleConvert
+        valueDict = component.transform.get(fieldName, dict(value=default))
+        values[fieldName] = convert(valueDict["value"])
+        if VARIDX_KEY in valueDict:
+            values[fieldName] += varcInstancer[valueDict[VARIDX_KEY]]
+    return values
+
+
+@pytest.mark.parametrize("numWorkers", [1, 2])
+def test_buildVarCTable(varcoTestData, numWorkers):
+    vcData, allLocations = varcoTestData
+    ttFont = makeSkeletonFont(vcData, allLocations)
+    buildVarCTable(ttFont, vcData, allLocations, numWorkers)
+
+    # Round trip through the binary table
+    varcTable = newTable("VarC")
+    varcTable.decompile(ttFont["VarC"].compile(ttFont), ttFont)
+    glyphData = varcTable.GlyphData
+    assert sorted(glyphData.keys()) == sorted(vcData)
+
+    # Values that don't vary after all don't get NO_VARIATION_INDEX, which
+    # would widen the varIdx entries
+    allVarIdxs = {
+        varIdx
+        for components in glyphData.values()
+        for component in components
+        for varIdx in getComponentVarIdxs(component)
+    }
+    assert NO_VARIATION_INDEX not in allVarIdxs
+
+    # The VarStore reproduces the master values
+    fvarAxes = ttFont["fvar"].axes
+    for glyphName, (components, locations) in vcData.items():
+        for masterIndex, location in enumerate(locations):
+            varcInstancer = VarStoreInstancer(varcTable.VarStore, fvarAxes, location)
+            for component, masters in zip(glyphData[glyphName], components):
+                coord, transform = masters[masterIndex]
+                values = getComponentValues(component, varcInstancer)
+                scaleConvert = getToFixedConverterForNumIntBitsForScale(
+                    component.numIntBitsForScale
+                )
+                for axisTag, value in values.items():
+                    if axisTag in transformDefaults:
+                        convert = transformToIntConverters[axisTag] or scaleConvert
+                        expected = convert(
+                            transform.get(axisTag, transformDefaults[axisTag])
+                        )
+                    else:
+                        expected = fixedCoord(coord.get(axisTag, 0))
+                    assert value == expected, (glyphName, location, axisTag)
+                for axisTag, value in coord.items():
+                    if axisTag not in values:
+                        assert fixedCoord(value) == 0, (glyphName, location, axisTag)
+
+
+def test_replaceNoVariationIndex():
+    regionList = buildVarRegionList(
+        [{"wght": (0, 1, 1)}, {"wght": (0, 0.5, 1)}], ["wght"]
+    )
+    store = buildVarStore(
+        regionList,
+        [
+            buildVarData([0, 1], [[i, i + 1] for i in range(1, 301)]),
+            buildVarData([0], [[1000], [2000]]),
+        ],
+    )
+    # Mixes NO_VARIATION_INDEX with other varIdxs, in the coords and transform
+    mixedComponent = ComponentRecord(
+        CoordinateRecord(
+            V001=dict(value=0.5, varIdx=NO_VARIATION_INDEX),
+            V002=dict(value=0.1, varIdx=0x00000001),
+        ),
+        TransformRecord(
+            TranslateX=dict(value=10, varIdx=0x00010001),
+            Rotation=dict(value=0, varIdx=NO_VARIATION_INDEX),
+        ),
+        0,
+    )
+    noVarComponent = ComponentRecord(
+        CoordinateRecord(),
+        TransformRecord(TranslateX=dict(value=10, varIdx=NO_VARIATION_INDEX)),
+        0,
+    )
+    precompiled = {"mixed": [mixedComponent], "noVar": [noVarComponent]}
+
+    def getRows():
+        return {
+            (glyphName, fieldName): (
+                None
+                if valueDict[VARIDX_KEY] == NO_VARIATION_INDEX
+                else store.VarData[valueDict[VARIDX_KEY] >> 16].Item[
+                    valueDict[VARIDX_KEY] & 0xFFFF
+                ]
+            )
+            for glyphName, (component,) in precompiled.items()
+            for valueDicts in [component.coord, component.transform]
+            for fieldName, valueDict in valueDicts.items()
+            if VARIDX_KEY in valueDict
+        }
+
+    rows = getRows()
+    # 4-byte entries for mixedComponent, because of NO_VARIATION_INDEX
+    assert calcVarIdxsSize(precompiled) == (1 + 4 * 4) + (1 + 4)
+
+    replaceNoVariationIndex(precompiled, store)
+    remapVarIdxs(precompiled, optimizeVarIdxOrder(precompiled, store))
+
+    # The coordinate and noVarComponent lose their varIdx, the transform
+    # field refers to a new all-zero row in the VarData with the fewest regions
+    assert VARIDX_KEY not in mixedComponent.coord["V001"]
+    assert VARIDX_KEY not in noVarComponent.transform["TranslateX"]
+    zeroVarIdx = mixedComponent.transform["Rotation"][VARIDX_KEY]
+    assert store.VarData[zeroVarIdx >> 16].Item[zeroVarIdx & 0xFFFF] == [0]
+    del rows["mixed", "V001"], rows["noVar", "TranslateX"]
+    rows["mixed", "Rotation"] = [0]
+    assert getRows() == rows
+    # 1-byte entries now
+    assert calcVarIdxsSize(precompiled) == (1 + 3) + 1
@@ -0,0 +1,278 @@
+import io
+import random
+import pytest
+from fontTools.misc import xmlReader
+from fontTools.pens.recordingPen import RecordingPen
+from fontTools.ttLib import TTFont, newTable, registerCustomTableClass
+from fontTools.ttLib.tables.otTables import NO_VARIATION_INDEX
+
+registerCustomTableClass("VarC", "rcjktools.table_VarC", "table_VarC")
+
+from rcjktools import compactVarC, ttxv  # noqa: E402
+from rcjktools.benchVarC import (  # noqa: E402
+    checkRoundTrip,
+    checkVarIdxsRoundTrip,
+    dumpVarCXML,
+    readVarCXML,
+)
+from rcjktools.compactVarC import (  # noqa: E402
+    CompactVarCGlyphs,
+    buildCompactVarCGlyph,
+)
+from rcjktools.synthVarC import buildSyntheticVarCFont  # noqa: E402
+from rcjktools.table_VarC import (  # noqa: E402
+    VARIDX_KEY,
+    VarCXMLReader,
+    packComponent,
+    packVarIdxs,
+    table_VarC,
+    unpackVarIdxs,
+)
+from rcjktools.ttVarCFont import TTVarCFont  # noqa: E402
+from rcjktools.varcStats import getVarCStats  # noqa: E402
+
+
+def reloadFont(ttFont):
+    f = io.BytesIO()
+    ttFont.save(f)
+    f.seek(0)
+    return TTFont(f)
+
+
+@pytest.mark.parametrize("transformVariationProbability", [0, 0.5, 1])
+@pytest.mark.parametrize("varIdxEntrySize", [1, 2, 3, 4])
+@pytest.mark.parametrize("numAxes", [8, 300])
+def test_roundTrip(numAxes, varIdxEntrySize, transformVariationProbability):
+    ttFont = reloadFont(
+        buildSyntheticVarCFont(
+            100,
+            numAxes=numAxes,
+            varIdxEntrySize=varIdxEntrySize,
+            transformVariationProbability=transformVariationProbability,
+        )
+    )
+    checkRoundTrip(ttFont)
+
+    stats = getVarCStats(ttFont)
+    assert sum(stats["bytes"].values()) == stats["size"]
+    # More than 128 axes need word-sized axis indices
+    assert ("word" in stats["axisIndexFormats"]) == (numAxes > 128)
+    if transformVariationProbability:
+        entrySizes = [int(k) for k in stats["varIdxEntrySizes"] if k != "none"]
+        assert max(entrySizes) == varIdxEntrySize
+
+
+@pytest.mark.parametrize(
+    "varIdxs, entrySize",
+    [
+        ([0x00000000], 1),
+        ([0x000000FF], 1),
+        ([0x00000100], 2),
+        ([0x00010001], 1),
+        ([0x00FF00FF], 2),
+        ([0x000F0FFF], 2),
+        ([0x00FF0FFF], 3),
+        ([0x0FFF0FFF], 3),
+        ([0xFFFF0FFF], 4),
+        ([0x00000001, 0xFFFF0000], 3),
+        ([NO_VARIATION_INDEX], 4),
+        ([0x00010002, NO_VARIATION_INDEX], 4),
+    ],
+)
+def test_packVarIdxs(varIdxs, entrySize):
+    data = packVarIdxs(varIdxs)
+    assert (data[0] >> 4) + 1 == entrySize
+    assert len(data) == 1 + entrySize * len(varIdxs)
+    assert unpackVarIdxs(data, 0, len(varIdxs)) == (varIdxs, len(data))
+
+
+@pytest.mark.parametrize("numAxes", [8, 300])
+def test_packComponent_fieldOrder(numAxes):
+    # The order of the coord and transform dicts doesn't matter
+    ttFont = buildSyntheticVarCFont(100, numAxes=numAxes)
+    axisTags = [axis.axisTag for axis in ttFont["fvar"].axes]
+    axisTagToIndex = {axisTag: i for i, axisTag in enumerate(axisTags)}
+    for components in ttFont["VarC"].GlyphData.values():
+        for component in components:
+            reversedComponent = component._replace(
+                coord=dict(reversed(component.coord.items())),
+                transform=dict(reversed(component.transform.items())),
+            )
+            assert packComponent(
+                reversedComponent, axisTags, axisTagToIndex
+            ) == packComponent(component, axisTags, axisTagToIndex)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_varIdxsRoundTrip(seed):
+    checkVarIdxsRoundTrip(random.Random(seed), numArrays=300)
+
+
+def setNoVariationIndex(ttFont, numGlyphs):
+    """Replace the coordinate varIdxs of the first numGlyphs glyphs that have
+    any with NO_VARIATION_INDEX, and return the names of these glyphs.
+    """
+    glyphNames = []
+    for glyphName, components in ttFont["VarC"].GlyphData.items():
+        changed = False
+        for component in components:
+            for valueDict in component.coord.values():
+                if VARIDX_KEY in valueDict:
+                    valueDict[VARIDX_KEY] = NO_VARIATION_INDEX
+                    changed = True
+        if changed:
+            glyphNames.append(glyphName)
+            if len(glyphNames) == numGlyphs:
+                break
+    return glyphNames
+
+
+def test_noVariationIndex_roundTrip():
+    ttFont = reloadFont(buildSyntheticVarCFont(200))
+    glyphNames = setNoVariationIndex(ttFont, 10)
+    assert glyphNames
+    checkRoundTrip(ttFont)
+
+
+def test_noVariationIndex_draw(tmp_path):
+    # Leave out the transforms, their outlines don't always fit in glyf
+    ttFont = buildSyntheticVarCFont(200, maxTransformFieldsPerComponent=0)
+    noVarPath = tmp_path / "noVar.ttf"
+    glyphNames = setNoVariationIndex(ttFont, 10)
+    ttFont.save(noVarPath)
+    # The same font without those varIdxs: they should draw the same
+    for glyphName in glyphNames:
+        for component in ttFont["VarC"].GlyphData[glyphName]:
+            for valueDict in component.coord.values():
+                if valueDict.get(VARIDX_KEY) == NO_VARIATION_INDEX:
+                    del valueDict[VARIDX_KEY]
+    expectedPath = tmp_path / "expected.ttf"
+    ttFont.save(expectedPath)
+
+    location = {"V000": 0.5, "V001": -0.3, "V002": 1}
+    with TTVarCFont(noVarPath) as noVarFont, TTVarCFont(expectedPath) as expFont:
+        for glyphName in glyphNames:
+            pen = RecordingPen()
+            noVarFont.drawGlyph(pen, glyphName, location)
+            expectedPen = RecordingPen()
+            expFont.drawGlyph(expectedPen, glyphName, location)
+            assert pen.value == expectedPen.value
+
+
+@pytest.mark.parametrize("transformVariationProbability", [0, 1])
+@pytest.mark.parametrize("varIdxEntrySize", [1, 3, 4])
+@pytest.mark.parametrize("numAxes", [8, 300])
+def test_compactVarCGlyphs_unpackAll(
+    numAxes, varIdxEntrySize, transformVariationProbability, monkeypatch
+):
+    if compactVarC.numpy is None:
+        pytest.skip("NumPy is not available")
+    ttFont = buildSyntheticVarCFont(
+        200,
+        numAxes=numAxes,
+        varIdxEntrySize=varIdxEntrySize,
+        transformVariationProbability=transformVariationProbability,
+    )
+    ttFont = reloadFont(ttFont)
+    assert setNoVariationIndex(ttFont, 10)
+    ttFont = reloadFont(ttFont)
+    glyfTable = ttFont["glyf"]
+    glyphData = ttFont["VarC"].GlyphData
+
+    # A decompiled glyph, and a glyph that was converted before unpackAll()
+    decompiledGlyphName, convertedGlyphName = list(glyphData)[:2]
+    glyphData[decompiledGlyphName]
+    compactGlyphs = CompactVarCGlyphs(ttFont)
+    compactGlyphs[convertedGlyphName]
+
+    builtGlyphs = []
+
+    def buildCompactVarCGlyphSpy(*args):
+        builtGlyphs.append(buildCompactVarCGlyph(*args))
+        return builtGlyphs[-1]
+
+    monkeypatch.setattr(compactVarC, "buildCompactVarCGlyph", buildCompactVarCGlyphSpy)
+    compactGlyphs.unpackAll()
+    # All other glyphs are unpacked straight from the binary data
+    assert len(builtGlyphs) == 1
+    for glyphName in glyphData:
+        compactGlyph = compactGlyphs[glyphName]
+        expectedGlyph = buildCompactVarCGlyph(
+            glyphData.peek(glyphName),
+            glyfTable[glyphName].components,
+            compactGlyphs._varDataOffsets,
+            compactGlyphs.numDeltas,
+        )
+        assert compactGlyph.glyphNames == expectedGlyph.glyphNames
+        assert compactGlyph.axisTags == expectedGlyph.axisTags
+        for fieldName in ["values", "deltaDivisors", "deltaIndices"]:
+            assert list(getattr(compactGlyph, fieldName)) == list(
+                getattr(expectedGlyph, fieldName)
+            )
+
+
+@pytest.mark.parametrize("readerClass", [xmlReader.XMLReader, VarCXMLReader])
+def test_fromXML(readerClass):
+    ttFont = buildSyntheticVarCFont(100, seed=1)
+    otherFont = buildSyntheticVarCFont(50, seed=2)
+    glyphData = dict(otherFont["VarC"].GlyphData)
+    xmlData = dumpVarCXML(otherFont["VarC"], otherFont)
+
+    assert readVarCXML(xmlData, ttFont, readerClass).GlyphData == glyphData
+
+    # An existing GlyphData is replaced, not merged into
+    varcTable = ttFont["VarC"] = newTable("VarC")
+    varcTable.GlyphData = {"bogus": []}
+    varcTable.fromXML("GlyphData", {}, [], ttFont)
+    assert varcTable.GlyphData == {}
+
+
+def test_getDumpGlyphNames_glyfComposite():
+    ttFont = buildSyntheticVarCFont(100)
+    glyfTable = ttFont["glyf"]
+    varcTable = ttFont["VarC"]
+    glyphData = varcTable.GlyphData
+    # A glyph with a nested VarC component, turned into a plain glyf composite
+    glyphName = next(
+        glyphName
+        for glyphName in glyphData
+        if any(c.glyphName in glyphData for c in glyfTable[glyphName].components)
+    )
+    del glyphData[glyphName]
+    expectedGlyphNames = set()
+    stack = [glyphName]
+    while stack:
+        componentNames = glyfTable[stack.pop()].getComponentNames(glyfTable)
+        stack.extend(name for name in componentNames if name in glyphData)
+        expectedGlyphNames.update(name for name in componentNames if name in glyphData)
+    assert expectedGlyphNames
+
+    varcTable.dumpGlyphNames = [glyphName]
+    assert varcTable.getDumpGlyphNames(ttFont) == sorted(expectedGlyphNames)
+    varcTable.dumpGlyphNames = None
+    cmap = {glyphName: uni for uni, glyphName in ttFont.getBestCmap().items()}
+    varcTable.dumpUnicodes = {cmap[glyphName]}
+    assert varcTable.getDumpGlyphNames(ttFont) == sorted(expectedGlyphNames)
+
+
+def test_ttxv(tmp_path):
+    fontPath = tmp_path / "test.ttf"
+    ttxPath = tmp_path / "test.ttx"
+    outPath = tmp_path / "test-out.ttf"
+    ttFont = buildSyntheticVarCFont(50)
+    ttFont.save(fontPath)
+    glyphName = sorted(ttFont["VarC"].GlyphData)[0]
+    for args in [
+        ["-o", ttxPath, "--glyphs", glyphName, fontPath],
+        ["-o", ttxPath, fontPath],
+        ["-o", outPath, ttxPath],
+    ]:
+        with pytest.raises(SystemExit) as e:
+            ttxv.main(["-q"] + [str(arg) for arg in args])
+        assert not e.value.code
+        if "--glyphs" in args:
+            assert ttxPath.read_text().count("<Glyph name=") < 50
+    # The options were set on the dumped table only, not globally
+    assert table_VarC.dumpGlyphNames is None
+    assert xmlReader.XMLReader is not VarCXMLReader
+    assert TTFont(fontPath).reader["VarC"] == TTFont(outPath).reader["VarC"]
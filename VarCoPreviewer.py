@@ -44,9 +44,14 @@ class VarCoPreviewer:
         # objects don't agree what's in obj.axes: user axes or all axes? Also:
         # does obj.drawGlyph() take a normalized location or not?
         if ext == ".designspace":
-            from rcjktools.varco import VarCoFont
-
-            self.varcoFont = VarCoFont(fontPath)
+            from rcjktools.varco import VarCoFont, getDefaultGlyphCachePath
+
+            # Only use the glyph cache when it was opted into, for example
+            # with buildvarc --glyph-cache
+            glyphCachePath = getDefaultGlyphCachePath(fontPath)
+            if not glyphCachePath.exists():
+                glyphCachePath = None
+            self.varcoFont = VarCoFont(fontPath, glyphCachePath=glyphCachePath)
             axisInfo = [
                 (axisTag, minValue, defaultValue, maxValue)
                 for axisTag, (
@@ -126,8 +131,13 @@ class VarCoPreviewer:
 
         self.w.dbView = DrawView((200, 0, -220, 0))  # The DrawBot PDF view
         self.w.characterGlyphList.setSelection([])
+        self.w.bind("close", self.windowCloseCallback)
         self.w.open()
 
+    def windowCloseCallback(self, sender):
+        if hasattr(self.varcoFont, "saveGlyphCache"):
+            self.varcoFont.saveGlyphCache()
+
     def findGlyphFieldCallback(self, sender):
         pat = sender.get().lower()
         if not pat:
@@ -14,11 +14,16 @@ setup(
     setup_requires=["setuptools_scm"],
     entry_points={
         "console_scripts": [
+            "benchvarc=rcjktools.benchVarC:main",
             "buildvarc=rcjktools.buildVarC:main",
+            "decomposevarc=rcjktools.decomposeVarC:main",
+            "instantiatevarc=rcjktools.instantiateVarC:main",
             "rcjk2ufo=rcjktools.project:rcjk2ufo",
             "rcjkproofer=rcjktools.proofer:main",
+            "rcjkserve=rcjktools.previewServer:main",
             "ttf2woff2=rcjktools.ttf2woff2:main",
             "ttxv=rcjktools.ttxv:main",
+            "varcstats=rcjktools.varcStats:main",
         ],
     },
 )